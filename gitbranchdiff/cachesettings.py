@@ -0,0 +1,11 @@
+import os, platform
+
+# where the diff cache lives, shared by the views and hooks/post-receive, which runs without Django
+GIT_DIFF_CACHE_DIR = "/var/tmp/django/gitbranchdiff"
+GIT_DIFF_CACHE_DB = "gitbranchdiff.sqlite" # inside GIT_DIFF_CACHE_DIR
+
+if platform.system() is "Windows":
+	GIT_DIFF_CACHE_DIR = "D:\\temp\\gitbranchdiff"
+
+def getCacheDbPath():
+	return os.path.join( GIT_DIFF_CACHE_DIR, GIT_DIFF_CACHE_DB )
@@ -0,0 +1,135 @@
+import os, bisect, hashlib
+import fileutil
+
+# first line of an index file: magic, version, entry count and md5 of the rest
+INDEX_MAGIC = "gitbranchdiff-index"
+INDEX_VERSION = 1
+
+class FirstParentIndex( object ):
+	"""The first-parent history of a tip, as (timestamp, commit) pairs newest first.
+
+	commitAt() answers 'rev-list <tip> --first-parent --until=<time> -n 1' with a
+	binary search. Committer times along a first-parent chain are not strictly
+	decreasing, so the search runs over their running minimum instead; it is
+	monotonic and still finds the first commit at or before the cutoff.
+
+	The index of an ancestor, from fromCommit(), shares the lists of the whole
+	chain and only keeps the offset it starts at.
+	"""
+	def __init__( self, entries ):
+		self.timestamps = [entry[0] for entry in entries]
+		self.commits = [entry[1] for entry in entries]
+		self.offset = 0
+		self.root = self
+		self.positions = None
+		self.firstTimestamp = None
+
+		# running minimum negated, so it is ascending for bisect
+		self.negMinTimestamps = []
+		minTimestamp = None
+		for timestamp in self.timestamps:
+			if minTimestamp is None or timestamp < minTimestamp:
+				minTimestamp = timestamp
+			self.negMinTimestamps.append( -minTimestamp )
+
+	def __len__( self ):
+		return len(self.commits) - self.offset
+
+	def getTip( self ):
+		if not len(self):
+			return ""
+		return self.commits[self.offset]
+
+	def getTimestamp( self ):
+		if not len(self):
+			return 0
+		return self.timestamps[self.offset]
+
+	def entries( self ):
+		return zip( self.timestamps[self.offset:], self.commits[self.offset:] )
+
+	def find( self, commit ):
+		"""Position of 'commit' in the first-parent chain, or -1."""
+		root = self.root
+		if root.positions is None:
+			root.positions = dict( [(root.commits[x], x) for x in range(len(root.commits) - 1, -1, -1)] )
+		position = root.positions.get( commit, -1 )
+		if position < self.offset:
+			return -1
+		return position - self.offset
+
+	def fromCommit( self, commit ):
+		"""The index of 'commit', a first-parent ancestor of the tip (or the tip itself)."""
+		position = self.find( commit )
+		if position == 0:
+			return self
+		if position < 0:
+			return None
+		view = FirstParentIndex( [] )
+		view.timestamps = self.timestamps
+		view.commits = self.commits
+		view.negMinTimestamps = self.negMinTimestamps
+		view.offset = self.offset + position
+		view.root = self.root
+		return view
+
+	def findAt( self, timestamp ):
+		"""Position in the shared lists of the first commit at or before 'timestamp', their length if there is none."""
+		x = self.offset
+		if x == 0 or timestamp < -self.negMinTimestamps[x - 1]:
+			# the commits before the offset are all newer, they leave the running minimum from x on as it is
+			return bisect.bisect_left( self.negMinTimestamps, -timestamp, x )
+		while x < len(self.commits) and self.timestamps[x] > timestamp:
+			x += 1
+		return x
+
+	def commitAt( self, timestamp ):
+		"""The newest first-parent commit at or before 'timestamp', or "" if there is none."""
+		x = self.findAt( timestamp )
+		if x >= len(self.commits):
+			return ""
+		return self.commits[x]
+
+	def getFirstTimestamp( self ):
+		"""The earliest time commitAt() finds a commit for, 0 if there are no commits."""
+		if not len(self):
+			return 0
+		if self.offset == 0:
+			return -self.negMinTimestamps[-1]
+		if self.firstTimestamp is None:
+			self.firstTimestamp = min( self.timestamps[self.offset:] )
+		return self.firstTimestamp
+
+	def entriesSince( self, timestamp ):
+		"""(timestamp, commit) of every commit newer than 'timestamp', and then commitAt( timestamp ) if there is one."""
+		x = self.findAt( timestamp )
+		return zip( self.timestamps[self.offset:x + 1], self.commits[self.offset:x + 1] )
+
+	def prepend( self, entries ):
+		"""Returns a new index for a tip that advanced by 'entries' (newest first)."""
+		return FirstParentIndex( list(entries) + self.entries() )
+
+	def write( self, path ):
+		body = "".join( ["%d %s\n" % (timestamp, commit) for timestamp, commit in self.entries()] )
+		header = "%s %d %d %s\n" % (INDEX_MAGIC, INDEX_VERSION, len(self.commits), hashlib.md5( body ).hexdigest())
+		fileutil.writeAtomic( path, header + body )
+
+	@staticmethod
+	def read( path ):
+		"""Loads an index written by write(), None if there is none or it does not check out."""
+		if not os.path.exists( path ):
+			return None
+		with open( path, 'rb' ) as f:
+			header = f.readline().split()
+			body = f.read()
+		if len(header) != 4 or header[0] != INDEX_MAGIC or header[1] != str(INDEX_VERSION) or hashlib.md5( body ).hexdigest() != header[3]:
+			return None
+
+		entries = []
+		for line in body.splitlines():
+			fields = line.split()
+			if len(fields) == 2:
+				entries.append( (int(fields[0]), fields[1]) )
+		if not entries or len(entries) != int(header[2]):
+			return None
+		return FirstParentIndex( entries )
@@ -0,0 +1,698 @@
+import os, threading, time, datetime, zlib
+import sqlite3
+from fileutil import FileLock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS treeDiffs (
+	baseTree TEXT NOT NULL,
+	compareTree TEXT NOT NULL,
+	options TEXT NOT NULL,
+	insertions INTEGER NOT NULL,
+	deletions INTEGER NOT NULL,
+	filesChanged INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL,
+	PRIMARY KEY (baseTree, compareTree, options)
+);
+CREATE TABLE IF NOT EXISTS blobDiffs (
+	newBlob TEXT NOT NULL,
+	oldBlob TEXT NOT NULL,
+	options TEXT NOT NULL,
+	insertions INTEGER NOT NULL,
+	deletions INTEGER NOT NULL,
+	binary INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL,
+	PRIMARY KEY (newBlob, oldBlob, options)
+);
+CREATE TABLE IF NOT EXISTS rawDiffs (
+	baseCommit TEXT NOT NULL,
+	compareCommit TEXT NOT NULL,
+	directories TEXT NOT NULL,
+	options TEXT NOT NULL,
+	entries BLOB NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL,
+	PRIMARY KEY (baseCommit, compareCommit, directories, options)
+);
+CREATE TABLE IF NOT EXISTS histories (
+	id INTEGER PRIMARY KEY,
+	baseCommit TEXT NOT NULL,
+	compareCommit TEXT NOT NULL,
+	directory TEXT NOT NULL,
+	options TEXT NOT NULL,
+	historyLen INTEGER NOT NULL,
+	timeDelta INTEGER NOT NULL,
+	numPoints INTEGER NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL DEFAULT 0,
+	UNIQUE (baseCommit, compareCommit, directory, options, historyLen, timeDelta)
+);
+CREATE TABLE IF NOT EXISTS historyPoints (
+	historyId INTEGER NOT NULL,
+	seq INTEGER NOT NULL,
+	date INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	baseCommit TEXT NOT NULL,
+	compareCommit TEXT NOT NULL,
+	PRIMARY KEY (historyId, seq)
+);
+CREATE TABLE IF NOT EXISTS timelines (
+	id INTEGER PRIMARY KEY,
+	baseBranch TEXT NOT NULL,
+	compareBranch TEXT NOT NULL,
+	directory TEXT NOT NULL,
+	options TEXT NOT NULL,
+	firstDate INTEGER NOT NULL,
+	lastDate INTEGER NOT NULL,
+	baseCommit TEXT NOT NULL,
+	compareCommit TEXT NOT NULL,
+	updated INTEGER NOT NULL,
+	UNIQUE (baseBranch, compareBranch, directory, options)
+);
+CREATE TABLE IF NOT EXISTS timelinePoints (
+	timelineId INTEGER NOT NULL,
+	date INTEGER NOT NULL,
+	month INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	baseCommit TEXT NOT NULL,
+	compareCommit TEXT NOT NULL,
+	PRIMARY KEY (timelineId, date)
+);
+CREATE TABLE IF NOT EXISTS pages (
+	key TEXT PRIMARY KEY,
+	contentType TEXT NOT NULL,
+	body BLOB NOT NULL,
+	created INTEGER NOT NULL,
+	accessed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS warmQueue (
+	id INTEGER PRIMARY KEY,
+	ref TEXT NOT NULL,
+	oldCommit TEXT NOT NULL,
+	newCommit TEXT NOT NULL,
+	queued INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+	kind TEXT PRIMARY KEY,
+	hits INTEGER NOT NULL,
+	misses INTEGER NOT NULL
+);
+"""
+
+# run after SCHEMA, for tables created by older versions
+MIGRATIONS = [
+	("histories", "accessed", "ALTER TABLE histories ADD COLUMN accessed INTEGER NOT NULL DEFAULT 0"),
+]
+
+# tables of older versions, nothing reads them any more
+DROPPED_TABLES = ("diffs",)
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS treeDiffsAccessed ON treeDiffs (accessed);
+CREATE INDEX IF NOT EXISTS blobDiffsAccessed ON blobDiffs (accessed);
+CREATE INDEX IF NOT EXISTS rawDiffsAccessed ON rawDiffs (accessed);
+CREATE INDEX IF NOT EXISTS historiesAccessed ON histories (accessed);
+CREATE INDEX IF NOT EXISTS pagesAccessed ON pages (accessed);
+"""
+
+KINDS = ("diffs", "blobs", "rawDiffs", "histories", "pages") # diffs are stored in treeDiffs, blobs in blobDiffs
+COMMIT_KINDS = ("rawDiffs", "histories") # entries keyed by a base and a compare commit
+
+# keeps each IN (...) list well under SQLite's limit of 999 bound parameters
+MAX_QUERY_PARAMETERS = 500
+
+def chunks(items, size=MAX_QUERY_PARAMETERS):
+	for x in range(0, len(items), size):
+		yield items[x:x + size]
+
+RAW_ENTRY_FIELDS = 7
+
+def encodeRawEntries(entries):
+	"""(oldMode, newMode, oldBlob, newBlob, status, oldPath, path) entries as one compressed NUL-separated string."""
+	fields = []
+	for entry in entries:
+		fields.extend( [field or "" for field in entry] )
+	return zlib.compress( "\0".join( fields ) )
+
+def decodeRawEntries(data):
+	data = zlib.decompress( data )
+	if not data:
+		return []
+	fields = data.split( "\0" )
+	entries = []
+	for x in range(0, len(fields), RAW_ENTRY_FIELDS):
+		entry = fields[x:x + RAW_ENTRY_FIELDS]
+		entry[5] = entry[5] or None
+		entries.append( tuple(entry) )
+	return entries
+
+def getTimeDeltaSeconds(timeDelta):
+	return timeDelta.days * 86400 + timeDelta.seconds
+
+class DiffStore( object ):
+	"""Diff, blob diff, raw diff and history results, branch timelines and rendered pages, in a single SQLite database.
+
+	Each thread gets its own connection, SQLite serializes writers between the
+	threads and processes sharing the file.
+	"""
+	def __init__( self, path ):
+		self.path = path
+		self.local = threading.local()
+
+		# access times and lookup counts are gathered in memory and written by flush()
+		self.pendingLock = threading.Lock()
+		self.pendingAccess = dict( [(kind, {}) for kind in KINDS] )
+		self.pendingLookups = dict( [(kind, [0, 0]) for kind in KINDS] )
+		self.touchedDays = {}
+
+	def connect( self ):
+		connection = getattr( self.local, 'connection', None )
+		if connection is None:
+			directory = os.path.dirname( self.path )
+			if directory and not os.path.exists( directory ):
+				os.makedirs( directory )
+			connection = sqlite3.connect( self.path, timeout=60 )
+			# one connection at a time sets up the database, DDL racing another
+			# connection fails with 'database schema has changed'
+			with FileLock( self.path + ".lock" ):
+				try:
+					connection.execute( "PRAGMA journal_mode=WAL" )
+				except sqlite3.DatabaseError:
+					pass # older SQLite, keep the rollback journal
+				connection.execute( "PRAGMA synchronous=NORMAL" )
+				for statement in SCHEMA.split( ";" ):
+					if statement.strip():
+						connection.execute( statement )
+				for table, column, statement in MIGRATIONS:
+					columns = [row[1] for row in connection.execute( "PRAGMA table_info(%s)" % table )]
+					if column not in columns:
+						connection.execute( statement )
+						if column == "accessed":
+							connection.execute( "UPDATE %s SET accessed = created" % table )
+				for table in DROPPED_TABLES:
+					connection.execute( "DROP TABLE IF EXISTS %s" % table )
+				for statement in INDEXES.split( ";" ):
+					if statement.strip():
+						connection.execute( statement )
+				connection.commit()
+			self.local.connection = connection
+		return connection
+
+	def close( self ):
+		connection = getattr( self.local, 'connection', None )
+		if connection is not None:
+			connection.close()
+			self.local.connection = None
+
+	# ------------------- Diffs ----------------------------------------------------------------------------------
+	def getTreeDiffs( self, treePairs, options ):
+		"""Every cached diff of the (baseTree, compareTree) pairs in 'treePairs'.
+
+		Returns a dictionary keyed by (baseTree, compareTree) of (insertions, deletions, filesChanged).
+		"""
+		connection = self.connect()
+		wanted = set( treePairs )
+		baseTrees = list( set( [pair[0] for pair in wanted] ) )
+		compareTrees = list( set( [pair[1] for pair in wanted] ) )
+		diffs = {}
+		for baseChunk in chunks( baseTrees, MAX_QUERY_PARAMETERS // 2 ):
+			for compareChunk in chunks( compareTrees, MAX_QUERY_PARAMETERS // 2 ):
+				query = ( "SELECT baseTree, compareTree, insertions, deletions, filesChanged FROM treeDiffs "
+						"WHERE options = ? AND baseTree IN (%s) AND compareTree IN (%s)" % (",".join( "?" * len(baseChunk) ), ",".join( "?" * len(compareChunk) )) )
+				for baseTree, compareTree, insertions, deletions, filesChanged in connection.execute( query, [options] + baseChunk + compareChunk ):
+					pair = (str(baseTree), str(compareTree))
+					if pair in wanted:
+						self.touch( "diffs", pair + (options,) )
+						diffs[pair] = (insertions, deletions, filesChanged)
+		return diffs
+
+	def putTreeDiffs( self, treeDiffs, options ):
+		"""Writes all of the (baseTree, compareTree, insertions, deletions, filesChanged) 'treeDiffs' in one transaction."""
+		if not treeDiffs:
+			return
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.executemany( "INSERT OR REPLACE INTO treeDiffs (baseTree, compareTree, options, insertions, deletions, filesChanged, created, accessed) "
+									"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+									[(baseTree, compareTree, options, insertions, deletions, filesChanged, now, now)
+									for baseTree, compareTree, insertions, deletions, filesChanged in treeDiffs] )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Blob Diffs ----------------------------------------------------------------------------------
+	def getBlobDiffs( self, blobPairs, options ):
+		"""The cached line counts of the (oldBlob, newBlob) pairs in 'blobPairs'.
+
+		Returns a dictionary keyed by (oldBlob, newBlob) of (insertions, deletions, binary).
+		"""
+		connection = self.connect()
+		wanted = set( blobPairs )
+		diffs = {}
+		for newChunk in chunks( list( set( [pair[1] for pair in wanted] ) ) ):
+			query = ( "SELECT oldBlob, newBlob, insertions, deletions, binary FROM blobDiffs "
+					"WHERE options = ? AND newBlob IN (%s)" % ",".join( "?" * len(newChunk) ) )
+			for oldBlob, newBlob, insertions, deletions, binary in connection.execute( query, [options] + newChunk ):
+				pair = (str(oldBlob), str(newBlob))
+				if pair in wanted:
+					self.touch( "blobs", pair + (options,) )
+					diffs[pair] = (insertions, deletions, bool(binary))
+		return diffs
+
+	def putBlobDiffs( self, blobDiffs, options ):
+		"""Writes all of the (oldBlob, newBlob, insertions, deletions, binary) 'blobDiffs' in one transaction."""
+		if not blobDiffs:
+			return
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.executemany( "INSERT OR REPLACE INTO blobDiffs (newBlob, oldBlob, options, insertions, deletions, binary, created, accessed) "
+									"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+									[(newBlob, oldBlob, options, insertions, deletions, int(binary), now, now)
+									for oldBlob, newBlob, insertions, deletions, binary in blobDiffs] )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Raw Diffs ----------------------------------------------------------------------------------
+	def getRawDiffs( self, commitPairs, directories, options ):
+		"""The cached raw diff entries of any of the (baseCommit, compareCommit) pairs in 'commitPairs'.
+
+		Returns a dictionary keyed by (baseCommit, compareCommit) of lists of entries.
+		"""
+		connection = self.connect()
+		directories = "\t".join( directories )
+		wanted = set( commitPairs )
+		rawDiffs = {}
+		for compareChunk in chunks( list( set( [pair[1] for pair in wanted] ) ) ):
+			query = ( "SELECT baseCommit, compareCommit, entries FROM rawDiffs "
+					"WHERE directories = ? AND options = ? AND compareCommit IN (%s)" % ",".join( "?" * len(compareChunk) ) )
+			for baseCommit, compareCommit, entries in connection.execute( query, [directories, options] + compareChunk ):
+				pair = (str(baseCommit), str(compareCommit))
+				if pair in wanted:
+					self.touch( "rawDiffs", pair + (directories, options) )
+					rawDiffs[pair] = decodeRawEntries( str(entries) )
+		return rawDiffs
+
+	def putRawDiff( self, entries, baseCommit, compareCommit, directories, options ):
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.execute( "INSERT OR REPLACE INTO rawDiffs (baseCommit, compareCommit, directories, options, entries, created, accessed) "
+								"VALUES (?, ?, ?, ?, ?, ?, ?)",
+								(baseCommit, compareCommit, "\t".join( directories ), options, sqlite3.Binary( encodeRawEntries( entries ) ), now, now) )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Histories ----------------------------------------------------------------------------------
+	def getHistories( self, baseCommit, compareCommits, directories, options, historyLen, timeDelta ):
+		"""Every cached history of 'baseCommit' against 'compareCommits' in one query.
+
+		Returns a dictionary keyed by (compareCommit, directory) of lists of points.
+		"""
+		connection = self.connect()
+		histories = {}
+		for compareChunk in chunks( list(compareCommits) ):
+			query = ( "SELECT h.compareCommit, h.directory, h.numPoints, p.date, p.total, p.baseCommit, p.compareCommit "
+					"FROM histories h JOIN historyPoints p ON p.historyId = h.id "
+					"WHERE h.baseCommit = ? AND h.options = ? AND h.historyLen = ? AND h.timeDelta = ? AND h.compareCommit IN (%s) "
+					"ORDER BY h.id, p.seq" % ",".join( "?" * len(compareChunk) ) )
+			parameters = [baseCommit, options, historyLen, getTimeDeltaSeconds( timeDelta )] + compareChunk
+			numPoints = {}
+			for compareCommit, directory, count, date, total, pointBaseCommit, pointCompareCommit in connection.execute( query, parameters ):
+				directory = str(directory)
+				if directory not in directories:
+					continue
+				key = (str(compareCommit), directory)
+				numPoints[key] = count
+				histories.setdefault( key, [] ).append( { 'total': total, 'date': datetime.date.fromordinal( date ),
+														'baseCommit': str(pointBaseCommit), 'compareCommit': str(pointCompareCommit),
+														'directory': directory } )
+			for key, count in numPoints.items():
+				if len(histories[key]) != count:
+					del histories[key]
+				else:
+					self.touch( "histories", (baseCommit, key[0], key[1], options, historyLen, getTimeDeltaSeconds( timeDelta )) )
+		return histories
+
+	def getHistory( self, baseCommit, compareCommit, directory, options, historyLen, timeDelta ):
+		return self.getHistories( baseCommit, [compareCommit], [directory], options, historyLen, timeDelta ).get( (compareCommit, directory), [] )
+
+	def putHistory( self, diffList, baseCommit, compareCommit, directory, options, historyLen, timeDelta ):
+		"""Writes a history and its points in one transaction."""
+		connection = self.connect()
+		try:
+			connection.execute( "DELETE FROM historyPoints WHERE historyId IN (SELECT id FROM histories WHERE baseCommit = ? AND compareCommit = ? "
+								"AND directory = ? AND options = ? AND historyLen = ? AND timeDelta = ?)",
+								(baseCommit, compareCommit, directory, options, historyLen, getTimeDeltaSeconds( timeDelta )) )
+			now = int( time.time() )
+			cursor = connection.execute( "INSERT OR REPLACE INTO histories (baseCommit, compareCommit, directory, options, historyLen, timeDelta, numPoints, created, accessed) "
+										"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+										(baseCommit, compareCommit, directory, options, historyLen, getTimeDeltaSeconds( timeDelta ),
+										len(diffList), now, now) )
+			historyId = cursor.lastrowid
+			connection.executemany( "INSERT INTO historyPoints VALUES (?, ?, ?, ?, ?, ?)",
+									[(historyId, x, diffList[x]['date'].toordinal(), diffList[x]['total'],
+									diffList[x]['baseCommit'], diffList[x]['compareCommit']) for x in range(len(diffList))] )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Timelines ----------------------------------------------------------------------------------
+	def getTimelines( self, baseBranch, compareBranches, directories, options ):
+		"""The stored timelines of 'baseBranch' against 'compareBranches' in one query.
+
+		Returns a dictionary keyed by (compareBranch, directory) of dictionaries with the timeline's
+		'id', the 'firstDate' and 'lastDate' it covers, the 'baseCommit' and 'compareCommit' tips it was brought up to
+		and when its points last changed, 'updated'.
+		"""
+		connection = self.connect()
+		timelines = {}
+		for compareChunk in chunks( list(compareBranches) ):
+			query = ( "SELECT id, compareBranch, directory, firstDate, lastDate, baseCommit, compareCommit, updated FROM timelines "
+					"WHERE baseBranch = ? AND options = ? AND compareBranch IN (%s)" % ",".join( "?" * len(compareChunk) ) )
+			for id, compareBranch, directory, firstDate, lastDate, baseCommit, compareCommit, updated in connection.execute( query, [baseBranch, options] + compareChunk ):
+				directory = str(directory)
+				if directory in directories:
+					timelines[ (str(compareBranch), directory) ] = { 'id': id, 'firstDate': datetime.date.fromordinal( firstDate ),
+																	'lastDate': datetime.date.fromordinal( lastDate ),
+																	'baseCommit': str(baseCommit), 'compareCommit': str(compareCommit),
+																	'updated': updated }
+		return timelines
+
+	def getTimelinePoints( self, timelineIds, fromDate ):
+		"""The points of the timelines from 'fromDate' on, and the last one before it, newest first.
+
+		Returns a dictionary keyed by timeline id of lists of points.
+		"""
+		connection = self.connect()
+		points = {}
+		for idChunk in chunks( list(timelineIds) ):
+			query = ( "SELECT timelineId, date, total, baseCommit, compareCommit FROM timelinePoints p "
+					"WHERE timelineId IN (%s) AND date >= (SELECT COALESCE(MAX(date), 0) FROM timelinePoints "
+					"WHERE timelineId = p.timelineId AND date <= ?) ORDER BY timelineId, date DESC" % ",".join( "?" * len(idChunk) ) )
+			for timelineId, date, total, baseCommit, compareCommit in connection.execute( query, idChunk + [fromDate.toordinal()] ):
+				points.setdefault( timelineId, [] ).append( { 'total': total, 'date': datetime.date.fromordinal( date ),
+															'baseCommit': str(baseCommit), 'compareCommit': str(compareCommit) } )
+		return points
+
+	def putTimelinePoints( self, points, baseBranch, compareBranch, directory, options, firstDate, lastDate, baseCommit, compareCommit ):
+		"""Adds or replaces 'points' in a timeline, which now covers firstDate to lastDate for the tips baseCommit and compareCommit."""
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.execute( "INSERT OR IGNORE INTO timelines (baseBranch, compareBranch, directory, options, firstDate, lastDate, baseCommit, compareCommit, updated) "
+								"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+								(baseBranch, compareBranch, directory, options, firstDate.toordinal(), lastDate.toordinal(), baseCommit, compareCommit, now) )
+			connection.execute( "UPDATE timelines SET firstDate = ?, lastDate = ?, baseCommit = ?, compareCommit = ?, updated = ? "
+								"WHERE baseBranch = ? AND compareBranch = ? AND directory = ? AND options = ?",
+								(firstDate.toordinal(), lastDate.toordinal(), baseCommit, compareCommit, now, baseBranch, compareBranch, directory, options) )
+			timelineId = connection.execute( "SELECT id FROM timelines WHERE baseBranch = ? AND compareBranch = ? AND directory = ? AND options = ?",
+											(baseBranch, compareBranch, directory, options) ).fetchone()[0]
+			connection.executemany( "INSERT OR REPLACE INTO timelinePoints VALUES (?, ?, ?, ?, ?, ?)",
+									[(timelineId, point['date'].toordinal(), point['date'].year * 12 + point['date'].month - 1, point['total'],
+									point['baseCommit'], point['compareCommit']) for point in points] )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	def _deleteTimelines( self, connection, where, parameters ):
+		connection.execute( "DELETE FROM timelinePoints WHERE timelineId IN (SELECT id FROM timelines WHERE %s)" % where, parameters )
+		return connection.execute( "DELETE FROM timelines WHERE %s" % where, parameters ).rowcount
+
+	def deleteTimeline( self, timelineId ):
+		connection = self.connect()
+		try:
+			self._deleteTimelines( connection, "id = ?", (timelineId,) )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	def rollupTimelines( self, weeklyBefore, monthlyBefore ):
+		"""Keeps only the last point of each week before 'weeklyBefore' and of each month before 'monthlyBefore'.
+
+		A timeline carries a point forward to the next one, so the last point of a week
+		is what the week ends with. The timelines that lost points are marked updated.
+		Returns the number of points deleted.
+		"""
+		# date ordinal 1 is a Monday, so (date - 1) / 7 numbers the weeks
+		rollups = ((weeklyBefore, "(later.date - 1) / 7 = (timelinePoints.date - 1) / 7"), (monthlyBefore, "later.month = timelinePoints.month"))
+		now = int( time.time() )
+		connection = self.connect()
+		deleted = 0
+		try:
+			for before, samePeriod in rollups:
+				where = ( "date < ? AND EXISTS (SELECT 1 FROM timelinePoints later WHERE later.timelineId = timelinePoints.timelineId "
+						"AND later.date > timelinePoints.date AND later.date < ? AND %s)" % samePeriod )
+				# 'updated' always moves on, even within the second the timeline was last written
+				connection.execute( "UPDATE timelines SET updated = MAX(updated + 1, ?) WHERE id IN (SELECT timelineId FROM timelinePoints WHERE %s)" % where,
+									(now, before.toordinal(), before.toordinal()) )
+				deleted += connection.execute( "DELETE FROM timelinePoints WHERE %s" % where, (before.toordinal(), before.toordinal()) ).rowcount
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+		return deleted
+
+	# ------------------- Pages ----------------------------------------------------------------------------------
+	def getPage( self, key ):
+		"""(contentType, body) of a rendered page or fragment, None if it is not cached."""
+		row = self.connect().execute( "SELECT contentType, body FROM pages WHERE key = ?", (key,) ).fetchone()
+		if row is None:
+			return None
+		self.touch( "pages", (key,) )
+		return (str(row[0]), str(row[1]))
+
+	def putPage( self, key, contentType, body ):
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.execute( "INSERT OR REPLACE INTO pages (key, contentType, body, created, accessed) VALUES (?, ?, ?, ?, ?)",
+								(key, contentType, sqlite3.Binary( body ), now, now) )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Warm Queue ----------------------------------------------------------------------------------
+	def queueRefs( self, updates ):
+		"""Queues (oldCommit, newCommit, ref) updates, as a post-receive hook reads them, for the cache warmer."""
+		if not updates:
+			return
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.executemany( "INSERT INTO warmQueue (ref, oldCommit, newCommit, queued) VALUES (?, ?, ?, ?)",
+									[(ref, oldCommit, newCommit, now) for oldCommit, newCommit, ref in updates] )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	def takeQueuedRefs( self ):
+		"""Removes and returns every queued (oldCommit, newCommit, ref), oldest first."""
+		connection = self.connect()
+		try:
+			# take the write lock first, so two warmers never take the same rows
+			connection.execute( "BEGIN IMMEDIATE" )
+			rows = connection.execute( "SELECT id, oldCommit, newCommit, ref FROM warmQueue ORDER BY id" ).fetchall()
+			if rows:
+				connection.execute( "DELETE FROM warmQueue WHERE id <= ?", (rows[-1][0],) )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+		return [(str(oldCommit), str(newCommit), str(ref)) for id, oldCommit, newCommit, ref in rows]
+
+	# ------------------- Access Tracking ----------------------------------------------------------------------------------
+	def touch( self, kind, key ):
+		"""Marks an entry of 'kind' as used today, for the least recently used eviction in collect().
+
+		key is the entry's primary key: (baseTree, compareTree, options) for diffs, (oldBlob, newBlob, options)
+		for blobs, (baseCommit, compareCommit, tab-joined directories, options) for rawDiffs,
+		(baseCommit, compareCommit, directory, options) plus (historyLen, timeDelta seconds) for histories,
+		and (key,) for pages.
+		"""
+		today = int( time.time() ) // 86400
+		self.pendingLock.acquire()
+		try:
+			if self.touchedDays.get( (kind, key) ) != today:
+				self.touchedDays[ (kind, key) ] = today
+				self.pendingAccess[kind][key] = None
+		finally:
+			self.pendingLock.release()
+
+	def countLookups( self, kind, hits, misses ):
+		self.pendingLock.acquire()
+		try:
+			counts = self.pendingLookups[kind]
+			counts[0] += hits
+			counts[1] += misses
+		finally:
+			self.pendingLock.release()
+
+	def flush( self ):
+		"""Writes the gathered access times and lookup counts in one transaction."""
+		self.pendingLock.acquire()
+		try:
+			pendingAccess = self.pendingAccess
+			pendingLookups = self.pendingLookups
+			self.pendingAccess = dict( [(kind, {}) for kind in KINDS] )
+			self.pendingLookups = dict( [(kind, [0, 0]) for kind in KINDS] )
+			if len(self.touchedDays) > 100000:
+				self.touchedDays = {}
+		finally:
+			self.pendingLock.release()
+
+		now = int( time.time() )
+		connection = self.connect()
+		try:
+			connection.executemany( "UPDATE treeDiffs SET accessed = ? WHERE baseTree = ? AND compareTree = ? AND options = ?",
+									[(now,) + key for key in pendingAccess["diffs"]] )
+			connection.executemany( "UPDATE blobDiffs SET accessed = ? WHERE oldBlob = ? AND newBlob = ? AND options = ?",
+									[(now,) + key for key in pendingAccess["blobs"]] )
+			connection.executemany( "UPDATE rawDiffs SET accessed = ? WHERE baseCommit = ? AND compareCommit = ? AND directories = ? AND options = ?",
+									[(now,) + key for key in pendingAccess["rawDiffs"]] )
+			connection.executemany( "UPDATE histories SET accessed = ? WHERE baseCommit = ? AND compareCommit = ? AND directory = ? AND options = ? "
+									"AND historyLen = ? AND timeDelta = ?",
+									[(now,) + key for key in pendingAccess["histories"]] )
+			connection.executemany( "UPDATE pages SET accessed = ? WHERE key = ?",
+									[(now,) + key for key in pendingAccess["pages"]] )
+			for kind, counts in pendingLookups.items():
+				if counts[0] or counts[1]:
+					connection.execute( "INSERT OR IGNORE INTO stats VALUES (?, 0, 0)", (kind,) )
+					connection.execute( "UPDATE stats SET hits = hits + ?, misses = misses + ? WHERE kind = ?", (counts[0], counts[1], kind) )
+			connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+	# ------------------- Garbage Collection ----------------------------------------------------------------------------------
+	def getUsedBytes( self ):
+		connection = self.connect()
+		pageSize = connection.execute( "PRAGMA page_size" ).fetchone()[0]
+		pageCount = connection.execute( "PRAGMA page_count" ).fetchone()[0]
+		freePages = connection.execute( "PRAGMA freelist_count" ).fetchone()[0]
+		return (pageCount - freePages) * pageSize
+
+	def _deleteHistories( self, connection, where, parameters ):
+		connection.execute( "DELETE FROM historyPoints WHERE historyId IN (SELECT id FROM histories WHERE %s)" % where, parameters )
+		return connection.execute( "DELETE FROM histories WHERE %s" % where, parameters ).rowcount
+
+	def _deleteRowIds( self, connection, table, rowIds ):
+		deleted = 0
+		for rowIdChunk in chunks( rowIds ):
+			where = "rowid IN (%s)" % ",".join( "?" * len(rowIdChunk) )
+			if table == "histories":
+				deleted += self._deleteHistories( connection, where, rowIdChunk )
+			else:
+				deleted += connection.execute( "DELETE FROM %s WHERE %s" % (table, where), rowIdChunk ).rowcount
+		return deleted
+
+	def collect( self, maxBytes=None, maxAge=None, reachable=None, vacuum=False, batchSize=1000, branches=None ):
+		"""Deletes entries from the store.
+
+		maxAge: seconds, entries not used for longer are deleted.
+		reachable: a set of commits, raw diffs and histories comparing any other commit are deleted.
+		branches: timelines comparing any other branch are deleted, timelines are never collected otherwise.
+		maxBytes: afterwards the least recently used entries go until the store's used pages fit.
+		vacuum: gives the freed pages back to the filesystem.
+
+		Returns the number of entries deleted for each kind and reason.
+		"""
+		self.flush()
+		connection = self.connect()
+		deleted = {}
+		try:
+			if maxAge is not None:
+				cutoff = int( time.time() ) - maxAge
+				deleted['diffs expired'] = connection.execute( "DELETE FROM treeDiffs WHERE accessed < ?", (cutoff,) ).rowcount
+				deleted['blobs expired'] = connection.execute( "DELETE FROM blobDiffs WHERE accessed < ?", (cutoff,) ).rowcount
+				deleted['rawDiffs expired'] = connection.execute( "DELETE FROM rawDiffs WHERE accessed < ?", (cutoff,) ).rowcount
+				deleted['histories expired'] = self._deleteHistories( connection, "accessed < ?", (cutoff,) )
+				deleted['pages expired'] = connection.execute( "DELETE FROM pages WHERE accessed < ?", (cutoff,) ).rowcount
+				connection.commit()
+
+			if reachable is not None:
+				for kind in COMMIT_KINDS:
+					rowIds = [row[0] for row in connection.execute( "SELECT rowid, baseCommit, compareCommit FROM %s" % kind )
+								if row[1] not in reachable or row[2] not in reachable]
+					deleted[kind + ' unreachable'] = self._deleteRowIds( connection, kind, rowIds )
+				connection.commit()
+
+			if branches is not None:
+				branches = list(branches)
+				where = "baseBranch NOT IN (%s) OR compareBranch NOT IN (%s)" % (",".join( "?" * len(branches) ), ",".join( "?" * len(branches) ))
+				deleted['timelines of other branches'] = self._deleteTimelines( connection, where, branches + branches )
+				connection.commit()
+
+			if maxBytes is not None:
+				deleted['diffs evicted'] = 0
+				deleted['blobs evicted'] = 0
+				deleted['rawDiffs evicted'] = 0
+				deleted['histories evicted'] = 0
+				deleted['pages evicted'] = 0
+				accessed = "SELECT accessed FROM treeDiffs UNION ALL SELECT accessed FROM blobDiffs UNION ALL SELECT accessed FROM rawDiffs UNION ALL SELECT accessed FROM histories UNION ALL SELECT accessed FROM pages"
+				while self.getUsedBytes() > maxBytes:
+					# the batchSize least recently used entries of any kind
+					row = connection.execute( "SELECT accessed FROM (%s) ORDER BY accessed LIMIT 1 OFFSET ?" % accessed, (batchSize - 1,) ).fetchone()
+					if row is None:
+						row = connection.execute( "SELECT MAX(accessed) FROM (%s)" % accessed ).fetchone()
+						if row is None or row[0] is None:
+							break
+					cutoff = row[0]
+					deleted['diffs evicted'] += connection.execute( "DELETE FROM treeDiffs WHERE accessed <= ?", (cutoff,) ).rowcount
+					deleted['blobs evicted'] += connection.execute( "DELETE FROM blobDiffs WHERE accessed <= ?", (cutoff,) ).rowcount
+					deleted['rawDiffs evicted'] += connection.execute( "DELETE FROM rawDiffs WHERE accessed <= ?", (cutoff,) ).rowcount
+					deleted['histories evicted'] += self._deleteHistories( connection, "accessed <= ?", (cutoff,) )
+					deleted['pages evicted'] += connection.execute( "DELETE FROM pages WHERE accessed <= ?", (cutoff,) ).rowcount
+					connection.commit()
+		except:
+			connection.rollback()
+			raise
+
+		if vacuum:
+			connection.execute( "VACUUM" )
+		return deleted
+
+	def getStats( self ):
+		"""Entry counts, approximate bytes and lookup hit ratio for each kind."""
+		self.flush()
+		connection = self.connect()
+		stats = {}
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseTree) + LENGTH(compareTree) + LENGTH(options) + 40) FROM treeDiffs" ).fetchone()
+		stats["diffs"] = { 'entries': row[0], 'bytes': row[1] or 0 }
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(oldBlob) + LENGTH(newBlob) + LENGTH(options) + 48) FROM blobDiffs" ).fetchone()
+		stats["blobs"] = { 'entries': row[0], 'bytes': row[1] or 0 }
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseCommit) + LENGTH(compareCommit) + LENGTH(directories) + LENGTH(options) + LENGTH(entries) + 16) FROM rawDiffs" ).fetchone()
+		stats["rawDiffs"] = { 'entries': row[0], 'bytes': row[1] or 0 }
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseCommit) + LENGTH(compareCommit) + LENGTH(directory) + LENGTH(options) + 56) FROM histories" ).fetchone()
+		points = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseCommit) + LENGTH(compareCommit) + 32) FROM historyPoints" ).fetchone()
+		stats["histories"] = { 'entries': row[0], 'bytes': (row[1] or 0) + (points[1] or 0), 'points': points[0] }
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(key) + LENGTH(contentType) + LENGTH(body) + 16) FROM pages" ).fetchone()
+		stats["pages"] = { 'entries': row[0], 'bytes': row[1] or 0 }
+		row = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseBranch) + LENGTH(compareBranch) + LENGTH(directory) + LENGTH(options) + 128) FROM timelines" ).fetchone()
+		points = connection.execute( "SELECT COUNT(*), SUM(LENGTH(baseCommit) + LENGTH(compareCommit) + 40) FROM timelinePoints" ).fetchone()
+		stats["timelines"] = { 'entries': row[0], 'bytes': (row[1] or 0) + (points[1] or 0), 'points': points[0] }
+
+		for kind in KINDS:
+			stats[kind]['hits'] = 0
+			stats[kind]['misses'] = 0
+		for kind, hits, misses in connection.execute( "SELECT kind, hits, misses FROM stats" ):
+			if kind in stats:
+				stats[kind]['hits'] = hits
+				stats[kind]['misses'] = misses
+		for kind in KINDS:
+			lookups = stats[kind]['hits'] + stats[kind]['misses']
+			stats[kind]['hitRatio'] = float( stats[kind]['hits'] ) / lookups if lookups else 0.0
+		stats['usedBytes'] = self.getUsedBytes()
+		return stats
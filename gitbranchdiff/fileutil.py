@@ -0,0 +1,86 @@
+import os, tempfile
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+class FileLock( object ):
+	"""An exclusive lock on a file, held across processes and threads.
+
+	Every acquire() opens its own handle, so two threads of one process exclude
+	each other just like two processes do.
+
+		with FileLock( path ):
+			...
+	"""
+	def __init__( self, path ):
+		self.path = path
+		self.f = None
+
+	def acquire( self ):
+		directory = os.path.dirname( self.path )
+		if directory and not os.path.exists( directory ):
+			try:
+				os.makedirs( directory )
+			except OSError:
+				pass # made by someone else in the meantime
+		self.f = open( self.path, 'a+' )
+		if fcntl:
+			fcntl.flock( self.f.fileno(), fcntl.LOCK_EX )
+		else:
+			while True:
+				try:
+					# blocks for about 10 seconds before raising
+					msvcrt.locking( self.f.fileno(), msvcrt.LK_LOCK, 1 )
+					break
+				except IOError:
+					pass
+		# lets collection tell abandoned lock files from ones in use
+		os.utime( self.path, None )
+
+	def release( self ):
+		if self.f is None:
+			return
+		try:
+			if fcntl:
+				fcntl.flock( self.f.fileno(), fcntl.LOCK_UN )
+			else:
+				self.f.seek( 0 )
+				msvcrt.locking( self.f.fileno(), msvcrt.LK_UNLCK, 1 )
+		finally:
+			self.f.close()
+			self.f = None
+
+	def __enter__( self ):
+		self.acquire()
+		return self
+
+	def __exit__( self, excType, excValue, traceback ):
+		self.release()
+		return False
+
+def writeAtomic( path, data ):
+	"""Replaces the file at 'path' with 'data', readers see either the old or the new file.
+
+	The data goes to a temporary file next to 'path' which is renamed over it.
+	"""
+	directory = os.path.dirname( path ) or "."
+	fd, tempPath = tempfile.mkstemp( dir=directory, prefix=".tmp-" )
+	try:
+		f = os.fdopen( fd, 'wb' )
+		try:
+			f.write( data )
+			f.flush()
+			os.fsync( f.fileno() )
+		finally:
+			f.close()
+		if os.name == "nt" and os.path.exists( path ):
+			# rename does not replace on Windows
+			os.remove( path )
+		os.rename( tempPath, path )
+	except:
+		if os.path.exists( tempPath ):
+			os.remove( tempPath )
+		raise
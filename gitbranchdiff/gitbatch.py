@@ -0,0 +1,239 @@
+import subprocess, threading, atexit
+
+# ------------------- Fork Statistics ----------------------------------------------------------------------------------
+class ForkStats( object ):
+	"""Counts the git processes one request forked and the lookups a batch process served instead of a fork.
+
+	A request starts its own with startForkStats(), the counts of its thread and of the
+	work it hands to other threads through carryForkStats() go to it.
+	"""
+	def __init__( self ):
+		self.lock = threading.Lock()
+		self.forks = 0
+		self.saved = 0
+
+	def addFork( self ):
+		self.lock.acquire()
+		try:
+			self.forks += 1
+		finally:
+			self.lock.release()
+
+	def addSaved( self ):
+		self.lock.acquire()
+		try:
+			self.saved += 1
+		finally:
+			self.lock.release()
+
+forkStatsLocal = threading.local()
+
+def startForkStats():
+	"""Starts counting for the request on the calling thread, returns its ForkStats."""
+	stats = ForkStats()
+	forkStatsLocal.stats = stats
+	return stats
+
+def getForkStats():
+	return getattr( forkStatsLocal, 'stats', None )
+
+def addFork():
+	stats = getForkStats()
+	if stats is not None:
+		stats.addFork()
+
+def addSaved():
+	stats = getForkStats()
+	if stats is not None:
+		stats.addSaved()
+
+def carryForkStats( func ):
+	"""func wrapped to count into the calling thread's ForkStats, wherever it runs."""
+	stats = getForkStats()
+	def run( *args ):
+		previous = getForkStats()
+		forkStatsLocal.stats = stats
+		try:
+			return func( *args )
+		finally:
+			forkStatsLocal.stats = previous
+	return run
+
+# ------------------- Batch Processes ----------------------------------------------------------------------------------
+# names written before reading the answers, small enough that neither pipe fills up
+BATCH_NAMES = 256
+
+class GitBatchProcess( object ):
+	"""A long-lived 'git cat-file --batch' or '--batch-check' process.
+
+	Requests are written one per line to stdin and answered in order on stdout, so
+	a lock serializes the request/response pairs between threads. The process is
+	started on first use and restarted once if it has gone away.
+	"""
+	def __init__( self, repoDir, mode ):
+		self.repoDir = repoDir
+		self.mode = mode
+		self.process = None
+		self.lock = threading.Lock()
+
+	def start( self ):
+		self.process = subprocess.Popen( ["git", "cat-file", self.mode], cwd=self.repoDir,
+											stdin=subprocess.PIPE, stdout=subprocess.PIPE )
+		addFork()
+
+	def close( self ):
+		if self.process:
+			try:
+				self.process.stdin.close()
+				self.process.wait()
+			except (IOError, OSError):
+				pass
+			self.process = None
+
+	def request( self, name ):
+		"""Returns (sha, type, size, content) for 'name', or None if it is missing.
+
+		content is only read in '--batch' mode, otherwise it is None.
+		"""
+		if not name or "\n" in name:
+			return None
+
+		self.lock.acquire()
+		try:
+			try:
+				return self._request( name )
+			except (IOError, OSError, ValueError):
+				# the process died underneath us, start a fresh one and retry once
+				self.close()
+				return self._request( name )
+		finally:
+			self.lock.release()
+
+	def requestMany( self, names ):
+		"""request() for every name in 'names', written to the process in batches of BATCH_NAMES."""
+		results = []
+		self.lock.acquire()
+		try:
+			for x in range(0, len(names), BATCH_NAMES):
+				batch = names[x:x + BATCH_NAMES]
+				try:
+					results.extend( self._requestMany( batch ) )
+				except (IOError, OSError, ValueError):
+					self.close()
+					results.extend( self._requestMany( batch ) )
+		finally:
+			self.lock.release()
+		return results
+
+	def _requestMany( self, names ):
+		valid = [name for name in names if name and "\n" not in name]
+		if valid:
+			self._write( "".join( [name + "\n" for name in valid] ) )
+		results = []
+		for name in names:
+			if name and "\n" not in name:
+				results.append( self._read() )
+			else:
+				results.append( None )
+		return results
+
+	def _request( self, name ):
+		self._write( name + "\n" )
+		return self._read()
+
+	def _write( self, data ):
+		if not self.process or self.process.poll() is not None:
+			self.start()
+
+		self.process.stdin.write( data )
+		self.process.stdin.flush()
+
+	def _read( self ):
+		header = self.process.stdout.readline()
+		if not header:
+			raise IOError( "git cat-file %s exited" % self.mode )
+
+		fields = header.split()
+		if len(fields) != 3:
+			# "<name> missing" or "<name> ambiguous"
+			return None
+
+		sha, objectType, size = fields[0], fields[1], int(fields[2])
+		content = None
+		if self.mode == "--batch":
+			content = self.process.stdout.read( size )
+			self.process.stdout.read( 1 ) # trailing newline
+		return ( sha, objectType, size, content )
+
+class GitBatch( object ):
+	"""Object and rev lookups served by persistent cat-file processes.
+
+	revParse() and getCommit() answer what a rev-parse or log fork would, each answer counts as a saved fork.
+	"""
+	def __init__( self, repoDir ):
+		self.check = GitBatchProcess( repoDir, "--batch-check" )
+		self.batch = GitBatchProcess( repoDir, "--batch" )
+		atexit.register( self.close )
+
+	def close( self ):
+		self.check.close()
+		self.batch.close()
+
+	def revParse( self, rev ):
+		"""Returns the object id 'rev' resolves to, or "" if it does not exist."""
+		result = self.check.request( rev )
+		if not result:
+			return ""
+		addSaved()
+		return result[0]
+
+	def revParseMany( self, revs ):
+		"""revParse() for every rev in 'revs', in one round trip per batch."""
+		shas = []
+		for result in self.check.requestMany( list(revs) ):
+			if not result:
+				shas.append( "" )
+			else:
+				shas.append( result[0] )
+		return shas
+
+	def getCommit( self, rev ):
+		"""Returns the parsed commit object for 'rev' as a dictionary, or None.
+
+		Keys are 'sha', 'tree', 'parents', 'author', 'committer', 'timestamp'
+		(committer time) and 'message'.
+		"""
+		result = self.batch.request( rev )
+		if not result or result[1] != "commit":
+			return None
+		addSaved()
+		return parseCommit( result[0], result[3] )
+
+def parseCommit( sha, content ):
+	commit = { 'sha': sha, 'tree': "", 'parents': [], 'author': "", 'committer': "", 'timestamp': 0, 'message': "" }
+
+	headers, sep, message = content.partition( "\n\n" )
+	commit['message'] = message
+	for line in headers.split( "\n" ):
+		key, sep, value = line.partition( " " )
+		if key == "tree":
+			commit['tree'] = value
+		elif key == "parent":
+			commit['parents'].append( value )
+		elif key == "author":
+			commit['author'] = value
+		elif key == "committer":
+			commit['committer'] = value
+			# "Name <email> 1234567890 +0000"
+			fields = value.rsplit( " ", 2 )
+			if len(fields) == 3:
+				try:
+					commit['timestamp'] = int( fields[1] )
+				except ValueError:
+					pass
+	return commit
+
+def commitSubject( commit ):
+	"""The subject as '--pretty=oneline' prints it: the first paragraph on one line."""
+	paragraph = commit['message'].lstrip( "\n" ).split( "\n\n" )[0]
+	return " ".join( [line.strip() for line in paragraph.strip().split( "\n" )] )
@@ -26,8 +26,11 @@ Google Visualization API.
 
 __author__ = "Amit Weinstein, Misha Seltzer"
 
+import array
 import cgi
 import datetime
+import heapq
+import sys
 import types
 
 
@@ -128,7 +131,17 @@ class DataTable(object):
                           or did not use the supported formats.
     """
     self.__columns = self.TableDescriptionParser(table_description)
-    self.__data = []
+    # The column lookup and one value encoder per column are built once with
+    # the parsed description, instead of for every output call and cell.
+    self.__col_dict = dict([(col["id"], col) for col in self.__columns])
+    self.__encoders = dict([(col["id"], self._CompileValueEncoder(col["type"]))
+                            for col in self.__columns])
+    # The data is kept by column, see _AppendRow().
+    self.__column_ids = []
+    for col in self.__columns:
+      if col["id"] not in self.__column_ids:
+        self.__column_ids.append(col["id"])
+    self.__ClearData()
     if data:
       self.LoadData(data)
 
@@ -233,6 +246,62 @@ class DataTable(object):
     # supported types.
     raise DataTableException("Unsupported type %s" % value_type)
 
+  @staticmethod
+  def _CompileValueEncoder(value_type):
+    """Returns a function of one value equivalent to SingleValueToJS(value, value_type).
+
+    Internal helper method.
+
+    Values of the usual exact Python type for value_type are converted
+    directly. Anything else (None, (value, formatted value) tuples, subclasses
+    and values of the wrong type) goes through SingleValueToJS, so the output
+    and the exceptions raised are the same.
+
+    Args:
+      value_type: One of the types accepted by SingleValueToJS.
+
+    Returns:
+      A function taking a value and returning its JS format.
+    """
+    single_value_to_js = DataTable.SingleValueToJS
+
+    if value_type == "number":
+      def EncodeNumber(value):
+        value_class = type(value)
+        if value_class is int or value_class is float or value_class is long:
+          return str(value)
+        return single_value_to_js(value, value_type)
+      return EncodeNumber
+
+    if value_type == "string":
+      def EncodeString(value):
+        if type(value) is str:
+          return repr(value)
+        return single_value_to_js(value, value_type)
+      return EncodeString
+
+    if value_type == "date":
+      date_class = datetime.date
+      def EncodeDate(value):
+        if type(value) is date_class:
+          return "new Date(%d,%d,%d)" % (value.year, value.month - 1, value.day)
+        return single_value_to_js(value, value_type)
+      return EncodeDate
+
+    if value_type == "datetime":
+      datetime_class = datetime.datetime
+      def EncodeDateTime(value):
+        if type(value) is datetime_class:
+          return "new Date(%d,%d,%d,%d,%d,%d)" % (value.year, value.month - 1,
+                                                  value.day, value.hour,
+                                                  value.minute, value.second)
+        return single_value_to_js(value, value_type)
+      return EncodeDateTime
+
+    def Encode(value):
+      return single_value_to_js(value, value_type)
+    return Encode
+
   @staticmethod
   def ColumnTypeParser(description):
     """Parses a single column description. Internal helper method.
@@ -408,13 +477,84 @@ class DataTable(object):
 
   def NumberOfRows(self):
     """Returns the number of rows in the current data stored in the table."""
-    return len(self.__data)
+    return self.__num_rows
 
   def LoadData(self, data):
     """Loads new data to the data table, clearing existing data."""
-    self.__data = []
+    self.__ClearData()
     self.AppendData(data)
 
+  # Marks a missing cell in an array column. An int equal to it is stored by
+  # turning the column into a list.
+  _MISSING_INT = -sys.maxint - 1
+
+  def __ClearData(self):
+    # Number columns start as a compact array of C longs, every other column
+    # is a list. A column turns into a list when it gets a value that is not an
+    # int: a float, a long, a (value, formatted value) tuple and so on.
+    self.__values = {}
+    for col in self.__columns:
+      if col["type"] == "number":
+        self.__values[col["id"]] = array.array("l")
+      else:
+        self.__values[col["id"]] = []
+    self.__num_rows = 0
+    # (sort keys, limit) -> row indexes, see _PreparedData()
+    self.__sorted_rows = {}
+
+  def _AppendRows(self, rows):
+    """Appends rows given as dictionaries from column id to value.
+
+    A missing key and a None value are the same, an empty cell.
+    """
+    if not rows:
+      return
+    missing_int = self._MISSING_INT
+    for col_id in self.__column_ids:
+      new_values = [row.get(col_id) for row in rows]
+      values = self.__values[col_id]
+      if type(values) is not list:
+        if (not [v for v in new_values if type(v) is not int and v is not None]
+            and missing_int not in new_values):
+          values.fromlist([v is None and missing_int or v for v in new_values])
+          continue
+        values = [self._ArrayValue(v) for v in values]
+        self.__values[col_id] = values
+      values.extend(new_values)
+    self.__num_rows += len(rows)
+    self.__sorted_rows = {}
+
+  @staticmethod
+  def _ArrayValue(value):
+    if value == DataTable._MISSING_INT:
+      return None
+    return value
+
+  def _ColumnValues(self, col_id):
+    """Returns (values, is_array) of a column, indexed by row.
+
+    In an array column _MISSING_INT is an empty cell, in a list column None
+    is. A column id that is not in the table reads as a column of empty cells.
+    """
+    values = self.__values.get(col_id)
+    if values is None:
+      return [None] * self.__num_rows, False
+    return values, type(values) is not list
+
+  def _Rows(self, order_by=()):
+    """Yields the rows sorted by order_by, as dictionaries from column id to
+    value without the empty cells."""
+    columns = [(col_id,) + self._ColumnValues(col_id)
+               for col_id in self.__column_ids]
+    missing_int = self._MISSING_INT
+    for i in self._PreparedData(order_by):
+      row = {}
+      for col_id, values, is_array in columns:
+        value = values[i]
+        if value is not None and not (is_array and value == missing_int):
+          row[col_id] = value
+      yield row
+
   def AppendData(self, data):
     """Appends new data to the table.
 
@@ -433,14 +573,28 @@ class DataTable(object):
     # If the maximal depth is 0, we simply iterate over the data table
     # lines and insert them using _InnerAppendData. Otherwise, we simply
     # let the _InnerAppendData handle all the levels.
-    if not self.__columns[-1]["depth"]:
-      for line in data:
-        self._InnerAppendData({}, line, 0)
-    else:
-      self._InnerAppendData({}, data, 0)
+    # The rows are gathered and stored column by column at the end, the rows
+    # before a line that does not match the description are still stored.
+    rows = []
+    try:
+      if not self.__columns[-1]["depth"]:
+        if self.__columns[0]["container"] == "dict":
+          # Flat dictionaries are rows as they are, only read by column id
+          for line in data:
+            if not isinstance(line, dict):
+              raise DataTableException("Expected dictionary at current level, "
+                                       "got %s" % type(line))
+            rows.append(line)
+        else:
+          for line in data:
+            self._InnerAppendData({}, line, 0, rows)
+      else:
+        self._InnerAppendData({}, data, 0, rows)
+    finally:
+      self._AppendRows(rows)
 
-  def _InnerAppendData(self, prev_col_values, data, col_index):
-    """Inner function to assist LoadData."""
+  def _InnerAppendData(self, prev_col_values, data, col_index, rows):
+    """Inner function to assist LoadData, appends the rows to 'rows'."""
     # We first check that col_index has not exceeded the columns size
     if col_index >= len(self.__columns):
       raise DataTableException("The data does not match description, too deep")
@@ -448,7 +602,7 @@ class DataTable(object):
     # Dealing with the scalar case, the data is the last value.
     if self.__columns[col_index]["container"] == "scalar":
       prev_col_values[self.__columns[col_index]["id"]] = data
-      self.__data.append(prev_col_values)
+      rows.append(prev_col_values)
       return
 
     if self.__columns[col_index]["container"] == "iter":
@@ -462,7 +616,7 @@ class DataTable(object):
           raise DataTableException("Too many elements given in data")
         prev_col_values[self.__columns[col_index]["id"]] = value
         col_index += 1
-      self.__data.append(prev_col_values)
+      rows.append(prev_col_values)
       return
 
     # We know the current level is a dictionary, we verify the type.
@@ -475,21 +629,21 @@ class DataTable(object):
       for col in self.__columns[col_index:]:
         if col["id"] in data:
           prev_col_values[col["id"]] = data[col["id"]]
-      self.__data.append(prev_col_values)
+      rows.append(prev_col_values)
       return
 
     # We have a dictionary in an inner depth level.
     if not data.keys():
       # In case this is an empty dictionary, we add a record with the columns
       # filled only until this point.
-      self.__data.append(prev_col_values)
+      rows.append(prev_col_values)
     else:
       for key in sorted(data):
         col_values = dict(prev_col_values)
         col_values[self.__columns[col_index]["id"]] = key
-        self._InnerAppendData(col_values, data[key], col_index + 1)
+        self._InnerAppendData(col_values, data[key], col_index + 1, rows)
 
-  def _PreparedData(self, order_by=()):
+  def _PreparedData(self, order_by=(), limit=None):
     """Prepares the data for enumeration - sorting it by order_by.
 
     Args:
@@ -500,15 +654,21 @@ class DataTable(object):
                 ("string_col_name", "asc|desc") -- For a single key.
                 [("col_1","asc|desc"), ("col_2","asc|desc")] -- For more than
                     one column, an array of tuples of (col_name, "asc|desc").
+      limit: Optional. Only the first 'limit' rows of the order are returned.
+             When all the keys sort in the same direction they are picked
+             without sorting the whole table.
 
     Returns:
-      The data sorted by the keys given.
+      The indexes of the rows, in the order of the keys given. The order is
+      cached until the data changes, it must not be modified.
 
     Raises:
       DataTableException: Sort direction not in 'asc' or 'desc'
     """
     if not order_by:
-      return self.__data
+      if limit is None:
+        return xrange(self.__num_rows)
+      return xrange(min(limit, self.__num_rows))
 
     proper_sort_keys = []
     if isinstance(order_by, types.StringTypes) or (
@@ -525,17 +685,75 @@ class DataTable(object):
         raise DataTableException("Expected tuple with second value: "
                                  "'asc' or 'desc'")
 
+    # A whole order serves every limit, it is dropped by _AppendRows().
+    sort_keys = tuple(proper_sort_keys)
+    rows = self.__sorted_rows.get((sort_keys, None))
+    if rows is not None:
+      if limit is not None:
+        return rows[:limit]
+      return rows
+    rows = self.__sorted_rows.get((sort_keys, limit))
+    if rows is None:
+      rows = self._SortRows(proper_sort_keys, limit)
+      self.__sorted_rows[(sort_keys, limit)] = rows
+    return rows
+
+  def _SortRows(self, sort_keys, limit=None):
+    """Returns the row indexes sorted by (column id, 1 or -1) sort_keys.
+
+    A run of keys in the same direction sorts in one pass on a key tuple, runs
+    sort last to first in stable passes. This is the order a cmp function
+    comparing the keys one after the other gives, ties keep the order the rows
+    were added in.
+    """
+    passes = []
+    for key, asc_mult in sort_keys:
+      values, is_array = self._ColumnValues(key)
+      if is_array and self._MISSING_INT in values:
+        # Empty cells sort as None, before everything else
+        values = [self._ArrayValue(value) for value in values]
+      if passes and passes[-1][0] == asc_mult:
+        passes[-1][1].append(values)
+      else:
+        passes.append((asc_mult, [values]))
+
+    def KeyFunc(columns):
+      if len(columns) == 1:
+        return columns[0].__getitem__
+      return zip(*columns).__getitem__
+
     def SortCmpFunc(row1, row2):
       """cmp function for sorted. Compares by keys and 'asc'/'desc' keywords."""
-      for key, asc_mult in proper_sort_keys:
-        cmp_result = asc_mult * cmp(row1.get(key), row2.get(key))
-        if cmp_result:
-          return cmp_result
+      for asc_mult, columns in passes:
+        for values in columns:
+          cmp_result = asc_mult * cmp(values[row1], values[row2])
+          if cmp_result:
+            return cmp_result
       return 0
 
-    return sorted(self.__data, cmp=SortCmpFunc)
-
-  def ToJSCode(self, name, columns_order=None, order_by=()):
+    try:
+      if limit is not None and len(passes) == 1:
+        # The top rows only, nsmallest and nlargest are stable like sorted().
+        asc_mult, columns = passes[0]
+        if asc_mult > 0:
+          return heapq.nsmallest(limit, xrange(self.__num_rows),
+                                 key=KeyFunc(columns))
+        return heapq.nlargest(limit, xrange(self.__num_rows),
+                              key=KeyFunc(columns))
+
+      rows = range(self.__num_rows)
+      for asc_mult, columns in reversed(passes):
+        rows.sort(key=KeyFunc(columns), reverse=asc_mult < 0)
+    except TypeError:
+      # The passes compare a later key across all rows, a column holding
+      # values that do not compare (a datetime in a date column) only fails
+      # where the keys before it tie.
+      rows = sorted(xrange(self.__num_rows), cmp=SortCmpFunc)
+    if limit is not None:
+      return rows[:limit]
+    return rows
+
+  def ToJSCode(self, name, columns_order=None, order_by=(), limit=None):
     """Writes the data table as a JS code string.
 
     This method writes a string of JS code that can be run to
@@ -552,6 +770,7 @@ class DataTable(object):
                      if you use it.
       order_by: Optional. Specifies the name of the column(s) to sort by.
                 Passed as is to _PreparedData.
+      limit: Optional. Writes only the first 'limit' rows of the order.
 
     Returns:
       A string of JS code that, when run, generates a DataTable with the given
@@ -575,7 +794,7 @@ class DataTable(object):
     """
     if columns_order is None:
       columns_order = [col["id"] for col in self.__columns]
-    col_dict = dict([(col["id"], col) for col in self.__columns])
+    col_dict = self.__col_dict
 
     # We first create the table with the given name
     jscode = "var %s = new google.visualization.DataTable();\n" % name
@@ -586,15 +805,21 @@ class DataTable(object):
                                                        col_dict[col]["type"],
                                                        col_dict[col]["label"],
                                                        col_dict[col]["id"])
-    jscode += "%s.addRows(%d);\n" % (name, len(self.__data))
+    rows = self._PreparedData(order_by, limit)
+    jscode += "%s.addRows(%d);\n" % (name, len(rows))
+
+    columns = [self._ColumnValues(col) for col in columns_order]
+    missing_int = self._MISSING_INT
 
     # We now go over the data and add each row
-    for (i, row) in enumerate(self._PreparedData(order_by)):
+    for (i, row) in enumerate(rows):
       # We add all the elements of this row by their order
       for (j, col) in enumerate(columns_order):
-        if col not in row or row[col] is None:
+        values, is_array = columns[j]
+        value = values[row]
+        if value is None or (is_array and value == missing_int):
           continue
-        value = self.SingleValueToJS(row[col], col_dict[col]["type"])
+        value = self.__encoders[col](value)
         if isinstance(value, tuple):
           # We have a formatted value as well
           jscode += ("%s.setCell(%d, %d, %s, %s);\n" %
@@ -603,7 +828,7 @@ class DataTable(object):
           jscode += "%s.setCell(%d, %d, %s);\n" % (name, i, j, value)
     return jscode
 
-  def ToHtml(self, columns_order=None, order_by=()):
+  def ToHtml(self, columns_order=None, order_by=(), limit=None):
     """Writes the data table as an HTML table code string.
 
     Args:
@@ -614,6 +839,7 @@ class DataTable(object):
                      if you use it.
       order_by: Optional. Specifies the name of the column(s) to sort by.
                 Passed as is to _PreparedData.
+      limit: Optional. Writes only the first 'limit' rows of the order.
 
     Returns:
       An HTML table code string.
@@ -629,43 +855,56 @@ class DataTable(object):
     Raises:
       DataTableException: The data does not match the type.
     """
-    table_template = "<html><body><table border='1'>%s</table></body></html>"
-    columns_template = "<thead><tr>%s</tr></thead>"
-    rows_template = "<tbody>%s</tbody>"
+    return "".join(self.IterHtml(columns_order, order_by, limit))
+
+  def IterHtml(self, columns_order=None, order_by=(), limit=None):
+    """Writes the data table as an HTML table code string, one row at a time.
+
+    Args and the concatenated output are the same as for ToHtml().
+
+    Yields:
+      The opening tags and header row, then each table row, then the closing
+      tags. The sort and any DataTableException happen while iterating.
+    """
     row_template = "<tr>%s</tr>"
     header_cell_template = "<th>%s</th>"
     cell_template = "<td>%s</td>"
 
     if columns_order is None:
       columns_order = [col["id"] for col in self.__columns]
-    col_dict = dict([(col["id"], col) for col in self.__columns])
+    col_dict = self.__col_dict
 
     columns_list = []
     for col in columns_order:
       columns_list.append(header_cell_template % col_dict[col]["label"])
-    columns_html = columns_template % "".join(columns_list)
+    yield ("<html><body><table border='1'><thead><tr>%s</tr></thead><tbody>" %
+           "".join(columns_list))
+
+    columns = [(self.__encoders[col],) + self._ColumnValues(col)
+               for col in columns_order]
+    missing_int = self._MISSING_INT
 
-    rows_list = []
     # We now go over the data and add each row
-    for row in self._PreparedData(order_by):
+    for row in self._PreparedData(order_by, limit):
       cells_list = []
       # We add all the elements of this row by their order
-      for col in columns_order:
+      for encoder, values, is_array in columns:
         # For empty string we want empty quotes ("").
-        value = ""
-        if col in row and row[col] is not None:
-          value = self.SingleValueToJS(row[col], col_dict[col]["type"])
+        value = values[row]
+        if value is None or (is_array and value == missing_int):
+          value = ""
+        else:
+          value = encoder(value)
         if isinstance(value, tuple):
           # We have a formatted value and we're going to use it
           cells_list.append(cell_template % cgi.escape(value[1]))
         else:
           cells_list.append(cell_template % cgi.escape(value))
-      rows_list.append(row_template % "".join(cells_list))
-    rows_html = rows_template % "".join(rows_list)
+      yield row_template % "".join(cells_list)
 
-    return table_template % (columns_html + rows_html)
+    yield "</tbody></table></body></html>"
 
-  def ToCsv(self, columns_order=None, order_by=()):
+  def ToCsv(self, columns_order=None, order_by=(), limit=None):
     """Writes the data table as a CSV string.
 
     Args:
@@ -676,6 +915,7 @@ class DataTable(object):
                      if you use it.
       order_by: Optional. Specifies the name of the column(s) to sort by.
                 Passed as is to _PreparedData.
+      limit: Optional. Writes only the first 'limit' rows of the order.
 
     Returns:
       A CSV string representing the table.
@@ -687,42 +927,57 @@ class DataTable(object):
     Raises:
       DataTableException: The data does not match the type.
     """
+    return "".join(self.IterCsv(columns_order, order_by, limit))
+
+  def IterCsv(self, columns_order=None, order_by=(), limit=None):
+    """Writes the data table as a CSV string, one line at a time.
+
+    Args and the concatenated output are the same as for ToCsv().
+
+    Yields:
+      The header line, then each row with the newline before it. The sort and
+      any DataTableException happen while iterating.
+    """
     if columns_order is None:
       columns_order = [col["id"] for col in self.__columns]
-    col_dict = dict([(col["id"], col) for col in self.__columns])
+    col_dict = self.__col_dict
 
     columns_list = []
     for col in columns_order:
       columns_list.append(DataTable._EscapeValue(col_dict[col]["label"]))
-    columns_line = ", ".join(columns_list)
+    yield ", ".join(columns_list) + "\n"
+
+    columns = [(self.__encoders[col],
+                col_dict[col]["type"] in ["date", "datetime", "timeofday"]) +
+               self._ColumnValues(col) for col in columns_order]
+    missing_int = self._MISSING_INT
 
-    rows_list = []
     # We now go over the data and add each row
-    for row in self._PreparedData(order_by):
+    separator = ""
+    for row in self._PreparedData(order_by, limit):
       cells_list = []
       # We add all the elements of this row by their order
-      for col in columns_order:
-        value = "''"
-        if col in row and row[col] is not None:
-          value = self.SingleValueToJS(row[col], col_dict[col]["type"])
+      for encoder, is_time, values, is_array in columns:
+        value = values[row]
+        if value is None or (is_array and value == missing_int):
+          value = "''"
+        else:
+          value = encoder(value)
         if isinstance(value, tuple):
           # We have a formatted value. Using it only for date/time types.
-          if col_dict[col]["type"] in ["date", "datetime", "timeofday"]:
+          if is_time:
             cells_list.append(value[1])
           else:
             cells_list.append(value[0])
         else:
           # We need to quote date types, because they contain commas.
-          if (col_dict[col]["type"] in ["date", "datetime", "timeofday"] and
-              value != "''"):
+          if is_time and value != "''":
             value = "'%s'" % value
           cells_list.append(value)
-      rows_list.append(", ".join(cells_list))
-    rows = "\n".join(rows_list)
-
-    return "%s\n%s" % (columns_line, rows)
+      yield separator + ", ".join(cells_list)
+      separator = "\n"
 
-  def ToJSon(self, columns_order=None, order_by=()):
+  def ToJSon(self, columns_order=None, order_by=(), limit=None):
     """Writes a JSON string that can be used in a JS DataTable constructor.
 
     This method writes a JSON string that can be passed directly into a Google
@@ -745,6 +1000,7 @@ class DataTable(object):
                      if you use it.
       order_by: Optional. Specifies the name of the column(s) to sort by.
                 Passed as is to _PreparedData().
+      limit: Optional. Writes only the first 'limit' rows of the order.
 
     Returns:
       A JSon constructor string to generate a JS DataTable with the data
@@ -758,39 +1014,56 @@ class DataTable(object):
     Raises:
       DataTableException: The data does not match the type.
     """
+    return "".join(self.IterJSon(columns_order, order_by, limit))
+
+  def IterJSon(self, columns_order=None, order_by=(), limit=None):
+    """Writes the JSON string of ToJSon() one row at a time.
+
+    Args and the concatenated output are the same as for ToJSon().
+
+    Yields:
+      The columns, then each row with the comma before it, then the closing
+      brackets. The sort and any DataTableException happen while iterating.
+    """
     if columns_order is None:
       columns_order = [col["id"] for col in self.__columns]
-    col_dict = dict([(col["id"], col) for col in self.__columns])
+    col_dict = self.__col_dict
 
     # Creating the columns jsons
     cols_jsons = ["{id:'%(id)s',label:'%(label)s',type:'%(type)s'}" %
                   col_dict[col_id] for col_id in columns_order]
+    yield "{cols: [%s],rows: [" % ",".join(cols_jsons)
+
+    # The encoder of each output column, whether an empty cell in it is written
+    # as {v:null} (only in the last column) or omitted, and its values.
+    columns = [(self.__encoders[col], col == columns_order[-1]) +
+               self._ColumnValues(col) for col in columns_order]
+    missing_int = self._MISSING_INT
 
     # Creating the rows jsons
-    rows_jsons = []
-    for row in self._PreparedData(order_by):
+    separator = ""
+    for row in self._PreparedData(order_by, limit):
       cells_jsons = []
-      for col in columns_order:
+      for encoder, is_last, values, is_array in columns:
         # We omit the {v:null} for a None value of the not last column
-        value = row.get(col, None)
-        if value is None and col != columns_order[-1]:
-          cells_jsons.append("")
+        value = values[row]
+        if value is None or (is_array and value == missing_int):
+          cells_jsons.append(is_last and "{v:null}" or "")
         else:
-          value = self.SingleValueToJS(value, col_dict[col]["type"])
+          value = encoder(value)
           if isinstance(value, tuple):
             # We have a formatted value as well
             cells_jsons.append("{v:%s,f:%s}" % value)
           else:
             cells_jsons.append("{v:%s}" % value)
-      rows_jsons.append("{c:[%s]}" % ",".join(cells_jsons))
+      yield "%s{c:[%s]}" % (separator, ",".join(cells_jsons))
+      separator = ","
 
-    # We now join the columns jsons and the rows jsons
-    json = "{cols: [%s],rows: [%s]}" % (",".join(cols_jsons),
-                                        ",".join(rows_jsons))
-    return json
+    yield "]}"
 
   def ToJSonResponse(self, columns_order=None, order_by=(), req_id=0,
-                     response_handler="google.visualization.Query.setResponse"):
+                     response_handler="google.visualization.Query.setResponse",
+                     limit=None):
     """Writes a table as a JSON response that can be returned as-is to a client.
 
     This method writes a JSON response to return to a client in response to a
@@ -804,6 +1077,7 @@ class DataTable(object):
       req_id: Optional. The response id, as retrieved by the request.
       response_handler: Optional. The response handler, as retrieved by the
           request.
+      limit: Optional. Passed straight to self.ToJSon().
 
     Returns:
       A JSON response string to be received by JS the visualization Query
@@ -817,11 +1091,27 @@ class DataTable(object):
     Note: The URL returning this string can be used as a data source by Google
           Visualization Gadgets or from JS code.
     """
-    table = self.ToJSon(columns_order, order_by)
-    return ("%s({'version':'0.5', 'reqId':'%s', 'status':'OK', "
-            "'table': %s});") % (response_handler, req_id, table)
+    return "".join(self.IterJSonResponse(columns_order, order_by, req_id,
+                                         response_handler, limit))
+
+  def IterJSonResponse(self, columns_order=None, order_by=(), req_id=0,
+                       response_handler="google.visualization.Query.setResponse",
+                       limit=None):
+    """Writes the response of ToJSonResponse() one row at a time.
+
+    Args and the concatenated output are the same as for ToJSonResponse().
+
+    Yields:
+      The response handler call, the chunks of IterJSon(), and the closing
+      parenthesis.
+    """
+    yield ("%s({'version':'0.5', 'reqId':'%s', 'status':'OK', 'table': " %
+           (response_handler, req_id))
+    for chunk in self.IterJSon(columns_order, order_by, limit):
+      yield chunk
+    yield "});"
 
-  def ToResponse(self, columns_order=None, order_by=(), tqx=""):
+  def ToResponse(self, columns_order=None, order_by=(), tqx="", limit=None):
     """Writes the right response according to the request string passed in tqx.
 
     This method parses the tqx request string (format of which is defined in
@@ -838,6 +1128,7 @@ class DataTable(object):
            the format "key1:value1;key2:value2...". All keys have a default
            value, so an empty string will just do the default (which is calling
            ToJSonResponse() with no extra parameters).
+      limit: Optional. Passed as is to the relevant response function.
 
     Returns:
       A response string, as returned by the relevant response function.
@@ -845,6 +1136,25 @@ class DataTable(object):
     Raises:
       DataTableException: One of the parameters passed in tqx is not supported.
     """
+    return "".join(self.IterResponse(columns_order, order_by, tqx, limit))
+
+  def IterResponse(self, columns_order=None, order_by=(), tqx="", limit=None):
+    """Returns the response of ToResponse() as an iterator of chunks.
+
+    The chunks can be handed to a streaming HTTP response, so the first rows
+    are sent before the last ones are written.
+
+    Args:
+      Same as for ToResponse().
+
+    Returns:
+      An iterator of strings, from IterJSonResponse(), IterHtml() or IterCsv()
+      according to the "out" parameter of tqx.
+
+    Raises:
+      DataTableException: One of the parameters passed in tqx is not supported.
+                          Raised by this call, before any chunk is written.
+    """
     tqx_dict = {}
     if tqx:
       tqx_dict = dict(opt.split(":") for opt in tqx.split(";"))
@@ -856,13 +1166,14 @@ class DataTable(object):
     if tqx_dict.get("out", "json") == "json":
       response_handler = tqx_dict.get("responseHandler",
                                       "google.visualization.Query.setResponse")
-      return self.ToJSonResponse(columns_order, order_by,
-                                 req_id=tqx_dict.get("reqId", 0),
-                                 response_handler=response_handler)
+      return self.IterJSonResponse(columns_order, order_by,
+                                   req_id=tqx_dict.get("reqId", 0),
+                                   response_handler=response_handler,
+                                   limit=limit)
     elif tqx_dict["out"] == "html":
-      return self.ToHtml(columns_order, order_by)
+      return self.IterHtml(columns_order, order_by, limit)
     elif tqx_dict["out"] == "csv":
-      return self.ToCsv(columns_order, order_by)
+      return self.IterCsv(columns_order, order_by, limit)
     else:
       raise DataTableException(
           "'out' parameter: '%s' is not supported" % tqx_dict["out"])
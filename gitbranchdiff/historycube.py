@@ -0,0 +1,213 @@
+import os, hashlib
+import fileutil
+from fileutil import FileLock
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# first line of the header file: magic, version, generation, ordinal of the first day and number of days
+CUBE_MAGIC = "gitbranchdiff-cube"
+CUBE_VERSION = 1
+CUBE_SPARE_DAYS = 366 # the day axis goes this far past the newest point, so the tips move on for a year without a rebuild
+MISSING = -1 # a day before the first point of a timeline
+
+def getStamp( *parts ):
+	"""A 63 bit hash of 'parts', stored with a row to tell what it was filled from."""
+	return int( hashlib.md5( repr(parts) ).hexdigest()[:15], 16 )
+
+class HistoryCube( object ):
+	"""The daily totals of the branch timelines as one (base, branch, directory, day) int32 array in a memory-mapped .npy file.
+
+	Each day holds the total of the timeline's last point on or before it, MISSING before its first point.
+	Each (base, branch, directory) row keeps the stamp of the timeline it was filled from, so a row whose
+	timeline moved on is filled again. Every process maps the same files and shares their pages.
+
+	The axes live in a small header file next to the arrays. When they no longer fit, empty arrays of a new
+	generation are written and the header is switched to them, the other processes map them on their next open().
+	Needs numpy, open() returns False without it.
+	"""
+	def __init__( self, directory ):
+		self.directory = directory
+		self.headerPath = os.path.join( directory, "cube.txt" )
+		self.headerStat = None
+		self.generation = 0
+		self.origin = 0
+		self.days = 0
+		self.bases = []
+		self.branches = []
+		self.directories = []
+		self.values = None
+		self.stamps = None
+
+	def getLock( self ):
+		return FileLock( os.path.join( self.directory, "cube.lock" ) )
+
+	def getArrayPaths( self, generation ):
+		return (os.path.join( self.directory, "values-%d.npy" % generation ), os.path.join( self.directory, "stamps-%d.npy" % generation ))
+
+	def refresh( self ):
+		"""Maps the arrays the header points to, unless they are mapped already."""
+		try:
+			stat = os.stat( self.headerPath )
+		except OSError:
+			self.headerStat = None
+			self.values = None
+			self.stamps = None
+			return
+		headerStat = (stat.st_ino, stat.st_mtime, stat.st_size)
+		if headerStat == self.headerStat:
+			return
+
+		with open( self.headerPath, 'rb' ) as f:
+			lines = f.read().split( "\n" )
+		fields = lines[0].split()
+		if len(lines) < 4 or len(fields) != 5 or fields[0] != CUBE_MAGIC or fields[1] != str(CUBE_VERSION):
+			self.headerStat = None
+			self.values = None
+			self.stamps = None
+			return
+		self.generation, self.origin, self.days = int(fields[2]), int(fields[3]), int(fields[4])
+		self.bases, self.branches, self.directories = [[name for name in line.split( "\t" ) if name] for line in lines[1:4]]
+		valuesPath, stampsPath = self.getArrayPaths( self.generation )
+		self.values = numpy.load( valuesPath, mmap_mode='r+' )
+		self.stamps = numpy.load( stampsPath, mmap_mode='r+' )
+		self.headerStat = headerStat
+
+	def covers( self, bases, branches, directories, firstDate, lastDate ):
+		if self.values is None:
+			return False
+		for names, axis in ((bases, self.bases), (branches, self.branches), (directories, self.directories)):
+			for name in names:
+				if name not in axis:
+					return False
+		return self.origin <= firstDate.toordinal() and lastDate.toordinal() < self.origin + self.days
+
+	def open( self, bases, branches, directories, firstDate, lastDate ):
+		"""Maps the cube, first making a new one if its axes do not cover the arguments."""
+		if numpy is None:
+			return False
+		self.refresh()
+		if self.covers( bases, branches, directories, firstDate, lastDate ):
+			return True
+
+		lock = self.getLock()
+		lock.acquire()
+		try:
+			self.refresh()
+			if not self.covers( bases, branches, directories, firstDate, lastDate ):
+				self.create( bases, branches, directories, firstDate, lastDate )
+		finally:
+			lock.release()
+		return True
+
+	def create( self, bases, branches, directories, firstDate, lastDate ):
+		"""Writes empty arrays of a new generation, with the axes of the old one widened to fit."""
+		def union( axis, names ):
+			return axis + [name for name in names if name not in axis]
+		origin = firstDate.toordinal()
+		end = lastDate.toordinal() + CUBE_SPARE_DAYS
+		if self.values is not None:
+			bases, branches, directories = union( self.bases, bases ), union( self.branches, branches ), union( self.directories, directories )
+			origin = min( origin, self.origin )
+			end = max( end, self.origin + self.days )
+		oldGeneration = self.generation if self.values is not None else None
+		generation = self.generation + 1
+
+		valuesPath, stampsPath = self.getArrayPaths( generation )
+		for path in (valuesPath, stampsPath):
+			# a leftover may still be mapped somewhere, a new file leaves those mappings alone
+			if os.path.exists( path ):
+				os.remove( path )
+		values = numpy.lib.format.open_memmap( valuesPath, mode='w+', dtype=numpy.int32, shape=(len(bases), len(branches), len(directories), end - origin) )
+		values[...] = MISSING
+		values.flush()
+		stamps = numpy.lib.format.open_memmap( stampsPath, mode='w+', dtype=numpy.int64, shape=(len(bases), len(branches), len(directories)) )
+		stamps.flush()
+		del values, stamps
+
+		header = "%s %d %d %d %d\n%s\n%s\n%s\n" % (CUBE_MAGIC, CUBE_VERSION, generation, origin, end - origin,
+													"\t".join( bases ), "\t".join( branches ), "\t".join( directories ))
+		fileutil.writeAtomic( self.headerPath, header )
+		self.refresh()
+
+		if oldGeneration is not None:
+			for path in self.getArrayPaths( oldGeneration ):
+				try:
+					os.remove( path )
+				except OSError:
+					pass # still mapped on Windows, the next clear() takes it
+
+	def clear( self ):
+		"""Drops the cube, the next open() makes a new one."""
+		lock = self.getLock()
+		lock.acquire()
+		try:
+			self.refresh()
+			if os.path.exists( self.headerPath ):
+				os.remove( self.headerPath )
+			self.values = None
+			self.stamps = None
+			self.headerStat = None
+			if os.path.exists( self.directory ):
+				for name in os.listdir( self.directory ):
+					if name.endswith( ".npy" ):
+						try:
+							os.remove( os.path.join( self.directory, name ) )
+						except OSError:
+							pass
+		finally:
+			lock.release()
+
+	def getIndex( self, base, branch, directory ):
+		return (self.bases.index( base ), self.branches.index( branch ), self.directories.index( directory ))
+
+	def getStamp( self, base, branch, directory ):
+		return int( self.stamps[ self.getIndex( base, branch, directory ) ] )
+
+	def fillRows( self, base, rows ):
+		"""Fills (branch, directory, stamp, points) rows, the points newest first as dictionaries with 'date' and 'total'."""
+		lock = self.getLock()
+		lock.acquire()
+		try:
+			for branch, directory, stamp, points in rows:
+				index = self.getIndex( base, branch, directory )
+				row = self.values[index]
+				row[:] = MISSING
+				end = len(row)
+				for point in points:
+					x = min( max( point['date'].toordinal() - self.origin, 0 ), end )
+					row[x:end] = point['total']
+					end = x
+					if end == 0:
+						break
+				self.stamps[index] = stamp
+			self.values.flush()
+			self.stamps.flush()
+		finally:
+			lock.release()
+
+	def getTotals( self, base, branches, directories, fromDate, toDate ):
+		"""The directories added up for each branch from fromDate to toDate, as a (branch, day) array.
+
+		A day is MISSING where it is in none of the directories. The rows are copied under the
+		lock, so a row another process is filling is read before or after, never half done.
+		"""
+		x = self.bases.index( base )
+		branchIndexes = [self.branches.index( branch ) for branch in branches]
+		directoryIndexes = [self.directories.index( directory ) for directory in directories]
+		start = fromDate.toordinal() - self.origin
+		stop = toDate.toordinal() - self.origin + 1
+		lock = self.getLock()
+		lock.acquire()
+		try:
+			# indexing with a list copies
+			block = self.values[x][branchIndexes][:, directoryIndexes, start:stop]
+		finally:
+			lock.release()
+		present = block != MISSING
+		# summed in int64, numpy sums int32 in int32 on Windows
+		totals = numpy.where( present, block, 0 ).sum( axis=1, dtype=numpy.int64 )
+		totals[ ~present.any( axis=1 ) ] = MISSING
+		return totals
@@ -0,0 +1,101 @@
+import sys, threading
+
+def estimateSize( value ):
+	"""Rough number of bytes held by 'value', following dicts, lists and tuples."""
+	size = sys.getsizeof( value )
+	if isinstance( value, dict ):
+		for key, item in value.iteritems():
+			size += estimateSize( key ) + estimateSize( item )
+	elif isinstance( value, (list, tuple) ):
+		for item in value:
+			size += estimateSize( item )
+	return size
+
+class LRUCache( object ):
+	"""A thread safe least recently used cache bounded by entry count and bytes.
+
+	Entries live on a circular doubly linked list, most recently used first,
+	with a dictionary from key to list node. Each node is a list of
+	[previous, next, key, value, size].
+	"""
+	PREV, NEXT, KEY, VALUE, SIZE = range(5)
+
+	def __init__( self, maxEntries, maxBytes, sizeFunc=estimateSize ):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.sizeFunc = sizeFunc
+		self.lock = threading.Lock()
+		self.clear()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def clear( self ):
+		self.lock.acquire()
+		try:
+			self.nodes = {}
+			self.root = []
+			self.root[:] = [self.root, self.root, None, None, 0]
+			self.bytes = 0
+		finally:
+			self.lock.release()
+
+	def __len__( self ):
+		return len(self.nodes)
+
+	def _unlink( self, node ):
+		node[self.PREV][self.NEXT] = node[self.NEXT]
+		node[self.NEXT][self.PREV] = node[self.PREV]
+
+	def _linkFront( self, node ):
+		first = self.root[self.NEXT]
+		node[self.PREV] = self.root
+		node[self.NEXT] = first
+		first[self.PREV] = node
+		self.root[self.NEXT] = node
+
+	def get( self, key, default=None ):
+		self.lock.acquire()
+		try:
+			node = self.nodes.get( key )
+			if node is None:
+				self.misses += 1
+				return default
+			self.hits += 1
+			self._unlink( node )
+			self._linkFront( node )
+			return node[self.VALUE]
+		finally:
+			self.lock.release()
+
+	def put( self, key, value ):
+		size = self.sizeFunc( value )
+		if size > self.maxBytes:
+			return
+
+		self.lock.acquire()
+		try:
+			node = self.nodes.get( key )
+			if node is not None:
+				self._unlink( node )
+				self.bytes -= node[self.SIZE]
+				node[self.VALUE] = value
+				node[self.SIZE] = size
+			else:
+				node = [None, None, key, value, size]
+				self.nodes[key] = node
+			self._linkFront( node )
+			self.bytes += size
+
+			while len(self.nodes) > self.maxEntries or self.bytes > self.maxBytes:
+				last = self.root[self.PREV]
+				self._unlink( last )
+				del self.nodes[last[self.KEY]]
+				self.bytes -= last[self.SIZE]
+				self.evictions += 1
+		finally:
+			self.lock.release()
+
+	def getStats( self ):
+		return { 'entries': len(self.nodes), 'bytes': self.bytes, 'hits': self.hits,
+				'misses': self.misses, 'evictions': self.evictions }
@@ -0,0 +1,82 @@
+import datetime, time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysite.gitbranchdiff import gviz_api
+
+def referenceToJSon( dataTable, columns_order, order_by=() ):
+	"""DataTable.ToJSon as it was before the per-column encoders and storage, one row dictionary and SingleValueToJS call per cell."""
+	col_dict = dict( [(col["id"], col) for col in dataTable.columns] )
+	cols_jsons = ["{id:'%(id)s',label:'%(label)s',type:'%(type)s'}" % col_dict[col_id] for col_id in columns_order]
+	rows_jsons = []
+	for row in dataTable._Rows( order_by ):
+		cells_jsons = []
+		for col in columns_order:
+			value = row.get( col, None )
+			if value is None and col != columns_order[-1]:
+				cells_jsons.append( "" )
+			else:
+				value = gviz_api.DataTable.SingleValueToJS( value, col_dict[col]["type"] )
+				if isinstance( value, tuple ):
+					cells_jsons.append( "{v:%s,f:%s}" % value )
+				else:
+					cells_jsons.append( "{v:%s}" % value )
+		rows_jsons.append( "{c:[%s]}" % ",".join( cells_jsons ) )
+	return "{cols: [%s],rows: [%s]}" % (",".join( cols_jsons ), ",".join( rows_jsons ))
+
+def createMatrixTable( numRows, numDirectories=9 ):
+	"""Shaped like the matrix: branch, a number and a url per directory, total."""
+	description = {"branch": ("string", "Branch"), "total": ("number", "Total") }
+	columns = ["branch"]
+	for x in range(numDirectories):
+		description["dir%d" % x] = ("number", "dir%d" % x)
+		description["url%d" % x] = ("string", "url")
+	columns += ["dir%d" % x for x in range(numDirectories)] + ["url%d" % x for x in range(numDirectories)] + ["total"]
+
+	data = []
+	for y in range(numRows):
+		row = { "branch": "branch%d/ml" % y, "total": y * numDirectories }
+		for x in range(numDirectories):
+			row["dir%d" % x] = y
+			row["url%d" % x] = "/diff/?bc=%040x&cc=%040x&dir=dir%d/dev" % (y, y + 1, x)
+		data.append( row )
+	return gviz_api.DataTable( description, data ), columns
+
+def createHistoryTable( numRows ):
+	"""Shaped like the diff timeline: date, total and an annotation title."""
+	description = {"date": ("date", "Date"), "total": ("number", "Lines of Difference"),
+					"title0": ("string", "title0"), "text0": ("string", "text0")}
+	start = datetime.date( 2010, 1, 1 )
+	data = [{ 'date': start + datetime.timedelta(y), 'total': y * 3, 'title0': "<a href=/diff/?bc=%040x> commit %d</a>" % (y, y) }
+			for y in range(numRows)]
+	return gviz_api.DataTable( description, data ), ["date", "total", "title0", "text0"]
+
+def timeCall( func, repeat ):
+	best = None
+	for x in range(repeat):
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+class Command( NoArgsCommand ):
+	help = "Times DataTable.ToJSon against the per-cell reference implementation and checks their output is identical."
+	option_list = NoArgsCommand.option_list + (
+		make_option( '--rows', type='int', dest='rows', default=10000,
+					help='Rows in each benchmark table.' ),
+		make_option( '--repeat', type='int', dest='repeat', default=5,
+					help='Runs of each serializer, the best is reported.' ),
+	)
+
+	def handle_noargs( self, **options ):
+		for name, (dataTable, columns) in (("matrix", createMatrixTable( options['rows'] )),
+											("history", createHistoryTable( options['rows'] ))):
+			if dataTable.ToJSon( columns ) != referenceToJSon( dataTable, columns ):
+				print "%s: ToJSon output differs from the reference" % name
+				continue
+			reference = timeCall( lambda: referenceToJSon( dataTable, columns ), options['repeat'] )
+			compiled = timeCall( lambda: dataTable.ToJSon( columns ), options['repeat'] )
+			print "%-8s %6d rows  reference %.3fs  compiled %.3fs  %.1fx" % (name, options['rows'], reference, compiled, reference / compiled)
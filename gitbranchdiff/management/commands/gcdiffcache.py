@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysite.gitbranchdiff import views
+
+def printStats( stats ):
+	for kind in ("diffs", "blobs", "rawDiffs", "histories", "pages"):
+		kindStats = stats[kind]
+		print "%-10s %8d entries %12d bytes %8d hits %8d misses  hit ratio %.2f" % (kind, kindStats['entries'], kindStats['bytes'],
+																					kindStats['hits'], kindStats['misses'], kindStats['hitRatio'])
+	timelineStats = stats['timelines']
+	print "%-10s %8d entries %12d bytes %8d points" % ("timelines", timelineStats['entries'], timelineStats['bytes'], timelineStats['points'])
+	print "store uses %d bytes" % stats['usedBytes']
+
+class Command( NoArgsCommand ):
+	help = "Collects old, unreachable and least recently used entries from the diff cache, rolls up old timeline points and prints its stats."
+	option_list = NoArgsCommand.option_list + (
+		make_option( '--max-bytes', type='int', dest='maxBytes', default=views.GIT_CACHE_MAX_BYTES,
+					help='Evict least recently used entries until the store is below this size.' ),
+		make_option( '--max-age-days', type='int', dest='maxAgeDays', default=views.GIT_CACHE_MAX_AGE // 86400,
+					help='Delete entries that have not been used for this many days.' ),
+		make_option( '--keep-unreachable', action='store_false', dest='unreachable', default=True,
+					help='Keep entries for commits no configured branch reaches.' ),
+		make_option( '--vacuum', action='store_true', dest='vacuum', default=False,
+					help='Give the freed space back to the filesystem.' ),
+		make_option( '--stats', action='store_true', dest='statsOnly', default=False,
+					help='Only print the stats, delete nothing.' ),
+	)
+
+	def handle_noargs( self, **options ):
+		if not options.get('statsOnly'):
+			deleted = views.collectCache( options['maxBytes'], options['maxAgeDays'] * 86400, options['unreachable'], options['vacuum'] )
+			for reason, count in sorted( deleted.items() ):
+				print "deleted %d %s" % (count, reason)
+		printStats( views.diffStore.getStats() )
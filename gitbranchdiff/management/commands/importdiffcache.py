@@ -0,0 +1,76 @@
+import os, datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysite.gitbranchdiff import views
+
+# ------------------- Old File Cache ----------------------------------------------------------------------------------
+# The md5 sharded text files written before the SQLite store, GIT_DIFF_CACHE_DIR/xx/<md5>.cache
+def readValue( item ):
+	if "\'int\'" in item[0]:
+		return views.int_safe( item[2] )
+	elif "\'datetime.date\'" in item[0]:
+		return datetime.date.fromordinal( views.int_safe(item[2]) )
+	return item[2]
+
+def readDiffFile( lines ):
+	diff = {}
+	for line in lines:
+		item = line.strip().split(",")
+		if len(item) != 3:
+			return None
+		diff[item[1]] = readValue( item )
+	return diff
+
+class Command( NoArgsCommand ):
+	help = "Imports the old per-entry text file cache in GIT_DIFF_CACHE_DIR into the SQLite store."
+	option_list = NoArgsCommand.option_list + (
+		make_option( '--remove', action='store_true', dest='remove', default=False,
+					help='Delete each cache file once it has been imported.' ),
+	)
+
+	def handle_noargs( self, **options ):
+		diffKeys = ('baseCommit', 'compareCommit', 'directory', 'insertions', 'deletions', 'filesChanged')
+		imported = 0
+		skipped = 0
+
+		for shard in sorted( os.listdir( views.GIT_DIFF_CACHE_DIR ) ):
+			shardDir = os.path.join( views.GIT_DIFF_CACHE_DIR, shard )
+			if len(shard) != 2 or not os.path.isdir( shardDir ):
+				continue
+
+			diffs = []
+			importedPaths = []
+			for name in sorted( os.listdir( shardDir ) ):
+				if not name.endswith( ".cache" ):
+					continue
+				path = os.path.join( shardDir, name )
+				with open( path, 'r' ) as f:
+					lines = f.readlines()
+				if not lines:
+					skipped += 1
+					continue
+
+				if len(lines[0].strip().split(",")) == 3:
+					diff = readDiffFile( lines )
+					if not diff or [key for key in diffKeys if key not in diff]:
+						skipped += 1
+						continue
+					diff['total'] = diff['insertions'] + diff['deletions']
+					diffs.append( diff )
+					imported += 1
+				else:
+					# histories sampled every few days, the views now place their points
+					# on the days the branches changed, so these are computed again
+					skipped += 1
+					continue
+				importedPaths.append( path )
+
+			# one transaction per shard directory
+			views.writeDiffsToCache( diffs )
+			if options.get('remove'):
+				for path in importedPaths:
+					os.remove( path )
+
+		print "imported %d diffs, skipped %d files" % (imported, skipped)
@@ -0,0 +1,40 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysite.gitbranchdiff import views
+
+class Command( NoArgsCommand ):
+	help = "Precomputes the matrix and timelines for branches queued by hooks/post-receive."
+	option_list = NoArgsCommand.option_list + (
+		make_option( '--once', action='store_true', dest='once', default=False,
+					help='Warm what is queued and exit instead of polling the queue.' ),
+		make_option( '--interval', type='int', dest='interval', default=5,
+					help='Seconds between polls of the queue.' ),
+		make_option( '--all', action='store_true', dest='all', default=False,
+					help='Warm every configured branch, queued or not, and exit.' ),
+	)
+
+	def warm( self, branches ):
+		start = time.time()
+		warmed = views.warmCache( branches )
+		print "warmed %d branch pairs for %s in %.1fs" % (warmed, ", ".join( branches ), time.time() - start)
+
+	def handle_noargs( self, **options ):
+		views.initcache()
+		if options.get('all'):
+			self.warm( views.GIT_BRANCHES )
+			return
+
+		while True:
+			branches = views.getPushedBranches( views.diffStore.takeQueuedRefs() )
+			if branches:
+				try:
+					self.warm( branches )
+				except Exception, e:
+					# the next push queues them again, keep serving the queue
+					print "warming %s failed: %s" % (", ".join( branches ), e)
+			if options.get('once'):
+				return
+			time.sleep( options['interval'] )
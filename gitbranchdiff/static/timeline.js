@@ -0,0 +1,84 @@
+// Loads timelines in the compact format of the timeline views (fmt=compact) into google.visualization.DataTables.
+// The days and the values of each series come delta encoded, a null value breaks no chain: the value after it
+// is a delta from the last value that was not null.
+
+function decodeDeltas(deltas)
+{
+	var values = [];
+	var last = 0;
+	for (var i = 0; i < deltas.length; i++)
+	{
+		if (deltas[i] === null)
+		{
+			values.push(null);
+			continue;
+		}
+		last += deltas[i];
+		values.push(last);
+	}
+	return values;
+}
+
+function createTimelineDataTable(timeline)
+{
+	var data = new google.visualization.DataTable();
+	data.addColumn('date', 'Date');
+	for (var i = 0; i < timeline.labels.length; i++)
+		data.addColumn('number', timeline.labels[i]);
+	if (timeline.titles)
+	{
+		data.addColumn('string', 'title0');
+		data.addColumn('string', 'text0');
+	}
+
+	var days = decodeDeltas(timeline.days);
+	var series = [];
+	for (var i = 0; i < timeline.series.length; i++)
+		series.push(decodeDeltas(timeline.series[i]));
+
+	var rows = [];
+	for (var x = 0; x < days.length; x++)
+	{
+		// days since 1970-01-01, as a local date like the gviz tables have
+		var row = [new Date(1970, 0, 1 + days[x])];
+		for (var i = 0; i < series.length; i++)
+			row.push(series[i][x]);
+		if (timeline.titles)
+		{
+			row.push(timeline.titles[x]);
+			row.push(null);
+		}
+		rows.push(row);
+	}
+	data.addRows(rows);
+	return data;
+}
+
+// about one point for each pixel the timeline is wide
+function getTimelinePoints(element)
+{
+	return Math.max(element.offsetWidth, 100);
+}
+
+// handler(timeline) gets the parsed response, its status is 'ok' or 'error' with a reason and a message
+function sendTimelineQuery(url, handler)
+{
+	var request = new XMLHttpRequest();
+	request.onreadystatechange = function()
+	{
+		if (request.readyState != 4)
+			return;
+		var timeline;
+		try
+		{
+			timeline = JSON.parse(request.responseText);
+		}
+		catch (e)
+		{
+			timeline = {'status': 'error', 'reason': 'internal_error', 'message': 'The timeline did not load (' + request.status + ')'};
+		}
+		handler(timeline);
+	};
+	request.open('GET', url, true);
+	request.send(null);
+}
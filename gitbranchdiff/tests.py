@@ -5,8 +5,12 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
+import datetime, os, shutil, subprocess, tempfile, unittest
+
 from django.test import TestCase
 
+from mysite.gitbranchdiff import commitindex, diffstore, gviz_api, historycube, views
+
 class SimpleTest(TestCase):
     def test_basic_addition(self):
         """
@@ -14,6 +18,423 @@ class SimpleTest(TestCase):
         """
         self.failUnlessEqual(1 + 1, 2)
 
+class DataTableTest(TestCase):
+    def createTable(self):
+        description = [("n", "number"), ("s", "string"), ("d", "date"), ("b", "boolean")]
+        data = [[1, "x", datetime.date(2010, 1, 2), True],
+                [(5, "5$"), u"\xe9'", None, None],
+                [2.5, None, datetime.datetime(2010, 1, 2, 3, 4, 5), False]]
+        return gviz_api.DataTable(description, data)
+
+    def test_tojson(self):
+        """
+        The per-column encoders write what SingleValueToJS writes for each cell.
+        """
+        self.failUnlessEqual(self.createTable().ToJSon(),
+            "{cols: [{id:'n',label:'n',type:'number'},{id:'s',label:'s',type:'string'},"
+            "{id:'d',label:'d',type:'date'},{id:'b',label:'b',type:'boolean'}],"
+            "rows: [{c:[{v:1},{v:'x'},{v:new Date(2010,0,2)},{v:true}]},"
+            "{c:[{v:5,f:'5$'},{v:\"\\xe9'\"},,{v:null}]},"
+            "{c:[{v:2.5},,{v:new Date(2010,0,2)},{v:false}]}]}")
+
+    def test_iter(self):
+        """
+        The streamed chunks join up to the whole output.
+        """
+        table = self.createTable()
+        self.failUnlessEqual("".join(table.IterJSon(order_by="n")), table.ToJSon(order_by="n"))
+        self.failUnlessEqual("".join(table.IterCsv()), table.ToCsv())
+        self.failUnlessEqual("".join(table.IterHtml()), table.ToHtml())
+        self.failUnlessEqual(len(list(table.IterCsv())), 1 + table.NumberOfRows())
+        self.assertRaises(gviz_api.DataTableException, table.IterResponse, tqx="out:xml")
+
+    def test_order_by(self):
+        """
+        Key passes give the cmp order, a limit gives the top of it and appends drop the cached orders.
+        """
+        table = gviz_api.DataTable([("n", "number"), ("s", "string")],
+                                   [[2, "a"], [1, "b"], [None, "a"], [2, "b"], [1, "a"]])
+        order = [("s", "desc"), "n"]
+        self.failUnlessEqual(table.ToCsv(order_by=order), "'n', 's'\n1, 'b'\n2, 'b'\n'', 'a'\n1, 'a'\n2, 'a'")
+        self.failUnlessEqual(table.ToCsv(order_by=("n", "desc"), limit=2), "'n', 's'\n2, 'a'\n2, 'b'")
+        self.failUnlessEqual(table.ToCsv(order_by=order, limit=3), "'n', 's'\n1, 'b'\n2, 'b'\n'', 'a'")
+        table.AppendData([[0, "c"]])
+        self.failUnlessEqual(table.ToCsv(order_by=order, limit=1), "'n', 's'\n0, 'c'")
+
+    def test_wrong_type(self):
+        table = gviz_api.DataTable([("n", "number")], [["x"]])
+        self.assertRaises(gviz_api.DataTableException, table.ToJSon)
+
+class TimelinePayloadTest(TestCase):
+    def test_lttb(self):
+        """
+        Thinning keeps the ends and a lone spike, and leaves short timelines alone.
+        """
+        ys = [x % 3 for x in range(100)]
+        ys[41] = 50
+        indexes = views.getLTTBIndexes(range(100), [ys], 10)
+        self.failUnlessEqual(len(indexes), 10)
+        self.failUnlessEqual((indexes[0], indexes[-1]), (0, 99))
+        self.failUnless(41 in indexes)
+        self.failUnlessEqual(views.getLTTBIndexes(range(5), [ys[:5]], 10), range(5))
+
+    def test_compact(self):
+        """
+        The compact format is oldest first and delta encoded, a None does not break the deltas.
+        """
+        dates = [datetime.date(1970, 1, 5), datetime.date(1970, 1, 3), datetime.date(1970, 1, 2)]
+        timeline = views.createCompactTimeline(["a"], dates, [[7, None, 4]])
+        self.failUnlessEqual(timeline, {"labels": ["a"], "days": [1, 1, 2], "series": [[4, None, 3]]})
+
+class FirstParentIndexTest(TestCase):
+    def createIndex(self):
+        # c2 was committed after c3, on a clock that ran ahead
+        return commitindex.FirstParentIndex([(100, "c4"), (90, "c3"), (95, "c2"), (80, "c1"), (70, "c0")])
+
+    def test_commit_at(self):
+        """
+        The search runs over the running minimum of the times, so a commit newer than its child is passed over.
+        """
+        index = self.createIndex()
+        self.failUnlessEqual(index.commitAt(100), "c4")
+        self.failUnlessEqual(index.commitAt(96), "c3")
+        self.failUnlessEqual(index.commitAt(85), "c1")
+        self.failUnlessEqual(index.commitAt(60), "")
+        self.failUnlessEqual(index.getFirstTimestamp(), 70)
+        self.failUnlessEqual(index.entriesSince(85), [(100, "c4"), (90, "c3"), (95, "c2"), (80, "c1")])
+        self.failUnlessEqual(index.entriesSince(60), index.entries())
+
+    def test_from_commit(self):
+        index = self.createIndex()
+        self.failUnless(index.fromCommit("c4") is index)
+        self.failUnlessEqual(index.fromCommit("cx"), None)
+        view = index.fromCommit("c2")
+        self.failUnlessEqual((view.getTip(), view.getTimestamp(), len(view)), ("c2", 95, 3))
+        self.failUnlessEqual(view.commitAt(96), "c2")
+        self.failUnlessEqual(view.find("c0"), 2)
+        self.failUnlessEqual(view.find("c3"), -1)
+        self.failUnlessEqual(view.entriesSince(75), [(95, "c2"), (80, "c1"), (70, "c0")])
+
+    def test_write_read(self):
+        """
+        An index reads back as written, a damaged or missing file reads as None.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "index.idx")
+            self.failUnlessEqual(commitindex.FirstParentIndex.read(path), None)
+            self.createIndex().write(path)
+            self.failUnlessEqual(commitindex.FirstParentIndex.read(path).entries(), self.createIndex().entries())
+            f = open(path, "ab")
+            f.write("60 cx\n")
+            f.close()
+            self.failUnlessEqual(commitindex.FirstParentIndex.read(path), None)
+        finally:
+            shutil.rmtree(directory)
+
+class GitRepositoryMixin(object):
+    """
+    Runs git in a repository made in a temporary directory.
+    """
+    def git(self, *args):
+        environment = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+                           GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+        process = subprocess.Popen(["git"] + list(args), cwd=self.repo, env=environment, stdout=subprocess.PIPE)
+        return process.communicate()[0].strip()
+
+    def writeFile(self, path, lines):
+        path = os.path.join(self.repo, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, "wb")
+        f.write("".join(["%s\n" % line for line in lines]))
+        f.close()
+
+class LinesDifferencesTest(GitRepositoryMixin, TestCase):
+    """
+    Runs the diffs against a small repository made in a temporary directory.
+    """
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.saved = (views.GIT_REPO_DIR, views.gitBatch, views.diffStore, views.GIT_DIFF_OPTIONS,
+                      views.BLOB_DIFF_BATCH_ENTRIES, views.BLOB_DIFF_MAX_PATHS, views.RAW_DIFF_MAX_ENTRIES)
+        views.GIT_REPO_DIR = self.repo
+        views.gitBatch = views.gitbatch.GitBatch(self.repo)
+        views.diffStore = views.diffstore.DiffStore(os.path.join(self.repo, ".cache", "test.sqlite"))
+        views.GIT_DIFF_OPTIONS = "-M"
+
+        self.git("init", "-q")
+        for name in ("moved", "renamed", "edited"):
+            self.writeFile("a/dev/%s.txt" % name, ["%s %d" % (name, x) for x in range(20)])
+        self.writeFile("b/dev/kept.txt", ["kept %d" % x for x in range(20)])
+        self.git("add", ".")
+        self.git("commit", "-q", "-m", "base")
+        self.commit0 = self.git("rev-parse", "HEAD")
+
+        self.git("mv", "a/dev/moved.txt", "b/dev/moved.txt")
+        self.git("mv", "a/dev/renamed.txt", "a/dev/other name.txt")
+        self.writeFile("a/dev/edited.txt", ["edited %d" % x for x in range(15)] + ["new"])
+        self.writeFile("b/dev/kept.txt", ["kept %d" % x for x in range(21)])
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", "compare")
+        self.commit1 = self.git("rev-parse", "HEAD")
+
+    def tearDown(self):
+        views.gitBatch.close()
+        views.diffStore.close()
+        (views.GIT_REPO_DIR, views.gitBatch, views.diffStore, views.GIT_DIFF_OPTIONS,
+         views.BLOB_DIFF_BATCH_ENTRIES, views.BLOB_DIFF_MAX_PATHS, views.RAW_DIFF_MAX_ENTRIES) = self.saved
+        shutil.rmtree(self.repo)
+
+    def getNumstatCounts(self, *paths):
+        counts = []
+        for line in self.git("diff", "-M", "--numstat", self.commit0, self.commit1, "--", *paths).splitlines():
+            insertions, deletions = line.split("\t")[:2]
+            counts.append((int(insertions), int(deletions)))
+        return sorted(counts)
+
+    def test_batched(self):
+        """
+        A raw diff taken an entry at a time, with its renames diffed one pair at a time and kept nowhere, lists what numstat does.
+        """
+        views.BLOB_DIFF_BATCH_ENTRIES = 1
+        views.BLOB_DIFF_MAX_PATHS = 2
+        views.RAW_DIFF_MAX_ENTRIES = 1
+        for directories in (["a/dev"], ["a/dev", "b/dev"]):
+            records = views.git_getFileDifferences(self.commit0, self.commit1, directories)
+            self.failUnlessEqual(sorted([(record.insertions, record.deletions) for record in records]), self.getNumstatCounts(*directories))
+            self.failUnlessEqual(views.memoryCache.get(views.getRawDiffKey(self.commit0, self.commit1, directories)), None)
+
+    def test_bucketed(self):
+        """
+        One diff over both directories buckets into what a diff of each directory gives, a rename across them counts as an add and a delete.
+        """
+        directories = ["a/dev", "b/dev"]
+        diffs = views.git_getLinesDifferences(self.commit0, self.commit1, directories)
+        for directory, diff in zip(directories, diffs):
+            counts = [0, 0, 0]
+            for line in self.git("diff", "-M", "--numstat", self.commit0, self.commit1, "--", directory).splitlines():
+                insertions, deletions = line.split("\t")[:2]
+                counts = [counts[0] + int(insertions), counts[1] + int(deletions), counts[2] + 1]
+            self.failUnlessEqual([diff["insertions"], diff["deletions"], diff["filesChanged"]], counts)
+        self.failUnlessEqual([(diff["insertions"], diff["deletions"], diff["filesChanged"]) for diff in diffs], [(1, 25, 3), (21, 0, 2)])
+
+class RemoteBranchTest(GitRepositoryMixin, TestCase):
+    """
+    Reads the configured branches under origin/, as GIT_USE_REMOTE_BRANCH does, while shas stay plain revisions.
+    """
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.saved = (views.GIT_REPO_DIR, views.gitBatch, views.diffStore, views.historyCube, views.GIT_USE_REMOTE_BRANCH, views.GIT_BRANCHES,
+                      views.GIT_DEFAULT_BASEBRANCH, views.GIT_DIRECTORIES)
+        views.GIT_REPO_DIR = self.repo
+        views.gitBatch = views.gitbatch.GitBatch(self.repo)
+        views.diffStore = views.diffstore.DiffStore(os.path.join(self.repo, ".cache", "test.sqlite"))
+        views.historyCube = historycube.HistoryCube(os.path.join(self.repo, ".cache", "cube"))
+        views.GIT_USE_REMOTE_BRANCH = True
+        views.GIT_BRANCHES = ["main", "topic"]
+        views.GIT_DEFAULT_BASEBRANCH = "main"
+        views.GIT_DIRECTORIES = ["a/"]
+
+        self.git("init", "-q")
+        self.writeFile("a/file.txt", ["line %d" % x for x in range(10)])
+        self.git("add", ".")
+        self.git("commit", "-q", "-m", "base")
+        self.commit0 = self.git("rev-parse", "HEAD")
+        self.writeFile("a/file.txt", ["line %d" % x for x in range(12)])
+        self.git("commit", "-q", "-a", "-m", "compare")
+        self.commit1 = self.git("rev-parse", "HEAD")
+        self.git("update-ref", "refs/remotes/origin/main", self.commit0)
+        self.git("update-ref", "refs/remotes/origin/topic", self.commit1)
+
+    def tearDown(self):
+        views.gitBatch.close()
+        views.diffStore.close()
+        (views.GIT_REPO_DIR, views.gitBatch, views.diffStore, views.historyCube, views.GIT_USE_REMOTE_BRANCH, views.GIT_BRANCHES,
+         views.GIT_DEFAULT_BASEBRANCH, views.GIT_DIRECTORIES) = self.saved
+        shutil.rmtree(self.repo)
+
+    def test_resolve(self):
+        """
+        A configured branch is its tip under origin/, a sha or a tag resolves as it is.
+        """
+        self.git("tag", "start", self.commit0)
+        refs = views.RefSnapshot()
+        self.failUnlessEqual(refs.resolve("main"), self.commit0)
+        self.failUnlessEqual(refs.resolve("topic"), self.commit1)
+        self.failUnlessEqual(refs.resolve(self.commit1), self.commit1)
+        self.failUnlessEqual(refs.resolve(self.commit1[:12]), self.commit1)
+        self.failUnlessEqual(refs.resolve("start"), self.commit0)
+        self.failUnlessEqual(refs.resolve("missing"), "")
+
+    def test_timelineBranch(self):
+        """
+        A sha stands for the branch it is the tip of, any other commit for none.
+        """
+        self.writeFile("a/file.txt", ["line %d" % x for x in range(14)])
+        self.git("commit", "-q", "-a", "-m", "later")
+        refs = views.RefSnapshot()
+        self.failUnlessEqual(views.getTimelineBranch("topic", refs), "topic")
+        self.failUnlessEqual(views.getTimelineBranch(self.commit0, refs), "main")
+        self.failUnlessEqual(views.getTimelineBranch(self.commit1[:12], refs), "topic")
+        self.failUnlessEqual(views.getTimelineBranch(self.git("rev-parse", "HEAD"), refs), None)
+
+    def test_diffTimeline(self):
+        """
+        A diff timeline of the branches' tips given as shas reads the branches' timeline, the same request
+        again is not modified.
+        """
+        class Request(object):
+            GET = {'bc': self.commit0, 'cc': self.commit1, 'dir': "a/", 'fmt': "compact"}
+            META = {}
+        response = views.diffTimeline(Request())
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless(views.getTimelineVersion("main", ["topic"], ["a/"]))
+        Request.META = {'HTTP_IF_NONE_MATCH': response['ETag']}
+        self.failUnlessEqual(views.diffTimeline(Request()).status_code, 304)
+
+    def test_matrixTimeline(self):
+        """
+        The matrix timeline goes out under the version it was brought up to, the same request again is not modified.
+        """
+        class Request(object):
+            GET = {'bb': "main", 'fmt': "compact"}
+            META = {}
+        response = views.matrixTimeline(Request())
+        self.failUnlessEqual(response.status_code, 200)
+        Request.META = {'HTTP_IF_NONE_MATCH': response['ETag']}
+        self.failUnlessEqual(views.matrixTimeline(Request()).status_code, 304)
+
+class DiffParseTest(TestCase):
+    def test_numstat(self):
+        """
+        Renames and copies put both paths after the counts, binary files count as 0 lines, paths are taken as they are.
+        """
+        output = "3\t1\ta/x.txt\0" "0\t2\t\0a/old name.txt\0b/new\tname.txt\0" "-\t-\ta/image.png\0" "1\t0\ta/line\nbreak.txt\0"
+        self.failUnlessEqual([(record.insertions, record.deletions, record.oldPath, record.path, record.binary)
+                              for record in views.parseNumstatZ(output.split("\0"))],
+                             [(3, 1, None, "a/x.txt", False),
+                              (0, 2, "a/old name.txt", "b/new\tname.txt", False),
+                              (0, 0, None, "a/image.png", True),
+                              (1, 0, None, "a/line\nbreak.txt", False)])
+
+    def test_raw(self):
+        """
+        The status drops its score, only renames and copies have an old path.
+        """
+        output = (":100644 100644 %s %s M\0a/x.txt\0" % ("1" * 40, "2" * 40) +
+                  ":100644 100644 %s %s R100\0a/old name.txt\0b/new name.txt\0" % ("3" * 40, "3" * 40) +
+                  ":000000 100755 %s %s A\0a/run.sh\0" % ("0" * 40, "4" * 40) +
+                  ":100644 100644 %s %s C075\0a/x.txt\0a/y.txt\0" % ("1" * 40, "5" * 40))
+        self.failUnlessEqual(list(views.parseRawZ(output.split("\0"))),
+                             [("100644", "100644", "1" * 40, "2" * 40, "M", None, "a/x.txt"),
+                              ("100644", "100644", "3" * 40, "3" * 40, "R", "a/old name.txt", "b/new name.txt"),
+                              ("000000", "100755", "0" * 40, "4" * 40, "A", None, "a/run.sh"),
+                              ("100644", "100644", "1" * 40, "5" * 40, "C", "a/x.txt", "a/y.txt")])
+
+class HistoryDatesTest(TestCase):
+    def test_dates(self):
+        """
+        Both ends and the change days strictly between them, newest first, thinned to historyLen.
+        """
+        startDate = datetime.date(2010, 3, 1)
+        endDate = datetime.date(2010, 1, 1)
+        changeDates = [datetime.date(2010, 1, 15), datetime.date(2010, 2, 1), datetime.date(2009, 12, 1), startDate, endDate]
+        self.failUnlessEqual(views.getHistoryDates(startDate, endDate, changeDates, 10),
+                             [startDate, datetime.date(2010, 2, 1), datetime.date(2010, 1, 15), endDate])
+        self.failUnlessEqual(views.getHistoryDates(startDate, endDate, changeDates, 3), [startDate, datetime.date(2010, 2, 1), endDate])
+        self.failUnlessEqual(views.getHistoryDates(startDate, endDate, changeDates, 2), [startDate, endDate])
+        self.failUnlessEqual(views.getHistoryDates(startDate, endDate, changeDates, 1), [startDate])
+        self.failUnlessEqual(views.getHistoryDates(startDate, startDate, changeDates, 10), [startDate])
+
+    def test_buckets(self):
+        """
+        Each equal stretch of the span keeps its newest change day.
+        """
+        startDate = datetime.date(2010, 1, 31)
+        endDate = datetime.date(2010, 1, 1)
+        changeDates = [endDate + datetime.timedelta(days) for days in range(1, 30)]
+        dates = views.getHistoryDates(startDate, endDate, changeDates, 5)
+        self.failUnlessEqual(dates, [startDate, datetime.date(2010, 1, 30), datetime.date(2010, 1, 21), datetime.date(2010, 1, 11), endDate])
+
+class TimelineRollupTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = diffstore.DiffStore(os.path.join(self.directory, "test.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_rollup(self):
+        """
+        Before weeklyBefore each week keeps its last point, before monthlyBefore each month does.
+        """
+        firstDate = datetime.date(2010, 1, 1)
+        points = [{'date': firstDate + datetime.timedelta(days), 'total': days, 'baseCommit': "b", 'compareCommit': "c"} for days in range(90)]
+        self.store.putTimelinePoints(points, "main", "topic", "a/dev", "-M", firstDate, points[-1]['date'], "b", "c")
+        timeline = self.store.getTimelines("main", ["topic"], ["a/dev"], "-M")[("topic", "a/dev")]
+        timelineId = timeline['id']
+
+        deleted = self.store.rollupTimelines(datetime.date(2010, 3, 1), datetime.date(2010, 2, 1))
+        # the cube rows and ETags of a rolled up timeline go by 'updated', it moves on within the same second too
+        self.failUnless(self.store.getTimelines("main", ["topic"], ["a/dev"], "-M")[("topic", "a/dev")]['updated'] > timeline['updated'])
+        # Sundays are the last days of the weeks, the ones of February and March 1st on
+        expected = [datetime.date(2010, 1, 31)] + [datetime.date(2010, 2, day) for day in (7, 14, 21, 28)] + \
+                   [datetime.date(2010, 3, day) for day in range(1, 32)]
+        dates = [point['date'] for point in self.store.getTimelinePoints([timelineId], firstDate)[timelineId]]
+        self.failUnlessEqual(sorted(dates), expected)
+        self.failUnlessEqual(deleted, len(points) - len(expected))
+        self.failUnlessEqual(self.store.rollupTimelines(datetime.date(2010, 3, 1), datetime.date(2010, 2, 1)), 0)
+
+@unittest.skipIf(historycube.numpy is None, "the history cube needs numpy")
+class HistoryCubeTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_totals(self):
+        """
+        A day holds the last point on or before it, the directories add up and a day in none of them is MISSING.
+        """
+        cube = historycube.HistoryCube(self.directory)
+        self.failUnless(cube.open(["main"], ["a", "b"], ["x", "y"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 10)))
+        cube.fillRows("main", [("a", "x", 11, [{'date': datetime.date(2010, 1, 8), 'total': 5}, {'date': datetime.date(2010, 1, 3), 'total': 2}]),
+                               ("a", "y", 12, [{'date': datetime.date(2010, 1, 5), 'total': 1}])])
+        totals = cube.getTotals("main", ["a", "b"], ["x", "y"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 10))
+        missing = historycube.MISSING
+        self.failUnlessEqual(totals.tolist(), [[missing, missing, 2, 2, 3, 3, 3, 6, 6, 6], [missing] * 10])
+        self.failUnlessEqual((cube.getStamp("main", "a", "x"), cube.getStamp("main", "b", "x")), (11, 0))
+
+    def test_largeTotals(self):
+        """
+        Directories add up past the int32 a day of one of them holds.
+        """
+        cube = historycube.HistoryCube(self.directory)
+        cube.open(["main"], ["a"], ["x", "y"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 2))
+        cube.fillRows("main", [("a", directory, 11, [{'date': datetime.date(2010, 1, 1), 'total': 2 ** 31 - 1}]) for directory in ("x", "y")])
+        totals = cube.getTotals("main", ["a"], ["x", "y"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 2))
+        self.failUnlessEqual(totals.tolist(), [[2 ** 32 - 2] * 2])
+
+    def test_widen(self):
+        """
+        A cube that does not cover a branch is made again with both axes, the other processes map it on their next refresh.
+        """
+        cube = historycube.HistoryCube(self.directory)
+        cube.open(["main"], ["a"], ["x"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 10))
+        cube.fillRows("main", [("a", "x", 11, [{'date': datetime.date(2010, 1, 1), 'total': 5}])])
+        other = historycube.HistoryCube(self.directory)
+        self.failUnless(other.open(["main"], ["b"], ["x"], datetime.date(2010, 1, 1), datetime.date(2010, 1, 10)))
+        self.failUnlessEqual(other.branches, ["a", "b"])
+        cube.refresh()
+        self.failUnlessEqual((cube.generation, cube.branches), (other.generation, ["a", "b"]))
+        self.failUnlessEqual(cube.getStamp("main", "a", "x"), 0)
+        cube.clear()
+        other.refresh()
+        self.failUnlessEqual((cube.values, other.values), (None, None))
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
@@ -9,5 +9,8 @@ urlpatterns = patterns('',
     # Example:
 	url(r'^$', matrix, name='home'),
 	url(r'^matrix/$', matrix, name='matrix'),
+	url(r'^matrix/data/$', matrixData, name='matrixdata'),
+	url(r'^matrix/timeline/$', matrixTimeline, name='matrixtimeline'),
 	url(r'^diff/$', diff, name='diff'),
+	url(r'^diff/timeline/$', diffTimeline, name='difftimeline'),
 )
@@ -1,23 +1,46 @@
-import os, sys, re, threading, time
-import datetime, hashlib, platform
+import os, sys, re, threading, time, subprocess
+import datetime, hashlib, platform, gzip, cStringIO, pipes, json
 import gviz_api
+import gitbatch
+import diffstore
+import historycube
+from fileutil import FileLock
+from lrucache import LRUCache
+from commitindex import FirstParentIndex
+from cachesettings import GIT_DIFF_CACHE_DIR, GIT_DIFF_CACHE_DB # set there, the post-receive hook reads them too
 
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.template import Context, loader
 from django.template.loader import render_to_string
+from multiprocessing.pool import ThreadPool
 
 GIT_REPO_DIR = "/export/home/git/basekit-animation.git"
 GIT_USE_REMOTE_BRANCH = False
-GIT_DIFF_CACHE_DIR = "/var/tmp/django/gitbranchdiff"
+GIT_MEMORY_CACHE_ENTRIES = 50000 # parsed diffs and histories kept in each worker process
+GIT_MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+GIT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024 # least recently used entries are collected above this
+GIT_CACHE_MAX_AGE = 90 * 86400 # seconds, entries unused for longer are collected
+GIT_CACHE_SWEEP_INTERVAL = 0 # seconds between background collections in each worker, 0 leaves it to 'manage.py gcdiffcache'
 GIT_DIFF_OPTIONS = "-M -C --ignore-space-at-eol"
 GIT_DEFAULT_BASEBRANCH = "basekit/ml"
+GIT_WORKER_THREADS = 16 # concurrent git diffs when filling the matrix, 1 runs them in sequence
+GIT_DIFF_BUCKETED = True # one numstat diff per commit pair for all GIT_DIRECTORIES instead of one per directory
+GIT_HISTORY_LEN = 30 # most points in a history, they go on the days either branch changed the directory
+GIT_HISTORY_SPAN = datetime.timedelta(90) # how far a history goes back from the newer of the two commits
+GIT_TIMELINE_DAILY_DAYS = 180 # branch timelines keep every point this young, older ones are rolled up to the last of their week
+GIT_TIMELINE_WEEKLY_DAYS = 730 # and older than this to the last of their month
+GIT_TIMELINE_ROLLUP_INTERVAL = 86400 # seconds between those rollups in each worker, run by the next timeline update, 0 leaves them to 'manage.py gcdiffcache'
+GIT_HISTORY_CUBE = True # matrix timelines from a memory-mapped array of daily totals shared by the workers, needs numpy
+GIT_HTTP_MAX_AGE = 0 # seconds a browser may show a page without asking, after that it revalidates with the page's ETag
+GIT_TIMELINE_WAIT = 5 # seconds a timeline request waits, after that the page asks again while the history is computed in the background
+GIT_TIMELINE_MAX_POINTS = 2000 # most points a page may ask a timeline to be thinned to
+GIT_TIMELINE_POINTS_STEP = 100 # the points asked for are rounded up to this, so pages of similar widths share cached timelines
 
 if platform.system() is "Windows":
 	GIT_REPO_DIR = "D:\\code\\basekit-animation"
 	GIT_USE_REMOTE_BRANCH = True
-	GIT_DIFF_CACHE_DIR = "D:\\temp\\gitbranchdiff"
 
 GIT_BRANCHES = [ 
 	"ant15/dl",
@@ -55,37 +78,97 @@ def int_safe(n):
 def die(msg):
     raise Exception(msg)
 		
-def read_pipe(c, ignore_error=False):
-    pipe = os.popen(c, 'rb')
-    val = pipe.read()
-    if pipe.close() and not ignore_error:
+def read_pipe(c, ignore_error=False, cwd=None):
+    pipe = subprocess.Popen(c, shell=True, cwd=cwd, stdout=subprocess.PIPE)
+    val = pipe.stdout.read()
+    if pipe.wait() and not ignore_error:
         die('Command failed: %s' % c)
 
     return val
 	
-def read_pipe_lines(c):  
-	pipe = os.popen(c, 'rb')
-	val = pipe.readlines()
-	if pipe.close():
-		die('Command failed: %s' % c)
+# bytes read from a pipe at a time, streamed output never holds more than this and one unfinished field
+PIPE_CHUNK_BYTES = 64 * 1024
 
-	return val	
+def read_pipe_chunks(c, cwd=None):
+	"""Yields the output of 'c' as it arrives, in chunks of at most PIPE_CHUNK_BYTES."""
+	pipe = subprocess.Popen(c, shell=True, cwd=cwd, stdout=subprocess.PIPE)
+	finished = False
+	try:
+		while True:
+			chunk = os.read(pipe.stdout.fileno(), PIPE_CHUNK_BYTES)
+			if not chunk:
+				break
+			yield chunk
+		finished = True
+	finally:
+		# a reader that stopped early closes the pipe, the command exits on SIGPIPE
+		pipe.stdout.close()
+		if pipe.wait() and finished:
+			die('Command failed: %s' % c)
+
+def read_pipe_fields(c, cwd=None, separator="\0"):
+	"""Yields the 'separator' terminated fields of the output of 'c' as they arrive."""
+	rest = ""
+	for chunk in read_pipe_chunks(c, cwd):
+		fields = (rest + chunk).split(separator)
+		rest = fields.pop()
+		for field in fields:
+			yield field
+	if rest:
+		yield rest
+
+# bounded pool shared by every request, created on first use
+workerPool = None
+workerPoolLock = threading.Lock()
+
+def getWorkerPool():
+	global workerPool
+	workerPoolLock.acquire()
+	try:
+		if workerPool is None:
+			# the work happens in git child processes, so threads are enough to keep the cores busy
+			workerPool = ThreadPool( GIT_WORKER_THREADS )
+	finally:
+		workerPoolLock.release()
+	return workerPool
+
+def parallelMap(func, items):
+	"""map() on the worker pool, results come back in the order of 'items'."""
+	if GIT_WORKER_THREADS <= 1 or len(items) <= 1:
+		return map(func, items)
+	return getWorkerPool().map(gitbatch.carryForkStats(func), items)
 	
+# git runs in GIT_REPO_DIR as its own working directory, never os.chdir() as worker threads share the process
 def git_cmd(cmd):
-	os.chdir(GIT_REPO_DIR);
 	print "git: " + cmd
-	return read_pipe("git " + cmd, False)
+	gitbatch.addFork()
+	return read_pipe("git " + cmd, False, GIT_REPO_DIR)
 	
-def git_cmdMultiline(cmd):
-	os.chdir(GIT_REPO_DIR);
+def git_cmdFields(cmd):
 	print "git: " + cmd
-	return read_pipe_lines("git " + cmd)
+	gitbatch.addFork()
+	return read_pipe_fields("git " + cmd, GIT_REPO_DIR)
+
+# persistent cat-file processes for object and rev lookups, started on first use
+gitBatch = gitbatch.GitBatch( GIT_REPO_DIR )
+
+def git_printForkStats(name, forkStats):
+	print "%s: %d git forks, %d lookups served by cat-file batch (forks saved)" % (name, forkStats.forks, forkStats.saved)
+
+def git_getBranchName(branch):
+	return branch if not GIT_USE_REMOTE_BRANCH else "origin/" + branch
 
 def git_getCommit(branch):
-	branchName = branch if not GIT_USE_REMOTE_BRANCH else "origin/" + branch
-	return git_cmd("rev-parse %s" % branchName).strip();
+	commit = gitBatch.revParse( git_getBranchName(branch) )
+	if not commit:
+		# let rev-parse report the bad revision
+		commit = git_cmd("rev-parse %s" % git_getBranchName(branch)).strip();
+	return commit
 	
 def git_getShortLog(commit):
+	commitObject = gitBatch.getCommit( commit )
+	if commitObject:
+		return (" " + gitbatch.commitSubject( commitObject ))[:40]
 	output = git_cmd("log %s --pretty=oneline -n 1" % commit).strip();
 	log = re.match(r"\w+(.*)", output).group(1)
 	return log[:40]
@@ -95,10 +178,20 @@ def git_getCommitInfo(commit):
 	return output
 	
 def get_getCommitTimestamp(commit):
+	commitObject = gitBatch.getCommit( commit )
+	if commitObject:
+		return commitObject['timestamp']
 	output = git_cmd("rev-list %s --timestamp -n 1" % commit).strip()
 	return int_safe( output.split()[0] );
 	
-def git_getBranch(commit):
+def git_getBranch(commit, refs=None):
+	# a branch tip names itself, only fall back to name-rev for older commits
+	if refs is None:
+		refs = RefSnapshot()
+	branch = refs.getBranch( commit )
+	if branch:
+		return branch
+
 	branchRaw = git_cmd("name-rev --name-only %s" % commit).strip();
 	branch = branchRaw
 	match = re.match(r"remotes/origin/(.*)", branchRaw)
@@ -106,263 +199,1089 @@ def git_getBranch(commit):
 		branch = match.group(1)	
 	return branch
 
+class RefSnapshot( object ):
+	"""The tips of every branch, read with a single 'git for-each-ref'.
+
+	Create one per request and pass it along, so everything in the request sees
+	the same set of tips.
+	"""
+	def __init__( self ):
+		self.refs = {}
+		output = git_cmd("for-each-ref --format=\"%(objectname) %(refname)\" refs/heads refs/remotes/origin")
+		for line in output.splitlines():
+			fields = line.split(" ", 1)
+			if len(fields) == 2:
+				self.refs[fields[1]] = fields[0]
+
+	def getRefName( self, branch ):
+		return "refs/heads/" + branch if not GIT_USE_REMOTE_BRANCH else "refs/remotes/origin/" + branch
+
+	def getCommit( self, branch ):
+		commit = self.refs.get( self.getRefName(branch) )
+		if not commit:
+			# not a branch (a tag or a sha), resolve it the slow way and remember it
+			commit = git_getCommit( branch )
+			self.refs[ self.getRefName(branch) ] = commit
+		return commit
+
+	def getTip( self, branch ):
+		"""The tip of 'branch' in the snapshot, or None."""
+		return self.refs.get( self.getRefName(branch) )
+
+	def resolve( self, name ):
+		"""The commit 'name' stands for, "" if none: a branch is its tip in the snapshot,
+		anything else (a sha, a tag) a plain revision, never looked for under origin/.
+		"""
+		if not name:
+			return ""
+		return self.getTip( name ) or gitBatch.revParse( name + "^{commit}" )
+
+	def getTips( self ):
+		"""(ref name, commit) of every configured branch that exists."""
+		tips = []
+		for branch in GIT_BRANCHES:
+			refName = self.getRefName(branch)
+			if refName in self.refs:
+				tips.append( (refName, self.refs[refName]) )
+		return tips
+
+	def getBranch( self, commit ):
+		"""The configured branch whose tip is 'commit', or None."""
+		for branch in GIT_BRANCHES:
+			if self.refs.get( self.getRefName(branch) ) == commit:
+				return branch
+		return None
+
 def getBranchFilesDifference(branch0Commit, branch1Commit, directory):
 	# get file differences
-	output = git_cmdMultiline("diff %s --numstat %s %s -- %s" % (GIT_DIFF_OPTIONS, branch0Commit, branch1Commit, directory));
 	fileList=[]
 	totalInsertions = 0
 	totalDeletions = 0
-	for line in output:
-		match = re.match(r"(\d+).*?(\d+)\s+(.*)", line);
-		insertions = 0
-		deletions = 0
-		filePath = ""
-		if match:
-			insertions = int_safe( match.group(1) )
-			deletions = int_safe( match.group(2) )	
-			filePath = match.group(3)
-		fileList.append( {"insertions":insertions, "deletions":deletions, "total":insertions+deletions, "file":filePath} )
-		totalInsertions += insertions
-		totalDeletions += deletions
+	for record in git_getFileDifferences( branch0Commit, branch1Commit, [directory] ):
+		fileList.append( record )
+		totalInsertions += record.insertions
+		totalDeletions += record.deletions
 		
 	diff = { "fileList":fileList, "insertions":totalInsertions, "deletions":totalDeletions, "total":totalInsertions+totalDeletions }
 	return diff;
 
+def createLinesDifference(commit0, commit1, directory, insertions, deletions, filesChanged):
+	return {"insertions": insertions, "deletions": deletions, "total":insertions+deletions, "filesChanged": filesChanged, "compareCommit": commit1, "baseCommit": commit0, "directory": directory};
+
+def git_getLinesDifference(commit0, commit1, directory):
+	# sum the per file counts, most of them come from the blob diff cache
+	insertions = 0
+	deletions = 0
+	filesChanged = 0
+	for record in git_getFileDifferences( commit0, commit1, [directory] ):
+		insertions += record.insertions
+		deletions += record.deletions
+		filesChanged += 1
+	return createLinesDifference( commit0, commit1, directory, insertions, deletions, filesChanged )
+
+class NumstatRecord( object ):
+	"""One file of a 'git diff --numstat' listing, the diff page shows these as its file list."""
+	__slots__ = ('insertions', 'deletions', 'oldPath', 'path', 'binary')
+
+	def __init__( self, insertions, deletions, oldPath, path, binary ):
+		self.insertions = insertions
+		self.deletions = deletions
+		self.oldPath = oldPath
+		self.path = path
+		self.binary = binary
+
+	@property
+	def total( self ):
+		return self.insertions + self.deletions
+
+	@property
+	def file( self ):
+		if self.oldPath is not None:
+			return "%s => %s" % (self.oldPath, self.path)
+		return self.path
+
+def parseNumstatZ(fields):
+	"""Yields a NumstatRecord for every file in 'git diff --numstat -z' output split at the NULs.
+
+	Binary files count as 0 lines, oldPath is None unless the entry is a rename or copy.
+	"""
+	fields = iter(fields)
+	for field in fields:
+		counts = field.split("\t", 2)
+		if len(counts) != 3:
+			continue
+		oldPath = None
+		path = counts[2]
+		if not path:
+			# renames and copies put "\0old\0new" after the counts
+			oldPath = next(fields)
+			path = next(fields)
+		binary = counts[0] == "-"
+		yield NumstatRecord( int_safe( counts[0] ), int_safe( counts[1] ), oldPath, path, binary )
+
+def parseRawZ(fields):
+	"""Yields (oldMode, newMode, oldBlob, newBlob, status, oldPath, path) for every entry in
+	'git diff-tree -r -z' output split at the NULs.
+
+	oldPath is None unless the entry is a rename or copy.
+	"""
+	fields = iter(fields)
+	for field in fields:
+		meta = field.split()
+		if len(meta) != 5 or not meta[0].startswith(":"):
+			continue
+		oldPath = None
+		status = meta[4][0]
+		if status in "RC":
+			# "R086\0old\0new"
+			oldPath = next(fields)
+		path = next(fields)
+		yield (meta[0][1:], meta[1], meta[2], meta[3], status, oldPath, path)
+
+# raw entries whose line counts are looked up, diffed and cached together, memory stays bounded by this however large the diff
+BLOB_DIFF_BATCH_ENTRIES = 1024
+# paths of renames and copies a numstat diff names at a time, keeps it under git's rename limit
+BLOB_DIFF_MAX_PATHS = 256
+# bytes of paths a numstat diff names at a time, the shell gets the command as one argument and Linux limits that to 128k
+BLOB_DIFF_MAX_PATH_BYTES = 64 * 1024
+
+def getEntryPaths(entries):
+	paths = []
+	for entry in entries:
+		if entry[5] is not None:
+			paths.append( entry[5] )
+		paths.append( entry[6] )
+	return paths
+
+def getEntryGroups(entries, maxPaths):
+	"""Splits 'entries' into groups naming at most maxPaths paths and BLOB_DIFF_MAX_PATH_BYTES of them."""
+	groups = []
+	group = []
+	paths = 0
+	size = 0
+	for entry in entries:
+		entryPaths = getEntryPaths( [entry] )
+		entrySize = sum( [len(path) + 3 for path in entryPaths] )
+		if group and (paths + len(entryPaths) > maxPaths or size + entrySize > BLOB_DIFF_MAX_PATH_BYTES):
+			groups.append( group )
+			group = []
+			paths = 0
+			size = 0
+		group.append( entry )
+		paths += len(entryPaths)
+		size += entrySize
+	if group:
+		groups.append( group )
+	return groups
+
+def git_getNumstat(commit0, commit1, options, paths):
+	"""Yields the NumstatRecords of a numstat diff with GIT_DIFF_OPTIONS and 'options' limited to 'paths'."""
+	return parseNumstatZ( git_cmdFields("diff %s %s --numstat -z %s %s -- %s" % (GIT_DIFF_OPTIONS, options, commit0, commit1,
+																				" ".join( [pipes.quote( path ) for path in paths] ))) )
+
+def git_getBlobDiffs(commit0, commit1, entries):
+	"""The (insertions, deletions, binary) of the entries' blob pairs, keyed by pair, from numstat diffs limited to their paths.
+
+	The entries the whole diff paired with no other are diffed with --no-renames, so a limited diff cannot find
+	renames the whole diff skipped at git's rename limit. Renames and copies are diffed as they are, BLOB_DIFF_MAX_PATHS
+	paths at a time, see getEntryGroups(). The counts of the entries these diffs pair like the raw diff go to the
+	blob diff cache, an entry one of them pairs differently is diffed again on its own paths.
+	"""
+	groups = [(group, "--no-renames") for group in getEntryGroups( [entry for entry in entries if entry[5] is None], BLOB_DIFF_BATCH_ENTRIES )]
+	groups += [(group, "") for group in getEntryGroups( [entry for entry in entries if entry[5] is not None], BLOB_DIFF_MAX_PATHS )]
+
+	blobDiffs = []
+	unpaired = []
+	for group, options in groups:
+		keys = set( [(entry[5], entry[6]) for entry in group] )
+		found = {}
+		for record in git_getNumstat( commit0, commit1, options, getEntryPaths( group ) ):
+			if (record.oldPath, record.path) in keys:
+				found[ (record.oldPath, record.path) ] = record
+		for oldMode, newMode, oldBlob, newBlob, status, oldPath, path in group:
+			record = found.get( (oldPath, path) )
+			if record is not None:
+				blobDiffs.append( (oldBlob, newBlob, record.insertions, record.deletions, record.binary) )
+			elif status == "M" and oldMode == newMode:
+				# numstat leaves out modifications GIT_DIFF_OPTIONS hide completely
+				blobDiffs.append( (oldBlob, newBlob, 0, 0, False) )
+			else:
+				unpaired.append( (oldMode, newMode, oldBlob, newBlob, status, oldPath, path) )
+	writeBlobDiffsToCache( blobDiffs )
+
+	counts = {}
+	for oldBlob, newBlob, insertions, deletions, binary in blobDiffs:
+		counts[ (oldBlob, newBlob) ] = (insertions, deletions, binary)
+	for entry in unpaired:
+		# what a plain diff of the entry's own paths gives, not cached as it may not be the pair's
+		insertions = 0
+		deletions = 0
+		binary = False
+		for record in git_getNumstat( commit0, commit1, entry[5] is None and "--no-renames" or "", getEntryPaths( [entry] ) ):
+			insertions += record.insertions
+			deletions += record.deletions
+			binary = binary or record.binary
+		counts[ (entry[2], entry[3]) ] = (insertions, deletions, binary)
+	return counts
+
+def getBatchFileDifferences(commit0, commit1, entries):
+	"""Yields a NumstatRecord for every raw entry of the batch that numstat would list."""
+	counts = getBlobDiffsFromCache( [(entry[2], entry[3]) for entry in entries] )
+	missing = [entry for entry in entries if (entry[2], entry[3]) not in counts]
+	if missing:
+		counts.update( git_getBlobDiffs( commit0, commit1, missing ) )
+
+	for oldMode, newMode, oldBlob, newBlob, status, oldPath, path in entries:
+		insertions, deletions, binary = counts[ (oldBlob, newBlob) ]
+		if status == "M" and oldMode == newMode and not insertions and not deletions and not binary:
+			continue
+		yield NumstatRecord( insertions, deletions, oldPath, path, binary )
+
+def git_getFileDifferences(commit0, commit1, directories):
+	"""Yields a NumstatRecord for every file 'git diff --numstat' lists in 'directories'.
+
+	A raw diff-tree names the blob pairs, their line counts come from the blob diff cache, and only
+	pairs it has never seen go to numstat diffs limited to their paths. The entries are taken
+	BLOB_DIFF_BATCH_ENTRIES at a time as the raw diff streams in, so a large diff is never held whole.
+	"""
+	batch = []
+	for entry in getRawDiffEntries( commit0, commit1, directories ):
+		batch.append( entry )
+		if len(batch) >= BLOB_DIFF_BATCH_ENTRIES:
+			for record in getBatchFileDifferences( commit0, commit1, batch ):
+				yield record
+			batch = []
+	if batch:
+		for record in getBatchFileDifferences( commit0, commit1, batch ):
+			yield record
+
+def getPathDirectories(path, directories):
+	return [directory for directory in directories if path.startswith( directory.rstrip("/") + "/" )]
+
+def git_getLinesDifferences(commit0, commit1, directories):
+	"""One file diff over all 'directories', bucketed into per directory differences by path prefix."""
+	counts = dict([(directory, [0, 0, 0]) for directory in directories])
+	crossDirectories = set()
+	for record in git_getFileDifferences( commit0, commit1, directories ):
+		pathDirectories = getPathDirectories( record.path, directories )
+		if record.oldPath is not None:
+			oldPathDirectories = getPathDirectories( record.oldPath, directories )
+			if oldPathDirectories != pathDirectories:
+				# a per directory diff would not pair these, so it sees an add and a delete instead
+				crossDirectories.update( oldPathDirectories + pathDirectories )
+		for directory in pathDirectories:
+			count = counts[directory]
+			count[0] += record.insertions
+			count[1] += record.deletions
+			count[2] += 1
+
+	diffs = []
+	for directory in directories:
+		if directory in crossDirectories:
+			diffs.append( git_getLinesDifference( commit0, commit1, directory ) )
+		else:
+			count = counts[directory]
+			diffs.append( createLinesDifference( commit0, commit1, directory, count[0], count[1], count[2] ) )
+	return diffs
+
+def getBranchCommitLinesDifferences(commit0, commit1, directories, cachedDiffs=None):
+	"""Returns the differences for every directory, diffing the cache misses in one git run.
+
+	cachedDiffs is an optional result of getDiffsFromCache() that already holds this pair.
+	"""
+	if cachedDiffs is None:
+		cachedDiffs = getDiffsFromCache(commit0, [commit1], directories)
+	diffs = [cachedDiffs.get( (commit1, directory), {} ) for directory in directories]
+	missing = [directories[x] for x in range(len(directories)) if not diffs[x]]
+
+	if missing:
+		def lookup():
+			foundDiffs = getDiffsFromCache( commit0, [commit1], missing )
+			if len(foundDiffs) != len(missing):
+				return None
+			return [foundDiffs[ (commit1, directory) ] for directory in missing]
+
+		def compute():
+			if GIT_DIFF_BUCKETED:
+				missingDiffs = git_getLinesDifferences( commit0, commit1, missing )
+			else:
+				missingDiffs = [git_getLinesDifference( commit0, commit1, directory ) for directory in missing]
+			writeDiffsToCache( missingDiffs )
+			return missingDiffs
+
+		for diff in computeOnce( ('diffs', commit0, commit1, GIT_DIFF_OPTIONS), lookup, compute ):
+			diffs[directories.index( diff['directory'] )] = diff
+	return diffs
+
 def getBranchCommitLinesDifference(commit0, commit1, directory):
 	diff = getDiffLinesFromCache(commit0, commit1, directory)
 
 	if not diff:
-		# get lines of difference
-		output = git_cmd("diff %s --shortstat %s %s -- %s" % (GIT_DIFF_OPTIONS, commit0, commit1, directory));
+		if GIT_DIFF_BUCKETED and directory in GIT_DIRECTORIES:
+			# the other directories come for free, they are cached for the rest of the matrix or history
+			return getBranchCommitLinesDifferences(commit0, commit1, GIT_DIRECTORIES)[GIT_DIRECTORIES.index(directory)]
 
-		# parse output
-		match = re.match(".*?(\d+) files changed.*?(\d+) insertions.*?(\d+) deletions", output);
-		insertions = 0
-		deletions = 0
-		filesChanged = 0
-		if match:
-			filesChanged = int_safe( match.group(1) )
-			insertions = int_safe( match.group(2) )
-			deletions = int_safe( match.group(3) )
+		def compute():
+			diff = git_getLinesDifference(commit0, commit1, directory)
+			writeDiffLinesToCache( diff )
+			return diff
 
-		diff = {"insertions": insertions, "deletions": deletions, "total":insertions+deletions, "filesChanged": filesChanged, "compareCommit": commit1, "baseCommit": commit0, "directory": directory};
-		
-		writeDiffLinesToCache( diff )
+		diff = computeOnce( ('diff', commit0, commit1, directory, GIT_DIFF_OPTIONS),
+							lambda: getDiffLinesFromCache(commit0, commit1, directory) or None, compute )
 	return diff;
 	
-def getDiffHistory( baseCommit, compareCommit, directory ):
-	historyLen = 30
-	timeDelta = datetime.timedelta(3) # 3 days
+# ------------------- Incremental Diffs ----------------------------------------------------------------------------------
+# A branch that moved by a few commits keeps most of its diff against the base, so the raw entries of a cached
+# pair are updated with a diff of the paths that changed since, together with every path renames and copies can pair.
+INCREMENTAL_DIFF_DEPTH = 16 # first-parent ancestors searched for a cached pair
+RAW_DIFF_MAX_ENTRIES = 4096 # raw diffs with more entries are not kept, they stream from git every time
+INCREMENTAL_DIFF_MAX_PATHS = BLOB_DIFF_MAX_PATHS # paths to diff again above this diff the whole directories, keeps it under git's rename limit
+
+def getRawDiffKey(commit0, commit1, directories):
+	return ('raw diff', commit0, commit1, tuple(directories), GIT_DIFF_OPTIONS)
+
+def git_getRawDiffEntries(commit0, commit1, directories):
+	"""Yields the raw entries as git lists them, and keeps them like getRawDiffEntries() unless there are more than RAW_DIFF_MAX_ENTRIES."""
+	entries = []
+	for entry in parseRawZ( git_cmdFields("diff-tree -r -z --no-abbrev %s %s %s -- %s" % (GIT_DIFF_OPTIONS, commit0, commit1, " ".join(directories))) ):
+		if entries is not None:
+			entries.append( entry )
+			if len(entries) > RAW_DIFF_MAX_ENTRIES:
+				entries = None
+		yield entry
+	if entries is not None:
+		diffStore.putRawDiff( entries, commit0, commit1, directories, GIT_DIFF_OPTIONS )
+		keepRawDiffEntries( entries, commit0, commit1, directories )
+
+def getRawDiffEntries(commit0, commit1, directories):
+	"""The parseRawZ() entries of commit0 against commit1 in 'directories', kept in the memory cache and the diff store.
+
+	Diffs of more than RAW_DIFF_MAX_ENTRIES entries are not kept, they come as a stream from git.
+	"""
+	key = getRawDiffKey( commit0, commit1, directories )
+	entries = memoryCache.get( key )
+	if entries is not None:
+		diffStore.touch( "rawDiffs", (commit0, commit1, "\t".join( directories ), GIT_DIFF_OPTIONS) )
+		diffStore.countLookups( "rawDiffs", 1, 0 )
+		return entries
+
+	entries = diffStore.getRawDiffs( [(commit0, commit1)], directories, GIT_DIFF_OPTIONS ).get( (commit0, commit1) )
+	diffStore.countLookups( "rawDiffs", entries is not None and 1 or 0, entries is None and 1 or 0 )
+	if entries is None:
+		entries = git_updateRawDiffEntries( commit0, commit1, directories )
+		if entries is None:
+			return git_getRawDiffEntries( commit0, commit1, directories )
+		if len(entries) > RAW_DIFF_MAX_ENTRIES:
+			# a kept list could only grow with every update from it
+			return entries
+		diffStore.putRawDiff( entries, commit0, commit1, directories, GIT_DIFF_OPTIONS )
+	keepRawDiffEntries( entries, commit0, commit1, directories )
+	return entries
+
+def keepRawDiffEntries(entries, commit0, commit1, directories):
+	"""Puts the raw entries in the memory cache.
+
+	Lists of several directories are also kept per directory, for each directory no rename
+	or copy crosses, so a later diff of one of them finds them.
+	"""
+	memoryCache.put( getRawDiffKey( commit0, commit1, directories ), entries )
+	if len(directories) > 1:
+		directoryEntries = dict( [(directory, []) for directory in directories] )
+		for entry in entries:
+			pathDirectories = getPathDirectories( entry[6], directories )
+			if entry[5] is not None and getPathDirectories( entry[5], directories ) != pathDirectories:
+				for directory in getPathDirectories( entry[5], directories ) + pathDirectories:
+					directoryEntries.pop( directory, None )
+			for directory in pathDirectories:
+				if directory in directoryEntries:
+					directoryEntries[directory].append( entry )
+		for directory, directoryList in directoryEntries.items():
+			memoryCache.put( getRawDiffKey( commit0, commit1, [directory] ), directoryList )
+
+def getFirstParentAncestors(commit):
+	"""Up to INCREMENTAL_DIFF_DEPTH first-parent ancestors of 'commit', nearest first, if a branch or commit index has it."""
+	commitIndexLock.acquire()
+	try:
+		for index in branchIndexes.values() + commitIndexes.values():
+			position = index.find( commit )
+			if position >= 0:
+				return index.commits[position + 1:position + 1 + INCREMENTAL_DIFF_DEPTH]
+	finally:
+		commitIndexLock.release()
+	return []
+
+def getCachedRawDiff(commitPairs, directories):
+	"""(pair, entries) of the first pair in 'commitPairs' with cached raw entries, (None, None) if none has them."""
+	for pair in commitPairs:
+		entries = memoryCache.get( getRawDiffKey( pair[0], pair[1], directories ) )
+		if entries is not None:
+			return pair, entries
+	storedDiffs = diffStore.getRawDiffs( commitPairs, directories, GIT_DIFF_OPTIONS )
+	for pair in commitPairs:
+		if pair in storedDiffs:
+			return pair, storedDiffs[pair]
+	return None, None
+
+def getRenameOptions():
+	"""(copies, breaks): whether GIT_DIFF_OPTIONS detect copies and break rewrites."""
+	copies = False
+	breaks = False
+	for option in GIT_DIFF_OPTIONS.split():
+		if option.startswith("-C") or option.startswith("--find-copies"):
+			copies = True
+		elif option.startswith("-B") or option.startswith("--break-rewrites"):
+			breaks = True
+	return copies, breaks
+
+def git_updateRawDiffEntries(commit0, commit1, directories):
+	"""The raw entries of commit0 against commit1 from a cached pair where one of them is a nearby first-parent ancestor.
+
+	Modified entries of paths that did not change since the cached pair are carried over. The changed
+	paths are diffed again, together with the paths of every other entry, as those are the rename and
+	copy candidates whose pairing can change. A modified path that did not change is only a copy source,
+	and no better source than before for a destination that did not change either. Returns None if there
+	is no cached pair, or if a changed path is now a rename or copy destination whose source could lie
+	outside the paths diffed again.
+	"""
+	copies, breaks = getRenameOptions()
+	if breaks:
+		return None
+
+	commitPairs = [(commit0, ancestor) for ancestor in getFirstParentAncestors( commit1 )] + \
+				[(ancestor, commit1) for ancestor in getFirstParentAncestors( commit0 )]
+	if not commitPairs:
+		return None
+	previous, entries = getCachedRawDiff( commitPairs, directories )
+	if entries is None:
+		return None
+
+	if previous[1] != commit1:
+		moved = (previous[1], commit1)
+	else:
+		moved = (previous[0], commit0)
+	changed = set( [entry[6] for entry in parseRawZ( git_cmdFields("diff-tree -r -z --no-abbrev --no-renames %s %s -- %s" % (moved[0], moved[1], " ".join(directories))) )] )
+	if not changed:
+		return entries
+
+	paths = set( changed )
+	for entry in entries:
+		if entry[4] != "M":
+			paths.add( entry[6] )
+			if entry[5] is not None:
+				paths.add( entry[5] )
+	kept = [entry for entry in entries if entry[4] == "M" and entry[6] not in paths]
+	if len(paths) > INCREMENTAL_DIFF_MAX_PATHS:
+		return None
+
+	updated = list( parseRawZ( git_cmdFields("diff-tree -r -z --no-abbrev %s %s %s -- %s" % (GIT_DIFF_OPTIONS, commit0, commit1,
+																				" ".join( [pipes.quote( path ) for path in sorted( paths )] ))) ) )
+	if copies:
+		for entry in updated:
+			if entry[4] in "ACR" and entry[6] in changed:
+				# any modified file is a copy source for it, the kept ones were not diffed again
+				return None
+
+	entries = kept + updated
+	entries.sort( key=lambda entry: entry[6] )
+	return entries
+
+# ------------------- Commit Index ----------------------------------------------------------------------------------
+COMMIT_INDEX_CACHE_SIZE = 64 # indexes kept for commits that are on none of the configured branches
+
+branchIndexes = {} # ref name -> FirstParentIndex of its tip, persisted under GIT_DIFF_CACHE_DIR/index
+commitIndexes = {}
+commitIndexLock = threading.Lock()
+
+def git_getFirstParentEntries(revs):
+	"""(timestamp, commit, first parent) of every first-parent commit in 'revs', newest first."""
+	output = git_cmd("rev-list %s --first-parent --timestamp --parents" % revs)
+	entries = []
+	for line in output.splitlines():
+		fields = line.split()
+		if len(fields) >= 2:
+			entries.append( (int_safe( fields[0] ), fields[1], fields[2] if len(fields) > 2 else "") )
+	return entries
+
+def getBranchIndexPath(refName):
+	h = hashlib.md5()
+	h.update(refName)
+	return os.path.join(GIT_DIFF_CACHE_DIR, "index", h.hexdigest() + ".idx")
+
+def updateBranchIndex(refName, tip):
+	index = branchIndexes.get( refName )
+	if index is None:
+		index = FirstParentIndex.read( getBranchIndexPath( refName ) )
+	if index is not None and index.getTip() == tip:
+		branchIndexes[refName] = index
+		return index
+
+	if index is not None:
+		# only walk the commits the tip has advanced by
+		try:
+			newEntries = git_getFirstParentEntries( "%s ^%s" % (tip, index.getTip()) )
+		except Exception:
+			newEntries = []
+		if newEntries and newEntries[-1][2] == index.getTip():
+			index = index.prepend( [(entry[0], entry[1]) for entry in newEntries] )
+		else:
+			# rewound or rewritten, start again
+			index = None
+	if index is None:
+		index = FirstParentIndex( [(entry[0], entry[1]) for entry in git_getFirstParentEntries( tip )] )
+
+	indexPath = getBranchIndexPath( refName )
+	initcache( os.path.dirname( indexPath ) )
+	index.write( indexPath )
+	branchIndexes[refName] = index
+	return index
+
+def updateBranchIndexes(refs):
+	"""Brings the index of every branch in 'refs' up to its tip."""
+	commitIndexLock.acquire()
+	try:
+		for refName, tip in refs.getTips():
+			updateBranchIndex( refName, tip )
+	finally:
+		commitIndexLock.release()
+
+def getFirstParentIndex(commit, refs=None):
+	"""The first-parent index starting at 'commit'.
+
+	Commits on a configured branch come out of that branch's persistent index,
+	brought up to the tips in 'refs' first. Anything else is walked once and kept in memory.
+	"""
+	if refs is not None:
+		updateBranchIndexes( refs )
+
+	commitIndexLock.acquire()
+	try:
+		for index in branchIndexes.values():
+			view = index.fromCommit( commit )
+			if view is not None:
+				return view
+
+		index = commitIndexes.get( commit )
+		if index is None:
+			index = FirstParentIndex( [(entry[0], entry[1]) for entry in git_getFirstParentEntries( commit )] )
+			if len(commitIndexes) >= COMMIT_INDEX_CACHE_SIZE:
+				commitIndexes.clear()
+			commitIndexes[commit] = index
+		return index
+	finally:
+		commitIndexLock.release()
+
+def getEndOfDayTimestamp(date):
+	return int( time.mktime( (date + datetime.timedelta(1)).timetuple() ) ) - 1
+
+def getDiffHistory( baseCommit, compareCommit, directory, refs=None, cachedHistories=None ):
+	historyLen = GIT_HISTORY_LEN
+	historySpan = GIT_HISTORY_SPAN
 	
-	diffList = getDiffHistoryFromCache( baseCommit, compareCommit, directory, historyLen, timeDelta )
+	if cachedHistories is not None:
+		diffList = cachedHistories.get( (compareCommit, directory), [] )
+	else:
+		diffList = getDiffHistoryFromCache( baseCommit, compareCommit, directory, historyLen, historySpan )
 
 	if not diffList:
-		commit0List = []
-		commit1List = []
-		
-		commit0Timestamp = get_getCommitTimestamp(baseCommit);
-		commit1Timestamp = get_getCommitTimestamp(compareCommit);
-		startDate = datetime.date.fromtimestamp( commit0Timestamp if commit0Timestamp > commit1Timestamp else commit1Timestamp )
-		
-		date = startDate
-		for x in range(historyLen):
-			output0 = git_cmd("rev-list %s --first-parent --until=%s --reverse -n 1" % (baseCommit, date.isoformat())).strip();
-			if not output0:
-				break
-			commit0List.append( (output0, date) )
-			output1 = git_cmd("rev-list %s --first-parent --until=%s --reverse -n 1" % (compareCommit, date.isoformat())).strip();
-			commit1List.append( (output1, date) )
-			date -= timeDelta
-
-		diffList = []
-		for x in range(len(commit0List)):
-			curCommit0 = commit0List[x]
-			curCommit1 = commit1List[x]
-			diff = getBranchCommitLinesDifference(curCommit0[0], curCommit1[0], directory)
-			diffList.append( {'total':diff['total'], 'date':curCommit0[1], 'baseCommit':curCommit0[0], 'compareCommit':curCommit1[0], 'directory':directory } )
-			
-			
-		writeDiffHistoryToCache( diffList, baseCommit, compareCommit, directory, timeDelta )
-		
+		lockKey = ('history', baseCommit, compareCommit, directory, GIT_DIFF_OPTIONS, historyLen, historySpan)
+		diffList = computeOnce( lockKey, lambda: getDiffHistoryFromCache( baseCommit, compareCommit, directory, historyLen, historySpan ) or None,
+								lambda: computeDiffHistory( baseCommit, compareCommit, directory, refs, historyLen, historySpan ) )
 	return diffList
+
+def getDirectoryChangeDates( index, directory, timestamp ):
+	"""The dates of the first-parent commits in 'index' newer than 'timestamp' that changed 'directory'.
+
+	A commit changed it if the directory's tree differs from the one of the commit before it,
+	the trees of the whole stretch are looked up in one batch.
+	"""
+	entries = index.entriesSince( timestamp )
+	trees = getDirectoryTrees( [commit for entryTimestamp, commit in entries], [directory] )
+	dates = set()
+	for x in range(len(entries) - 1):
+		if trees[ (entries[x][1], directory) ] != trees[ (entries[x + 1][1], directory) ]:
+			dates.add( datetime.date.fromtimestamp( entries[x][0] ) )
+	return dates
+
+def getHistoryDates( startDate, endDate, changeDates, historyLen ):
+	"""The days of a history from startDate back to endDate, newest first.
+
+	Both ends and the change days in between are kept. With more than historyLen, the span is cut
+	into equal stretches and each keeps its newest change day only.
+	"""
+	changeDates = sorted( [date for date in changeDates if endDate < date < startDate], reverse=True )
+	buckets = historyLen - 2
+	if buckets <= 0:
+		changeDates = []
+	elif len(changeDates) > buckets:
+		days = (startDate - endDate).days
+		bucketDates = {}
+		for date in changeDates:
+			bucket = (startDate - date).days * buckets // days
+			if bucket not in bucketDates:
+				bucketDates[bucket] = date
+		changeDates = sorted( bucketDates.values(), reverse=True )
+	dates = [startDate] + changeDates
+	if endDate < startDate and historyLen > 1:
+		dates.append( endDate )
+	return dates
+
+def getHistoryWindow( commit0Index, commit1Index, historySpan ):
+	"""The (startDate, endDate) of a history: the day of the newer tip, and historySpan before it but no further back than both branches go."""
+	commit0Timestamp = commit0Index.getTimestamp();
+	commit1Timestamp = commit1Index.getTimestamp();
+	startDate = datetime.date.fromtimestamp( commit0Timestamp if commit0Timestamp > commit1Timestamp else commit1Timestamp )
+
+	endDate = startDate - historySpan
+	for index in (commit0Index, commit1Index):
+		if index.getFirstTimestamp():
+			endDate = max( endDate, datetime.date.fromtimestamp( index.getFirstTimestamp() ) )
+	return startDate, min( endDate, startDate )
+
+def computeDiffHistory( baseCommit, compareCommit, directory, refs, historyLen, historySpan ):
+	"""Diffs the directory on the days either branch changed it, up to historyLen points over historySpan.
+
+	The diff only changes when one of the branches changes the directory, so points in between
+	would repeat the one before them. Newest first, as (total, date, baseCommit, compareCommit, directory).
+	"""
+	commit0Index = getFirstParentIndex( baseCommit, refs )
+	commit1Index = getFirstParentIndex( compareCommit, refs )
+	startDate, endDate = getHistoryWindow( commit0Index, commit1Index, historySpan )
+
+	endTimestamp = getEndOfDayTimestamp( endDate )
+	changeDates = getDirectoryChangeDates( commit0Index, directory, endTimestamp ) | getDirectoryChangeDates( commit1Index, directory, endTimestamp )
+
+	diffList = []
+	for date in getHistoryDates( startDate, endDate, changeDates, historyLen ):
+		# the last commit of each day
+		timestamp = getEndOfDayTimestamp( date )
+		commit0 = commit0Index.commitAt( timestamp )
+		commit1 = commit1Index.commitAt( timestamp )
+		if not commit0 or not commit1:
+			break
+		diff = getBranchCommitLinesDifference( commit0, commit1, directory )
+		diffList.append( {'total':diff['total'], 'date':date, 'baseCommit':commit0, 'compareCommit':commit1, 'directory':directory } )
+
+	writeDiffHistoryToCache( diffList, baseCommit, compareCommit, directory, historyLen, historySpan )
 	
-def getBranchDiffHistory( baseCommit, compareCommit ):
-	branchDiffList = []
-	for directory in GIT_DIRECTORIES:
-		diffList = getDiffHistory( baseCommit, compareCommit, directory )
-		if not branchDiffList:
-			branchDiffList = [{'total':diff['total'], 'date':diff['date']} for diff in diffList]
-		else:
-			for x in range(len(diffList)):
-				diff = diffList[x]
-				branchDiff = branchDiffList[x]
-				branchDiff['total'] += diff['total']
+	return diffList
+
+def getHistoryTotals( history, dates ):
+	"""The total of a newest first history on each of the newest first 'dates'.
+
+	A date between two points has the total of the point before it, the diff did not change in
+	between. Dates before the first point have None.
+	"""
+	totals = []
+	x = 0
+	for date in dates:
+		while x < len(history) and history[x]['date'] > date:
+			x += 1
+		totals.append( history[x]['total'] if x < len(history) else None )
+	return totals
+
+def getHistoriesDates( histories ):
+	"""Every date of any of the histories, newest first."""
+	dates = set()
+	for history in histories:
+		dates.update( [point['date'] for point in history] )
+	return sorted( dates, reverse=True )
+	
+def getBranchDiffHistory( baseCommit, compareCommit, refs=None, cachedHistories=None ):
+	"""The directories' histories of compareCommit against baseCommit added up."""
+	if cachedHistories is None:
+		cachedHistories = getDiffHistoriesFromCache( baseCommit, [compareCommit], GIT_DIRECTORIES, GIT_HISTORY_LEN, GIT_HISTORY_SPAN )
+
+	return addHistories( [getDiffHistory( baseCommit, compareCommit, directory, refs, cachedHistories ) for directory in GIT_DIRECTORIES] )
+
+def addHistories( histories ):
+	"""The histories added up on every date any of them has a point, newest first."""
+	dates = getHistoriesDates( histories )
+	branchDiffList = [{'total':0, 'date':date} for date in dates]
+	for history in histories:
+		totals = getHistoryTotals( history, dates )
+		for x in range(len(dates)):
+			if totals[x] is not None:
+				branchDiffList[x]['total'] += totals[x]
 		
 	return branchDiffList
 	
+# ------------------- Timelines ----------------------------------------------------------------------------------
+# The configured branches keep a timeline against each other for each directory in the store. As a tip moves
+# only the days from its old tip on are diffed, the other points are kept for good and rolled up as they age.
+def getTimelineBranches():
+	"""The branches that keep timelines."""
+	branches = list(GIT_BRANCHES)
+	if GIT_DEFAULT_BASEBRANCH not in branches:
+		branches.append( GIT_DEFAULT_BASEBRANCH )
+	return branches
+
+def getTimelineBranch( name, refs ):
+	"""The branch keeping timelines that 'name' stands for, by its name or as its tip, or None."""
+	branches = getTimelineBranches()
+	if name in branches:
+		return name
+	commit = refs.resolve( name )
+	for branch in branches:
+		if commit and refs.getTip( branch ) == commit:
+			return branch
+	return None
+
+def isTimelineCurrent( timeline, baseCommit, compareCommit, endDate ):
+	return (timeline is not None and timeline['baseCommit'] == baseCommit and timeline['compareCommit'] == compareCommit
+			and timeline['firstDate'] <= endDate)
+
+def getChangeDatesBetween( indexes, directory, fromDate, toDate ):
+	"""The days after fromDate and before toDate any of the first-parent indexes changed 'directory' on."""
+	dates = set()
+	for index in indexes:
+		dates.update( [date for date in getDirectoryChangeDates( index, directory, getEndOfDayTimestamp( fromDate ) ) if date < toDate] )
+	return dates
+
+def updateTimeline( baseBranch, compareBranch, directory, refs ):
+	"""Brings the stored timeline of a directory up to the tips of the branches, and back to the start of the history span.
+
+	Only the days from the old tip of a branch that moved on are diffed, and the days it is missing before its first point.
+	A timeline whose tips are no longer on the branches was rewritten, it starts over.
+	"""
+	options = GIT_DIFF_OPTIONS
+	baseCommit = refs.getCommit( baseBranch )
+	compareCommit = refs.getCommit( compareBranch )
+	indexes = (getFirstParentIndex( baseCommit, refs ), getFirstParentIndex( compareCommit, refs ))
+	startDate, endDate = getHistoryWindow( indexes[0], indexes[1], GIT_HISTORY_SPAN )
+
+	timeline = diffStore.getTimelines( baseBranch, [compareBranch], [directory], options ).get( (compareBranch, directory) )
+	if isTimelineCurrent( timeline, baseCommit, compareCommit, endDate ):
+		return timeline
+	if timeline is not None and (indexes[0].find( timeline['baseCommit'] ) < 0 or indexes[1].find( timeline['compareCommit'] ) < 0):
+		diffStore.deleteTimeline( timeline['id'] )
+		timeline = None
+
+	if timeline is None:
+		firstDate = endDate
+		lastDate = startDate
+		dates = set( [startDate, endDate] ) | getChangeDatesBetween( indexes, directory, endDate, startDate )
+	else:
+		firstDate = min( endDate, timeline['firstDate'] )
+		lastDate = max( startDate, timeline['lastDate'] )
+		dates = set()
+		# a branch that moved changes the points from the day of its old tip on
+		movedDates = []
+		for index, oldTip, tip in ((indexes[0], timeline['baseCommit'], baseCommit), (indexes[1], timeline['compareCommit'], compareCommit)):
+			if oldTip != tip:
+				movedDates.append( datetime.date.fromtimestamp( index.fromCommit( oldTip ).getTimestamp() ) )
+		if movedDates:
+			movedDate = max( min( movedDates ), firstDate )
+			dates.update( [movedDate, startDate, lastDate] )
+			dates.update( getChangeDatesBetween( indexes, directory, movedDate, lastDate ) )
+		if endDate < timeline['firstDate']:
+			dates.add( endDate )
+			dates.update( getChangeDatesBetween( indexes, directory, endDate, timeline['firstDate'] ) )
+
+	points = []
+	for date in sorted( dates, reverse=True ):
+		# the last commit of each day
+		timestamp = getEndOfDayTimestamp( date )
+		commit0 = indexes[0].commitAt( timestamp )
+		commit1 = indexes[1].commitAt( timestamp )
+		if not commit0 or not commit1:
+			continue
+		diff = getBranchCommitLinesDifference( commit0, commit1, directory )
+		points.append( {'total':diff['total'], 'date':date, 'baseCommit':commit0, 'compareCommit':commit1} )
+
+	diffStore.putTimelinePoints( points, baseBranch, compareBranch, directory, options, firstDate, lastDate, baseCommit, compareCommit )
+	return timeline
+
+def getTimelineHistory( points, startDate, endDate, historyLen, directory ):
+	"""A history out of a timeline's newest first points, on the days getHistoryDates() keeps from startDate back to endDate.
+
+	A day without a point of its own, like endDate, gets the one before it.
+	"""
+	history = []
+	x = 0
+	for date in getHistoryDates( startDate, endDate, [point['date'] for point in points], historyLen ):
+		while x < len(points) and points[x]['date'] > date:
+			x += 1
+		if x == len(points):
+			break
+		point = dict( points[x] )
+		point['date'] = date
+		point['directory'] = directory
+		history.append( point )
+	return history
+
+def updateTimelines( baseBranch, compareBranches, directories, refs ):
+	"""Brings the stored timelines of the compare branches against baseBranch up to the tips on the worker pool.
+
+	Returns the timelines as diffStore.getTimelines() does, and the history window of each compare branch.
+	"""
+	rollupTimelinesIfDue()
+	options = GIT_DIFF_OPTIONS
+	baseCommit = refs.getCommit( baseBranch )
+	timelines = diffStore.getTimelines( baseBranch, compareBranches, directories, options )
+
+	windows = {}
+	behind = []
+	for compareBranch in compareBranches:
+		compareCommit = refs.getCommit( compareBranch )
+		windows[compareBranch] = getHistoryWindow( getFirstParentIndex( baseCommit, refs ), getFirstParentIndex( compareCommit, refs ), GIT_HISTORY_SPAN )
+		for directory in directories:
+			if not isTimelineCurrent( timelines.get( (compareBranch, directory) ), baseCommit, compareCommit, windows[compareBranch][1] ):
+				behind.append( (compareBranch, directory) )
+
+	if behind:
+		def update( key ):
+			lockKey = ('timeline', baseBranch, key[0], key[1], options)
+			return computeOnce( lockKey, lambda: None, lambda: updateTimeline( baseBranch, key[0], key[1], refs ) )
+		parallelMap( update, behind )
+		timelines = diffStore.getTimelines( baseBranch, compareBranches, directories, options )
+	return timelines, windows
+
+def getTimelines( baseBranch, compareBranches, directories, refs ):
+	"""The histories of the compare branches against baseBranch in each directory, keyed by (compareBranch, directory).
+
+	The timelines behind the tips are brought up to them first, then it is one range read of the store.
+	"""
+	timelines, windows = updateTimelines( baseBranch, compareBranches, directories, refs )
+	if not timelines:
+		return {}
+	fromDate = min( [window[1] for window in windows.values()] )
+	points = diffStore.getTimelinePoints( [timeline['id'] for timeline in timelines.values()], fromDate )
+	histories = {}
+	for key, timeline in timelines.items():
+		histories[key] = getTimelineHistory( points.get( timeline['id'], [] ), timeline['lastDate'], windows[key[0]][1], GIT_HISTORY_LEN, key[1] )
+	return histories
+
+# daily totals of the timelines, see historycube.HistoryCube
+historyCube = historycube.HistoryCube( os.path.join(GIT_DIFF_CACHE_DIR, "cube") )
+
+def getTimelineVersion( baseBranch, compareBranches, directories ):
+	"""The stored timelines' ids and last updates, for ETags: backfills and rollups change a timeline under the same tips."""
+	timelines = diffStore.getTimelines( baseBranch, compareBranches, directories, GIT_DIFF_OPTIONS )
+	return ",".join( sorted( ["%d:%d" % (timeline['id'], timeline['updated']) for timeline in timelines.values()] ) )
+
+def getTimelineStamp( timeline ):
+	# a rollup only changes 'updated', the rows of the timelines it rolled up are filled again
+	return historycube.getStamp( timeline['id'], timeline['firstDate'], timeline['lastDate'], timeline['baseCommit'], timeline['compareCommit'],
+								timeline['updated'] )
+
+def getCubeMatrixTimeline( baseBranch, compareBranches, refs ):
+	"""getMatrixTimeline() out of the history cube.
+
+	Rows whose timeline moved on are filled from the store in one read, the rest is array slicing.
+	"""
+	timelines, windows = updateTimelines( baseBranch, compareBranches, GIT_DIRECTORIES, refs )
+	if not timelines:
+		return [], [[] for compareBranch in compareBranches]
+	startDate = max( [window[0] for window in windows.values()] )
+	endDate = min( [window[1] for window in windows.values()] )
+	firstDate = min( [timeline['firstDate'] for timeline in timelines.values()] + [endDate] )
+	lastDate = max( [timeline['lastDate'] for timeline in timelines.values()] + [startDate] )
+	branches = getTimelineBranches()
+	historyCube.open( branches, branches, GIT_DIRECTORIES, firstDate, lastDate )
+
+	stale = {}
+	for key, timeline in timelines.items():
+		stamp = getTimelineStamp( timeline )
+		if historyCube.getStamp( baseBranch, key[0], key[1] ) != stamp:
+			stale[ timeline['id'] ] = (key[0], key[1], stamp)
+	if stale:
+		points = diffStore.getTimelinePoints( stale.keys(), datetime.date.min )
+		historyCube.fillRows( baseBranch, [(compareBranch, directory, stamp, points.get( timelineId, [] ))
+											for timelineId, (compareBranch, directory, stamp) in stale.items()] )
+
+	totals = historyCube.getTotals( baseBranch, compareBranches, GIT_DIRECTORIES, endDate, startDate )
+	# the days any branch's total changed on, thinned like a history of each branch would be
+	changed = historycube.numpy.flatnonzero( (totals[:, 1:] != totals[:, :-1]).any( axis=0 ) ) + 1
+	changeDates = [endDate + datetime.timedelta( int(x) ) for x in changed]
+	dates = getHistoryDates( startDate, endDate, changeDates, GIT_HISTORY_LEN * len(compareBranches) )
+	branchTotals = totals[:, [(date - endDate).days for date in dates]].tolist()
+	return dates, [[None if total == historycube.MISSING else total for total in row] for row in branchTotals]
+
+def getMatrixTimeline( baseBranch, compareBranches, refs ):
+	"""The dates of the matrix timeline newest first, and the total of each compare branch on them.
+
+	A branch's total is None before its history starts.
+	"""
+	if GIT_HISTORY_CUBE and historycube.numpy is not None and baseBranch in getTimelineBranches():
+		return getCubeMatrixTimeline( baseBranch, compareBranches, refs )
+
+	histories = getBranchDiffHistories( baseBranch, compareBranches, refs )
+	# the branches change on different days, each carries its total forward to the others' dates
+	dates = getHistoriesDates( histories )
+	return dates, [getHistoryTotals( history, dates ) for history in histories]
+
+def rollupTimelines( today=None ):
+	"""Rolls the timelines' points older than GIT_TIMELINE_DAILY_DAYS up to weeks, and older than GIT_TIMELINE_WEEKLY_DAYS to months."""
+	if today is None:
+		today = datetime.date.today()
+	return diffStore.rollupTimelines( today - datetime.timedelta(GIT_TIMELINE_DAILY_DAYS), today - datetime.timedelta(GIT_TIMELINE_WEEKLY_DAYS) )
+
+lastTimelineRollup = 0 # when this process last ran rollupTimelines() from a timeline update
+timelineRollupLock = threading.Lock()
+
+def rollupTimelinesIfDue():
+	"""rollupTimelines(), if this process has not run it for GIT_TIMELINE_ROLLUP_INTERVAL seconds."""
+	global lastTimelineRollup
+	if GIT_TIMELINE_ROLLUP_INTERVAL <= 0:
+		return 0
+	timelineRollupLock.acquire()
+	try:
+		if time.time() - lastTimelineRollup < GIT_TIMELINE_ROLLUP_INTERVAL:
+			return 0
+		lastTimelineRollup = time.time()
+	finally:
+		timelineRollupLock.release()
+	try:
+		return rollupTimelines()
+	except Exception, e:
+		# the timelines are still right without it, the next interval tries again
+		print "timeline rollup failed: %s" % e
+		return 0
+
+# ------------------- Matrix ----------------------------------------------------------------------------------
+def getMatrixCells( baseCommit, compareCommits, refs=None ):
+	"""Diffs every compare commit against the base for every directory on the worker pool.
+
+	Returns one row per compare commit, each row a list of diffs in GIT_DIRECTORIES order.
+	The branch indexes are brought up to the tips in 'refs' first, so the diffs of a moved
+	branch find the cached entries of its earlier tips.
+	"""
+	if refs is not None:
+		updateBranchIndexes( refs )
+
+	# the whole matrix in one cache query, only the misses go to the pool
+	cachedDiffs = getDiffsFromCache( baseCommit, compareCommits, GIT_DIRECTORIES )
+
+	if GIT_DIFF_BUCKETED:
+		# one task per branch, each runs a single diff for all the directories
+		return parallelMap( lambda compareCommit: getBranchCommitLinesDifferences( baseCommit, compareCommit, GIT_DIRECTORIES, cachedDiffs ), compareCommits )
+
+	cells = []
+	for compareCommit in compareCommits:
+		for directory in GIT_DIRECTORIES:
+			cells.append( (baseCommit, compareCommit, directory) )
+
+	def getCell( cell ):
+		diff = cachedDiffs.get( (cell[1], cell[2]) )
+		if diff:
+			return diff
+		return getBranchCommitLinesDifference( *cell )
+
+	diffs = parallelMap( getCell, cells )
+
+	numDirectories = len(GIT_DIRECTORIES)
+	return [diffs[x:x + numDirectories] for x in range(0, len(diffs), numDirectories)]
+	
 def createDiffURL(baseCommit, compareCommit, directory):
 	url = reverse('diff') + "?bc=%s&cc=%s&dir=%s" % (baseCommit, compareCommit, directory)
 	return url
 	
-class BranchHistory( threading.Thread ):
-	def __init__ ( self, baseCommit ):
-		self.baseCommit = baseCommit
-		self.branchDiffHistory = []
+class BackgroundTask( threading.Thread ):
+	"""Runs func() on its own thread, keeping its result or the exception it raised, and when it finished."""
+	def __init__ ( self, func ):
+		self.func = gitbatch.carryForkStats( func )
+		self.result = None
+		self.error = None
+		self.finished = None
 		threading.Thread.__init__( self )
-		
-	def run ( self ):		
-		for branch in GIT_BRANCHES:
-			compareCommit = git_getCommit( branch )
-			diffList = getBranchDiffHistory( self.baseCommit, compareCommit )
-			self.branchDiffHistory.append( diffList )
-	
-def createMatrixTimelineJSon(baseBranch):
+		self.setDaemon( True )
+
+	def run ( self ):
+		try:
+			self.result = self.func()
+		except Exception, e:
+			self.error = e
+		self.finished = time.time()
+
+BACKGROUND_TASK_MAX_AGE = 600 # seconds a finished task waits for the page to ask again, before it is dropped
+
+backgroundTasks = {} # key -> BackgroundTask running, or finished and not yet collected
+backgroundTasksLock = threading.Lock()
+
+def runInBackground( key, func, timeout ):
+	"""Runs func() in the background for up to 'timeout' seconds.
+
+	Returns the finished task, or None if it is still running. A slow task is
+	not abandoned: the next call with the same key waits on it again, instead
+	of starting over. Finished tasks nobody came back for are dropped when a new one starts.
+	"""
+	backgroundTasksLock.acquire()
+	try:
+		task = backgroundTasks.get( key )
+		if task is None:
+			cutoff = time.time() - BACKGROUND_TASK_MAX_AGE
+			for oldKey, oldTask in backgroundTasks.items():
+				if oldTask.finished is not None and oldTask.finished < cutoff:
+					del backgroundTasks[oldKey]
+			task = BackgroundTask( func )
+			backgroundTasks[key] = task
+			task.start()
+	finally:
+		backgroundTasksLock.release()
+
+	task.join( timeout )
+	if task.isAlive():
+		return None
+
+	backgroundTasksLock.acquire()
+	try:
+		if backgroundTasks.get( key ) is task:
+			del backgroundTasks[key]
+	finally:
+		backgroundTasksLock.release()
+	return task
+
+def getBranchDiffHistories( baseBranch, compareBranches, refs ):
+	"""The history of every compare branch against baseBranch, out of the timeline store for the configured branches."""
+	if baseBranch in getTimelineBranches():
+		timelines = getTimelines( baseBranch, compareBranches, GIT_DIRECTORIES, refs )
+		return [addHistories( [timelines.get( (compareBranch, directory), [] ) for directory in GIT_DIRECTORIES] ) for compareBranch in compareBranches]
+
+	# the whole timeline in one cache query
+	baseCommit = refs.getCommit( baseBranch )
+	compareCommits = [refs.getCommit( branch ) for branch in compareBranches]
+	cachedHistories = getDiffHistoriesFromCache( baseCommit, compareCommits, GIT_DIRECTORIES, GIT_HISTORY_LEN, GIT_HISTORY_SPAN )
+	return [getBranchDiffHistory( baseCommit, compareCommit, refs, cachedHistories ) for compareCommit in compareCommits]
+
+def createMatrixTimeline(baseBranch, refs, points=0):
+	"""The timeline of every branch against baseBranch as getMatrixTimeline() returns it, thinned to 'points'
+	dates unless that is 0, or None if it is still being computed."""
 	print "Creating Matrix Timeline"
-	baseCommit = git_getCommit(baseBranch)
+	baseCommit = refs.getCommit(baseBranch)
+	compareCommits = [refs.getCommit( branch ) for branch in GIT_BRANCHES]
 
+	# get the history for the branches
+	task = runInBackground( ('timeline', baseBranch, baseCommit, tuple(compareCommits)),
+							lambda: getMatrixTimeline( baseBranch, GIT_BRANCHES, refs ), GIT_TIMELINE_WAIT )
+	if task is None:
+		return None
+	if task.error:
+		raise task.error
+		
+	print "successfully got timeline history"
+	dates, branchTotals = task.result
+	keep = getTimelineIndexes( dates, branchTotals, points )
+	return [dates[x] for x in keep], [[totals[x] for x in keep] for totals in branchTotals]
+
+def createMatrixTimelineTable(dates, branchTotals):
 	# create the description dictionary
 	descriptionTimeline = {"date": ("date", "Date") }
 	for branch in GIT_BRANCHES:
 		descriptionTimeline[branch] = ("number", branch);
 			
 	dataTableTimeline = gviz_api.DataTable( descriptionTimeline )
-
-	# get the history for the branches
-	if 1:
-		history = BranchHistory( baseCommit )
-		history.start()
-		history.join(5)
-		if history.isAlive():
-			return None
-	else:
-		return None  
-		
-	print "successfully got timeline history"
-	branchDiffHistory = history.branchDiffHistory		
-	
 	dataTimeline = []
-	for x in range(len(branchDiffHistory[0])):
-		item = { 'date': branchDiffHistory[0][x]['date'] }
+	for x in range(len(dates)):
+		item = { 'date': dates[x] }
 		for y in range( len(GIT_BRANCHES) ):
-			branch = branchDiffHistory[y]
-			item[ GIT_BRANCHES[y] ] = branch[x]['total']
+			item[ GIT_BRANCHES[y] ] = branchTotals[y][x]
 		dataTimeline.append( item )
 	dataTableTimeline.LoadData( dataTimeline )
+	return dataTableTimeline
 
-	timeLineColumnHeaders = tuple( ["date"] + GIT_BRANCHES )
-	
-	# Creating a JavaScript code string
-	json_timeline = dataTableTimeline.ToJSon( columns_order=timeLineColumnHeaders )	
-	return json_timeline	
-	
-# ------------------- Caching ----------------------------------------------------------------------------------
-def initcache(dir = GIT_DIFF_CACHE_DIR):
-	if not os.path.exists(dir):
-		os.makedirs(dir)
-		
-def getHexKeyForDiff( commit0, commit1, directory ):
-	key = "%s%s%s" % (commit0, commit1, directory);
-	h = hashlib.md5()
-	h.update(key)
-	hexKey = h.hexdigest()
-	return hexKey
-
-def getHexKeyForHistory( commit0, commit1, directory, historyLen, timeDelta ):
-	key = "%s%s%s%s%s" % (commit0, commit1, directory, historyLen, timeDelta );
-	h = hashlib.md5()
-	h.update(key)
-	hexKey = h.hexdigest()
-	return hexKey
-
-def getCacheDirPath( hexKey ):
-	fullCacheDir = os.path.join(GIT_DIFF_CACHE_DIR, hexKey[:2]);
-	fullCachePath = os.path.join(fullCacheDir, hexKey[2:] + ".cache");
-	return fullCacheDir, fullCachePath
-		
-def getDiffLinesFromCache( commit0, commit1, directory ):	
-	hexKey = getHexKeyForDiff( commit0, commit1, directory )
-	cacheDir, cachePath = getCacheDirPath( 	hexKey )
-	
-	diff = {}
-	if os.path.exists( cachePath ):
-		with open( cachePath, 'r' ) as f:
-			print "reading diff: '%s'" % (cachePath);
-			
-			for line in f.readlines():
-				item = line.strip().split(",")
-				if "\'int\'" in item[0]:
-					value = int_safe( item[2] )
-				else:
-					value = item[2]				
-				diff[item[1]] = value
-	return diff
-	
-def writeDiffLinesToCache( diff ):
-	hexKey = getHexKeyForDiff( diff['baseCommit'], diff['compareCommit'], diff['directory'] )
-	cacheDir, cachePath = getCacheDirPath( hexKey )
-
-	initcache( cacheDir )
-	with open( cachePath, 'w' ) as f:
-		for items in diff.items():
-			f.write( "%s,%s,%s\n" % ( str(type(items[1])), items[0], items[1] ) )
-	
-def getDiffHistoryFromCache( baseCommit, compareCommit, directory, historyLen, timeDelta ):
-	hexKey = getHexKeyForHistory( baseCommit, compareCommit, directory, historyLen, timeDelta )
-	cacheDir, cachePath = getCacheDirPath( 	hexKey )
-
-	diffList = []
-	if os.path.exists( cachePath ):
-		with open( cachePath, 'r' ) as f:
-			print "reading history: '%s'" % (cachePath);
-
-			diff = {}
-			numItems = 0
-			for line in f.readlines():			
-				item = line.strip().split(",")
-				
-				if numItems == 0:
-					numItems = int_safe( item[0] )
-					if diff:
-						diffList.append( diff )
-						diff = {}
-				else:
-					if "\'int\'" in item[0]:
-						value = int_safe( item[2] )
-					elif "\'datetime.date\'" in item[0]:
-						value = datetime.date.fromordinal( int_safe(item[2]) )
-					else:
-						value = item[2]				
-					diff[item[1]] = value
-					numItems -= 1
-					
-			if diff:
-				diffList.append( diff )
-	return diffList
-	
-def writeDiffHistoryToCache( diffList, baseCommit, compareCommit, directory, timeDelta ):
-	hexKey = getHexKeyForHistory( baseCommit, compareCommit, directory, len( diffList ), timeDelta )
-	cacheDir, cachePath = getCacheDirPath( hexKey )
+def createMatrixTable(baseBranch, refs):
+	baseCommit = refs.getCommit(baseBranch)
 
-	print "caching history: '%s'" % (cachePath);
-	
-	initcache( cacheDir )
-	with open( cachePath, 'w' ) as f:
-		for diff in diffList:
-			f.write( "%s\n" % len( diff.items() ) )	
-			for item in diff.items():
-				if type(item[1]) == datetime.date:
-					value = item[1].toordinal()
-				else:
-					value = item[1]
-				f.write( "%s,%s,%s\n" % ( str(type(item[1])), item[0], value ) )	
-					
-# ------------------- Program ----------------------------------------------------------------------------------
-def matrix(request):	
-	baseBranch = request.GET.get('bb')
-	baseBranch = GIT_DEFAULT_BASEBRANCH if not baseBranch else baseBranch
-	baseCommit = git_getCommit(baseBranch)
-
-    # Creating the data
 	urlcolumns = []
 	description = {"branch": ("string", "Branch"), "total": ("number", "Total") }
 	for x in range(len(GIT_DIRECTORIES)):
@@ -371,15 +1290,16 @@ def matrix(request):
 		description["url" + str(x)] = ("string", "url")
 		urlcolumns.append( "url" + str(x) )
 	
+	compareCommits = [refs.getCommit( branch ) for branch in GIT_BRANCHES]
+	matrixCells = getMatrixCells( baseCommit, compareCommits, refs )
+
 	data = []	
-	for branch in GIT_BRANCHES:
-		compareCommit = git_getCommit( branch )
-		row = { "branch": branch }
+	for y in range(len(GIT_BRANCHES)):
+		row = { "branch": GIT_BRANCHES[y] }
 		total = 0
 		for x in range(len(GIT_DIRECTORIES)):
-			directory = GIT_DIRECTORIES[x]
-			branchDiff = getBranchCommitLinesDifference( baseCommit, compareCommit, directory )
-			row[directory] = branchDiff['total']			
+			branchDiff = matrixCells[y][x]
+			row[GIT_DIRECTORIES[x]] = branchDiff['total']			
 			row["url" + str(x)] = createDiffURL(branchDiff['baseCommit'], branchDiff['compareCommit'], branchDiff['directory'])
 			total += branchDiff['total']
 		row["total"] = total
@@ -390,35 +1310,35 @@ def matrix(request):
 	data_table.LoadData(data)
 	
 	columnHeaders = tuple( ["branch"] + GIT_DIRECTORIES + urlcolumns + ["total"] )
+	return data_table, columnHeaders
 
-	# Creating a JavaScript code string
-	json_table = data_table.ToJSon(columns_order=columnHeaders, order_by="branch")	
-	
-	# History Timeline
-	json_timeline = createMatrixTimelineJSon( baseBranch )
-	
-	rendered = render_to_string('index.html', { 'json_table': json_table,
-												'json_timeline': json_timeline,
-												'numDirectories': len(GIT_DIRECTORIES),
-												'branches': GIT_BRANCHES,
-												'baseBranch': baseBranch })
-	
-	return HttpResponse( rendered )
-	
-def diff(request):
-	baseCommit = request.GET.get('bc')
-	compareCommit = request.GET.get('cc')
-	directory = request.GET.get('dir')
-	
-	baseBranch = git_getBranch(baseCommit)
-	compareBranch = git_getBranch(compareCommit)
-	commitInfo = git_getCommitInfo( compareCommit )
-	
-	diffHistory = getDiffHistory(baseCommit, compareCommit, directory)
-	
-	filesDiff = getBranchFilesDifference(baseCommit, compareCommit, directory)
-	
-	# Loading it into gviz_api.DataTable
+def createDiffTimeline(baseCommit, compareCommit, directory, refs, points=0):
+	"""The history of one directory of compareCommit against baseCommit thinned to 'points' unless that is 0,
+	or None if it is still being computed.
+
+	Commits that are the tips of two configured branches read the branches' timeline.
+	"""
+	baseBranch = getTimelineBranch( baseCommit, refs )
+	compareBranch = getTimelineBranch( compareCommit, refs )
+	if baseBranch and compareBranch:
+		task = runInBackground( ('history', baseBranch, compareBranch, refs.getCommit( baseBranch ), refs.getCommit( compareBranch ), directory),
+								lambda: getTimelines( baseBranch, [compareBranch], [directory], refs ).get( (compareBranch, directory), [] ), GIT_TIMELINE_WAIT )
+	else:
+		task = runInBackground( ('history', baseCommit, compareCommit, directory),
+								lambda: getDiffHistory( baseCommit, compareCommit, directory, refs ), GIT_TIMELINE_WAIT )
+	if task is None:
+		return None
+	if task.error:
+		raise task.error
+	diffHistory = task.result
+	return [diffHistory[x] for x in getTimelineIndexes( [diff['date'] for diff in diffHistory], [[diff['total'] for diff in diffHistory]], points )]
+
+def getDiffTimelineTitle(diff):
+	diffURL = createDiffURL( diff['baseCommit'], diff['compareCommit'], diff['directory'] )
+	shortLog = git_getShortLog( diff['compareCommit'] )
+	return "<a href=%s>%s</a>" % (diffURL, shortLog)
+
+def createDiffTimelineTable(diffHistory):
 	description = {"date": ("date", "Date"),
 					"total": ("number", "Lines of Difference"),
 					"title0": ("string", "title0"),
@@ -427,26 +1347,746 @@ def diff(request):
 	
 	data = []
 	for diff in diffHistory:
-		diffURL = createDiffURL( diff['baseCommit'], diff['compareCommit'], diff['directory'] )
-		shortLog = git_getShortLog( diff['compareCommit'] )
-		title = "<a href=%s>%s</a>" % (diffURL, shortLog)
-		data.append( { 'date': diff['date'], 'total': diff['total'], "title0": title } )
+		data.append( { 'date': diff['date'], 'total': diff['total'], "title0": getDiffTimelineTitle( diff ) } )
 	data_table.LoadData( data )
+	return data_table
+
+# ------------------- Timeline Payloads ----------------------------------------------------------------------------------
+# A timeline page asks for about as many points as it is pixels wide, longer timelines are thinned with
+# Largest-Triangle-Three-Buckets, which keeps the peaks and dips an even stride would drop. With fmt=compact
+# they go out as delta encoded integer arrays instead of a gviz table, static/timeline.js turns them into one.
+COMPACT_CONTENT_TYPE = "application/json"
+COMPACT_EPOCH = datetime.date(1970, 1, 1)
+
+def getTimelinePointCount(request):
+	"""The 'points' a request asks a timeline to be thinned to, 0 to keep them all."""
+	points = int_safe( request.GET.get('points', "0") )
+	if points <= 0:
+		return 0
+	points = (points + GIT_TIMELINE_POINTS_STEP - 1) // GIT_TIMELINE_POINTS_STEP * GIT_TIMELINE_POINTS_STEP
+	return min( points, GIT_TIMELINE_MAX_POINTS )
+
+def getLTTBIndexes(xs, series, threshold):
+	"""The indexes of the 'threshold' points Largest-Triangle-Three-Buckets keeps of 'series', lists of values over the ascending xs.
+
+	The first and last points stay, the ones in between are cut into threshold - 2 buckets and each keeps the point making
+	the largest triangle with the point kept before it and the average of the next bucket. The series' areas are added up,
+	so all of them keep the same xs. None counts as 0.
+	"""
+	count = len(xs)
+	if threshold >= count or threshold < 3:
+		return range(count)
+
+	series = [[value or 0 for value in values] for values in series]
+	bucketSize = float(count - 2) / (threshold - 2)
+	indexes = [0]
+	a = 0
+	for bucket in range(threshold - 2):
+		start = int( bucket * bucketSize ) + 1
+		end = int( (bucket + 1) * bucketSize ) + 1
+		# the average of the next bucket, for the last bucket that is the last point
+		nextEnd = min( int( (bucket + 2) * bucketSize ) + 1, count )
+		nextX = float( sum( xs[end:nextEnd] ) ) / (nextEnd - end)
+		nextYs = [float( sum( values[end:nextEnd] ) ) / (nextEnd - end) for values in series]
+
+		best = start
+		bestArea = -1
+		for x in range(start, end):
+			area = 0
+			for values, nextY in zip( series, nextYs ):
+				area += abs( (xs[a] - nextX) * (values[x] - values[a]) - (xs[a] - xs[x]) * (nextY - values[a]) )
+			if area > bestArea:
+				best = x
+				bestArea = area
+		indexes.append( best )
+		a = best
+	indexes.append( count - 1 )
+	return indexes
+
+def getTimelineIndexes(dates, series, points):
+	"""The indexes of the newest first 'dates' to keep to thin a timeline to 'points', see getLTTBIndexes()."""
+	count = len(dates)
+	if not points or count <= points:
+		return range(count)
+	xs = [date.toordinal() for date in reversed( dates )]
+	indexes = getLTTBIndexes( xs, [list(reversed( values )) for values in series], points )
+	return [count - 1 - x for x in reversed( indexes )]
+
+def deltaEncode(values):
+	"""Each value as the difference to the one before it. None stays None, the value after it is taken from the last one that was not."""
+	deltas = []
+	last = 0
+	for value in values:
+		if value is None:
+			deltas.append( None )
+		else:
+			deltas.append( value - last )
+			last = value
+	return deltas
+
+def createCompactTimeline(labels, dates, series, titles=None):
+	"""A newest first timeline in the compact format, oldest first:
+
+	{"labels": [label of each series], "days": days since 1970-01-01, "series": [values of each series], "titles": [title of each day]}
+
+	with "days" and each series delta encoded. "titles" is there if there are any.
+	"""
+	timeline = { 'labels': labels,
+				'days': deltaEncode( [(date - COMPACT_EPOCH).days for date in reversed( dates )] ),
+				'series': [deltaEncode( list(reversed( values )) ) for values in series] }
+	if titles is not None:
+		timeline['titles'] = list(reversed( titles ))
+	return timeline
+
+def createCompactResponse(request, timeline, etag):
+	content = json.dumps( dict( timeline, status="ok" ), separators=(",", ":") )
+	return createPageResponse( request, etag, putCachedPage( etag, COMPACT_CONTENT_TYPE, content ) )
+
+def createCompactError(reason, message):
+	"""What createDataSourceError() is to a gviz table, for a compact timeline."""
+	content = json.dumps( { 'status': "error", 'reason': reason, 'message': message } )
+	return HttpResponse( content, content_type=COMPACT_CONTENT_TYPE )
+
+# ------------------- Data Source ----------------------------------------------------------------------------------
+# The pages load their tables from these with google.visualization.Query, see
+# http://code.google.com/apis/visualization/documentation/dev/implementing_data_source.html
+DATA_SOURCE_CONTENT_TYPES = { "json": "text/javascript", "html": "text/html", "csv": "text/csv" }
+
+def parseTqx(tqx):
+	options = {}
+	for option in tqx.split(";"):
+		if ":" in option:
+			name, value = option.split(":", 1)
+			options[name] = value
+	return options
+
+def createDataSourceResponse(request, dataTable, columns_order=None, order_by=(), etag=None):
+	"""The table as the request's tqx asks for it, streamed, and kept in the page cache under 'etag' if there is one."""
+	tqx = request.GET.get('tqx', "")
+	out = parseTqx( tqx ).get( "out", "json" )
+	try:
+		chunks = dataTable.IterResponse( columns_order, order_by, tqx )
+	except gviz_api.DataTableException, e:
+		return createDataSourceError( request, "not_supported", str(e) )
+
+	# rows go out as they are written, large tables start arriving straight away
+	contentType = DATA_SOURCE_CONTENT_TYPES.get( out, "text/plain" )
+	if etag is None:
+		return HttpResponse( bufferChunks( chunks ), content_type=contentType )
+	return setCacheHeaders( HttpResponse( bufferChunks( streamCachedPage( etag, contentType, chunks ) ), content_type=contentType ), etag )
+
+def createDataSourceError(request, reason, message):
+	"""A json response the Query reports through response.isError() and getReasons()."""
+	tqx = parseTqx( request.GET.get('tqx', "") )
+	responseHandler = tqx.get( "responseHandler", "google.visualization.Query.setResponse" )
+	content = "%s({'version':'0.5', 'reqId':'%s', 'status':'error', 'errors':[{'reason':%s, 'message':%s}]});" % (
+				responseHandler, tqx.get( "reqId", 0 ), gviz_api.DataTable.SingleValueToJS( reason, "string" ),
+				gviz_api.DataTable.SingleValueToJS( message, "string" ))
+	return HttpResponse( content, content_type=DATA_SOURCE_CONTENT_TYPES["json"] )
 	
-	# Creating a JavaScript code string
-	json = data_table.ToJSon(columns_order=("date", "total", "title0", "text0"))		
+# ------------------- Caching ----------------------------------------------------------------------------------
+def initcache(dir = GIT_DIFF_CACHE_DIR):
+	if not os.path.exists(dir):
+		os.makedirs(dir)
+		
+def getLockPath( key ):
+	h = hashlib.md5()
+	h.update( repr(key) )
+	hexKey = h.hexdigest()
+	return os.path.join(GIT_DIFF_CACHE_DIR, "locks", hexKey[:2], hexKey[2:] + ".lock")
+
+def computeOnce( key, lookup, compute ):
+	"""Runs compute() for 'key' in one thread of one process at a time.
+
+	Call after a cache miss. Whoever waited for the lock first tries lookup(),
+	which returns None if the result is still not cached.
+	"""
+	lock = FileLock( getLockPath( key ) )
+	lock.acquire()
+	try:
+		result = lookup()
+		if result is None:
+			result = compute()
+		return result
+	finally:
+		lock.release()
+
+# every diff and history result lives in one SQLite database, opened on first use
+diffStore = diffstore.DiffStore( os.path.join(GIT_DIFF_CACHE_DIR, GIT_DIFF_CACHE_DB) )
+
+# parsed results in front of the store, keyed by commit and tree shas so they never go stale
+memoryCache = LRUCache( GIT_MEMORY_CACHE_ENTRIES, GIT_MEMORY_CACHE_BYTES )
+
+def printCacheStats(name):
+	stats = memoryCache.getStats()
+	print "%s: memory cache %d entries, %d bytes, %d hits, %d misses, %d evictions" % (name, stats['entries'], stats['bytes'],
+																						stats['hits'], stats['misses'], stats['evictions'])
+
+# the tree git hashes for a directory that does not exist, comparing against it counts every line as added or deleted
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+def getDirectoryTrees( commits, directories ):
+	"""The tree of every directory in every commit, keyed by (commit, directory).
+
+	Resolved with one cat-file batch for everything the memory cache does not know.
+	A directory missing from a commit has the empty tree, a commit that does not exist has None.
+	"""
+	trees = {}
+	names = []
+	for commit in commits:
+		for directory in directories:
+			if not commit:
+				trees[ (commit, directory) ] = None
+				continue
+			tree = memoryCache.get( ('tree', commit, directory) )
+			if tree is None:
+				names.append( (commit, directory) )
+			else:
+				trees[ (commit, directory) ] = tree
+
+	if names:
+		# the commits go in the same batch, a path is only missing from a commit that exists
+		commits = list( set( [commit for commit, directory in names] ) )
+		shas = gitBatch.revParseMany( ["%s:%s" % (commit, directory.rstrip("/")) for commit, directory in names] +
+										["%s^{commit}" % commit for commit in commits] )
+		existing = set( [commits[x] for x in range(len(commits)) if shas[len(names) + x]] )
+		for key, sha in zip( names, shas ):
+			if sha:
+				tree = sha
+			elif key[0] in existing:
+				tree = EMPTY_TREE
+			else:
+				trees[key] = None
+				continue
+			memoryCache.put( ('tree',) + key, tree )
+			trees[key] = tree
+	return trees
+
+def getDiffsFromCache( commit0, commit1List, directories ):
+	"""The cached diffs of commit0 against every commit in commit1List, keyed by (commit1, directory).
+
+	Diffs are stored under the trees of the directory on both sides, so every commit pair whose
+	directory trees match shares one entry, and identical trees are no difference without a lookup.
+	Results are shared with the memory cache, treat them as read only.
+	"""
+	trees = getDirectoryTrees( [commit0] + list(commit1List), directories )
+
+	diffs = {}
+	missing = {}
+	for commit1 in commit1List:
+		for directory in directories:
+			tree0 = trees[ (commit0, directory) ]
+			tree1 = trees[ (commit1, directory) ]
+			if tree0 is None or tree1 is None:
+				continue
+			if tree0 == tree1:
+				diffs[ (commit1, directory) ] = createLinesDifference( commit0, commit1, directory, 0, 0, 0 )
+				continue
+			counts = memoryCache.get( ('tree diff', tree0, tree1, GIT_DIFF_OPTIONS) )
+			if counts is None:
+				missing.setdefault( (tree0, tree1), [] ).append( (commit1, directory) )
+			else:
+				diffStore.touch( "diffs", (tree0, tree1, GIT_DIFF_OPTIONS) )
+				diffs[ (commit1, directory) ] = createLinesDifference( commit0, commit1, directory, *counts )
+
+	if missing:
+		for pair, counts in diffStore.getTreeDiffs( missing.keys(), GIT_DIFF_OPTIONS ).items():
+			memoryCache.put( ('tree diff',) + pair + (GIT_DIFF_OPTIONS,), counts )
+			for commit1, directory in missing[pair]:
+				diffs[ (commit1, directory) ] = createLinesDifference( commit0, commit1, directory, *counts )
+
+	diffStore.countLookups( "diffs", len(diffs), len(commit1List) * len(directories) - len(diffs) )
+	return diffs
+
+def getDiffLinesFromCache( commit0, commit1, directory ):	
+	return getDiffsFromCache( commit0, [commit1], [directory] ).get( (commit1, directory), {} )
+	
+def writeDiffLinesToCache( diff ):
+	writeDiffsToCache( [diff] )
+
+def writeDiffsToCache( diffs ):
+	treeDiffs = []
+	for diff in diffs:
+		trees = getDirectoryTrees( [diff['baseCommit'], diff['compareCommit']], [diff['directory']] )
+		tree0 = trees[ (diff['baseCommit'], diff['directory']) ]
+		tree1 = trees[ (diff['compareCommit'], diff['directory']) ]
+		if tree0 is None or tree1 is None or tree0 == tree1:
+			continue
+		counts = (diff['insertions'], diff['deletions'], diff['filesChanged'])
+		treeDiffs.append( (tree0, tree1) + counts )
+		memoryCache.put( ('tree diff', tree0, tree1, GIT_DIFF_OPTIONS), counts )
+	diffStore.putTreeDiffs( treeDiffs, GIT_DIFF_OPTIONS )
+
+def getBlobDiffsFromCache( blobPairs ):
+	"""The cached (insertions, deletions, binary) of every (oldBlob, newBlob) pair in blobPairs that has them."""
+	counts = {}
+	missing = []
+	for pair in set( blobPairs ):
+		count = memoryCache.get( ('blob diff',) + pair + (GIT_DIFF_OPTIONS,) )
+		if count is None:
+			missing.append( pair )
+		else:
+			diffStore.touch( "blobs", pair + (GIT_DIFF_OPTIONS,) )
+			counts[pair] = count
+
+	if missing:
+		for pair, count in diffStore.getBlobDiffs( missing, GIT_DIFF_OPTIONS ).items():
+			memoryCache.put( ('blob diff',) + pair + (GIT_DIFF_OPTIONS,), count )
+			counts[pair] = count
+
+	numPairs = len( set( blobPairs ) )
+	diffStore.countLookups( "blobs", len(counts), numPairs - len(counts) )
+	return counts
+
+def writeBlobDiffsToCache( blobDiffs ):
+	diffStore.putBlobDiffs( blobDiffs, GIT_DIFF_OPTIONS )
+	for oldBlob, newBlob, insertions, deletions, binary in blobDiffs:
+		memoryCache.put( ('blob diff', oldBlob, newBlob, GIT_DIFF_OPTIONS), (insertions, deletions, binary) )
+
+def getHistoryCacheKey( baseCommit, compareCommit, directory, historyLen, historySpan ):
+	return ('history', baseCommit, compareCommit, directory, GIT_DIFF_OPTIONS, historyLen, historySpan)
+
+def getDiffHistoriesFromCache( baseCommit, compareCommits, directories, historyLen, historySpan ):
+	"""The cached histories of baseCommit against every compare commit, keyed by (compareCommit, directory).
+
+	Results are shared with the memory cache, treat them as read only.
+	"""
+	histories = {}
+	missing = []
+	for compareCommit in compareCommits:
+		for directory in directories:
+			diffList = memoryCache.get( getHistoryCacheKey( baseCommit, compareCommit, directory, historyLen, historySpan ) )
+			if diffList is None:
+				missing.append( compareCommit )
+				break
+			histories[ (compareCommit, directory) ] = diffList
+			diffStore.touch( "histories", (baseCommit, compareCommit, directory, GIT_DIFF_OPTIONS, historyLen, diffstore.getTimeDeltaSeconds( historySpan )) )
+
+	if missing:
+		storedHistories = diffStore.getHistories( baseCommit, missing, directories, GIT_DIFF_OPTIONS, historyLen, historySpan )
+		for key, diffList in storedHistories.items():
+			memoryCache.put( getHistoryCacheKey( baseCommit, key[0], key[1], historyLen, historySpan ), diffList )
+		histories.update( storedHistories )
+
+	diffStore.countLookups( "histories", len(histories), len(compareCommits) * len(directories) - len(histories) )
+	return histories
+	
+def getDiffHistoryFromCache( baseCommit, compareCommit, directory, historyLen, historySpan ):
+	return getDiffHistoriesFromCache( baseCommit, [compareCommit], [directory], historyLen, historySpan ).get( (compareCommit, directory), [] )
+	
+def writeDiffHistoryToCache( diffList, baseCommit, compareCommit, directory, historyLen, historySpan ):
+	print "caching history: %s %s %s" % (baseCommit, compareCommit, directory);
+	diffStore.putHistory( diffList, baseCommit, compareCommit, directory, GIT_DIFF_OPTIONS, historyLen, historySpan )
+	memoryCache.put( getHistoryCacheKey( baseCommit, compareCommit, directory, historyLen, historySpan ), diffList )
+					
+# ------------------- Cache Collection ----------------------------------------------------------------------------------
+def git_getReachableCommits(refs):
+	"""Every commit reachable from the tips of the configured branches."""
+	tips = [tip for refName, tip in refs.getTips()]
+	if not tips:
+		return set()
+	return set( git_cmd("rev-list %s" % " ".join(tips)).split() )
+
+def collectCache(maxBytes=GIT_CACHE_MAX_BYTES, maxAge=GIT_CACHE_MAX_AGE, unreachable=True, vacuum=False):
+	"""Applies the age, reachability and size limits to the store, rolls up old timeline points and drops stale branch indexes.
+
+	Returns the number of entries deleted for each kind and reason.
+	"""
+	refs = RefSnapshot()
+	reachable = None
+	if unreachable and refs.getTips():
+		reachable = git_getReachableCommits( refs )
+	deleted = diffStore.collect( maxBytes, maxAge, reachable, vacuum, branches=getTimelineBranches() )
+	deleted['timeline points rolled up'] = rollupTimelines()
+
+	# lock files nobody has taken for a day
+	deleted['lock files'] = 0
+	lockDir = os.path.join(GIT_DIFF_CACHE_DIR, "locks")
+	cutoff = time.time() - 86400
+	for root, dirs, files in os.walk( lockDir ):
+		for name in files:
+			path = os.path.join( root, name )
+			try:
+				if os.path.getmtime( path ) < cutoff:
+					os.remove( path )
+					deleted['lock files'] += 1
+			except OSError:
+				pass
+
+	# indexes of branches that are no longer configured
+	deleted['branch indexes'] = 0
+	indexDir = os.path.dirname( getBranchIndexPath( "" ) )
+	if os.path.exists( indexDir ):
+		keep = set( [os.path.basename( getBranchIndexPath( refs.getRefName(branch) ) ) for branch in GIT_BRANCHES] )
+		for name in os.listdir( indexDir ):
+			if name not in keep:
+				os.remove( os.path.join( indexDir, name ) )
+				deleted['branch indexes'] += 1
+	return deleted
+
+class CacheSweeper( threading.Thread ):
+	def __init__ ( self, interval ):
+		self.interval = interval
+		threading.Thread.__init__( self )
+		self.setDaemon( True )
+
+	def run ( self ):
+		while True:
+			time.sleep( self.interval )
+			try:
+				deleted = collectCache()
+				print "cache sweep: " + ", ".join( ["%d %s" % (count, reason) for reason, count in sorted( deleted.items() )] )
+			except Exception, e:
+				print "cache sweep failed: %s" % e
+
+if GIT_CACHE_SWEEP_INTERVAL > 0:
+	CacheSweeper( GIT_CACHE_SWEEP_INTERVAL ).start()
+
+# ------------------- Cache Warming ----------------------------------------------------------------------------------
+# hooks/post-receive queues pushed refs in the store, 'manage.py warmcache' takes them and runs warmCache()
+NULL_COMMIT = "0" * 40
+
+def getPushedBranches(updates):
+	"""The configured branches moved or created by (oldCommit, newCommit, ref) updates."""
+	branches = []
+	for oldCommit, newCommit, ref in updates:
+		if newCommit == NULL_COMMIT or not ref.startswith( "refs/heads/" ):
+			# deleted, or a tag
+			continue
+		branch = ref[len("refs/heads/"):]
+		if branch in GIT_BRANCHES and branch not in branches:
+			branches.append( branch )
+	return branches
+
+def warmCache(branches):
+	"""Computes the matrix cells and timelines a page view would ask for after 'branches' moved.
+
+	Every row with a moved branch as the base is filled, and the moved branches'
+	cells in every other row. Returns the number of (base, compare) pairs warmed.
+	"""
+	if GIT_USE_REMOTE_BRANCH:
+		git_cmd("fetch origin")
+	refs = RefSnapshot()
+
+	warmed = 0
+	for baseBranch in getTimelineBranches():
+		compareBranches = GIT_BRANCHES if baseBranch in branches else branches
+		baseCommit = refs.getCommit( baseBranch )
+		compareCommits = [refs.getCommit( branch ) for branch in compareBranches]
+		if not baseCommit or not compareCommits:
+			continue
+
+		getMatrixCells( baseCommit, compareCommits, refs )
+		getMatrixTimeline( baseBranch, compareBranches, refs )
+		warmed += len(compareCommits)
+
+	diffStore.flush()
+	return warmed
+					
+# ------------------- HTTP Caching ----------------------------------------------------------------------------------
+# Every page and table is a function of the commits it shows and the settings below, so their hash is a strong
+# ETag. A refresh of an unchanged repository costs the one for-each-ref of the RefSnapshot and a 304.
+def getPageVersion():
+	"""Hash of the modification times of this module and the templates, so a deploy changes every ETag."""
+	appDir = os.path.dirname( os.path.abspath( __file__ ) )
+	templateDir = os.path.join( appDir, "templates" )
+	paths = [os.path.join( appDir, "views.py" ), os.path.join( appDir, "gviz_api.py" )]
+	if os.path.exists( templateDir ):
+		paths += [os.path.join( templateDir, name ) for name in sorted( os.listdir( templateDir ) )]
+	h = hashlib.md5()
+	for path in paths:
+		if os.path.exists( path ):
+			h.update( "%s %d\n" % (path, os.path.getmtime( path )) )
+	return h.hexdigest()
+
+pageVersion = getPageVersion()
+
+def createETag(*parts):
+	key = [pageVersion, GIT_DIFF_OPTIONS, ",".join( GIT_BRANCHES ), ",".join( GIT_DIRECTORIES ),
+			str(GIT_HISTORY_LEN), str(GIT_HISTORY_SPAN)] + [str(part) for part in parts]
+	h = hashlib.md5()
+	h.update( "\0".join( key ) )
+	return '"%s"' % h.hexdigest()
+
+def createRefsETag(refs, *parts):
+	"""ETag of a response that depends on the tips of the configured branches."""
+	tips = ["%s %s" % tip for tip in refs.getTips()]
+	return createETag( *(tips + list(parts)) )
+
+def isNotModified(request, etag):
+	ifNoneMatch = request.META.get( 'HTTP_IF_NONE_MATCH' )
+	if not ifNoneMatch:
+		return False
+	tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+	return etag in tags or "*" in tags
+
+def setCacheHeaders(response, etag):
+	response['ETag'] = etag
+	response['Cache-Control'] = "private, max-age=%d, must-revalidate" % GIT_HTTP_MAX_AGE
+	return response
+
+def createNotModified(etag):
+	return setCacheHeaders( HttpResponseNotModified(), etag )
+
+# ------------------- Page Cache ----------------------------------------------------------------------------------
+# Rendered pages, tables and fragments stored gzipped under their ETag, clients that accept gzip get the stored bytes
+def gzipString(data):
+	buffer = cStringIO.StringIO()
+	f = gzip.GzipFile( mode="wb", fileobj=buffer )
+	try:
+		f.write( data )
+	finally:
+		f.close()
+	return buffer.getvalue()
+
+def gunzipString(data):
+	f = gzip.GzipFile( mode="rb", fileobj=cStringIO.StringIO( data ) )
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+def getCachedPage(key):
+	"""(contentType, gzipped body) of a cached page, None if there is none."""
+	page = memoryCache.get( ('page', key) )
+	if page is not None:
+		diffStore.touch( "pages", (key,) )
+	else:
+		page = diffStore.getPage( key )
+		if page is not None:
+			memoryCache.put( ('page', key), page )
+	diffStore.countLookups( "pages", page is not None and 1 or 0, page is None and 1 or 0 )
+	return page
+
+def storeCachedPage(key, page):
+	diffStore.putPage( key, page[0], page[1] )
+	memoryCache.put( ('page', key), page )
+
+def putCachedPage(key, contentType, content):
+	if isinstance( content, unicode ):
+		content = content.encode( "utf-8" )
+	page = (contentType, gzipString( content ))
+	storeCachedPage( key, page )
+	return page
+
+def streamCachedPage(key, contentType, chunks):
+	"""Yields 'chunks' encoded, compressing them on the way, and caches the page once the last one is out.
+
+	A page whose chunks raise is not cached.
+	"""
+	buffer = cStringIO.StringIO()
+	f = gzip.GzipFile( mode="wb", fileobj=buffer )
+	for chunk in chunks:
+		if isinstance( chunk, unicode ):
+			chunk = chunk.encode( "utf-8" )
+		f.write( chunk )
+		yield chunk
+	f.close()
+	storeCachedPage( key, (contentType, buffer.getvalue()) )
+
+PAGE_CHUNK_BYTES = 64 * 1024
+
+def bufferChunks(chunks, size=PAGE_CHUNK_BYTES):
+	"""Joins small chunks, such as the rows of a table, into writes of about 'size' bytes."""
+	pending = []
+	pendingBytes = 0
+	for chunk in chunks:
+		pending.append( chunk )
+		pendingBytes += len(chunk)
+		if pendingBytes >= size:
+			yield "".join( pending )
+			pending = []
+			pendingBytes = 0
+	if pending:
+		yield "".join( pending )
+
+def createPageResponse(request, etag, page):
+	contentType, body = page
+	if "gzip" in request.META.get( 'HTTP_ACCEPT_ENCODING', "" ):
+		response = HttpResponse( body, content_type=contentType )
+		response['Content-Encoding'] = "gzip"
+	else:
+		response = HttpResponse( gunzipString( body ), content_type=contentType )
+	response['Vary'] = "Accept-Encoding"
+	return setCacheHeaders( response, etag )
+
+def getCachedFragment(key, render):
+	"""The fragment cached under 'key', rendered by render() on a miss."""
+	page = getCachedPage( key )
+	if page is None:
+		page = putCachedPage( key, "text/html", render() )
+	return gunzipString( page[1] ).decode( "utf-8" )
+
+# ------------------- Program ----------------------------------------------------------------------------------
+# matrix() and diff() return the page straight away, the pages then load their tables from the data views below
+def matrix(request):	
+	baseBranch = request.GET.get('bb')
+	baseBranch = GIT_DEFAULT_BASEBRANCH if not baseBranch else baseBranch
+
+	# the page itself shows no commits
+	etag = createETag( "matrix", baseBranch )
+	if isNotModified( request, etag ):
+		return createNotModified( etag )
+	page = getCachedPage( etag )
+	if page is None:
+		rendered = render_to_string('index.html', { 'numDirectories': len(GIT_DIRECTORIES),
+													'branches': GIT_BRANCHES,
+													'baseBranch': baseBranch })
+		page = putCachedPage( etag, "text/html; charset=utf-8", rendered )
+	return createPageResponse( request, etag, page )
+
+def matrixData(request):
+	forkStats = gitbatch.startForkStats()
+	baseBranch = request.GET.get('bb')
+	baseBranch = GIT_DEFAULT_BASEBRANCH if not baseBranch else baseBranch
+	refs = RefSnapshot()
+
+	etag = createRefsETag( refs, "matrix data", refs.getCommit( baseBranch ), request.GET.get('tqx', "") )
+	if isNotModified( request, etag ):
+		return createNotModified( etag )
+	page = getCachedPage( etag )
+	if page is not None:
+		return createPageResponse( request, etag, page )
+
+	data_table, columnHeaders = createMatrixTable( baseBranch, refs )
+	response = createDataSourceResponse( request, data_table, columns_order=columnHeaders, order_by="branch", etag=etag )
+
+	git_printForkStats( "matrix data", forkStats )
+	printCacheStats( "matrix data" )
+	diffStore.flush()
+	return response
+
+def matrixTimeline(request):
+	forkStats = gitbatch.startForkStats()
+	baseBranch = request.GET.get('bb')
+	baseBranch = GIT_DEFAULT_BASEBRANCH if not baseBranch else baseBranch
+	refs = RefSnapshot()
+
+	points = getTimelinePointCount( request )
+	compact = request.GET.get('fmt') == "compact"
+	def createTimelineETag():
+		timelineVersion = ""
+		if baseBranch in getTimelineBranches():
+			timelineVersion = getTimelineVersion( baseBranch, GIT_BRANCHES, GIT_DIRECTORIES )
+		return createRefsETag( refs, "matrix timeline", refs.getCommit( baseBranch ), request.GET.get('tqx', ""), points, compact, timelineVersion )
+	etag = createTimelineETag()
+	if isNotModified( request, etag ):
+		return createNotModified( etag )
+	page = getCachedPage( etag )
+	if page is not None:
+		return createPageResponse( request, etag, page )
+
+	timeline = createMatrixTimeline( baseBranch, refs, points )
+	if timeline is not None:
+		# bringing the timelines up changes their version, the response goes out under the one it was read at
+		etag = createTimelineETag()
+	if timeline is None:
+		message = "Generating Timeline, please try again in a moment..."
+		if compact:
+			response = createCompactError( "timeout", message )
+		else:
+			response = createDataSourceError( request, "timeout", message )
+	elif compact:
+		dates, branchTotals = timeline
+		response = createCompactResponse( request, createCompactTimeline( GIT_BRANCHES, dates, branchTotals ), etag )
+	else:
+		timeLineColumnHeaders = tuple( ["date"] + GIT_BRANCHES )
+		response = createDataSourceResponse( request, createMatrixTimelineTable( *timeline ), columns_order=timeLineColumnHeaders, etag=etag )
+
+	git_printForkStats( "matrix timeline", forkStats )
+	printCacheStats( "matrix timeline" )
+	diffStore.flush()
+	return response
+	
+def diff(request):
+	forkStats = gitbatch.startForkStats()
+	baseCommit = request.GET.get('bc')
+	compareCommit = request.GET.get('cc')
+	directory = request.GET.get('dir')
+	
+	refs = RefSnapshot()
+
+	# the branch names shown depend on the tips, the commits may be given as names
+	etag = createRefsETag( refs, "diff", refs.resolve( baseCommit ), refs.resolve( compareCommit ), directory )
+	if isNotModified( request, etag ):
+		return createNotModified( etag )
+
+	page = getCachedPage( etag )
+	if page is not None:
+		return createPageResponse( request, etag, page )
+
+	baseBranch = git_getBranch(baseCommit, refs)
+	compareBranch = git_getBranch(compareCommit, refs)
+	commitInfo = git_getCommitInfo( compareCommit )
+
+	# the file table only depends on the commits, it outlives the page when other branches move
+	def renderFileTable():
+		filesDiff = getBranchFilesDifference(baseCommit, compareCommit, directory)
+		return render_to_string('difftable.html', { 'baseCommit': baseCommit, 
+													'compareCommit': compareCommit, 
+													'insertions': filesDiff['insertions'],
+													'deletions': filesDiff['deletions'],
+													'total': filesDiff['total'],
+													'fileList': filesDiff['fileList'] })
+	fileTableKey = createETag( "diff files", baseCommit, compareCommit, directory )
+	fileTable = getCachedFragment( fileTableKey, renderFileTable )
 	
 	rendered = render_to_string('diff.html', { 'baseCommit': baseCommit, 
 												'compareCommit': compareCommit, 
 												'baseBranch': baseBranch,
 												'compareBranch': compareBranch,
 												'directory': directory,
-												'insertions': filesDiff['insertions'],
-												'deletions': filesDiff['deletions'],
-												'total': filesDiff['total'],
-												'fileList': filesDiff['fileList'],
-												'commitInfo': commitInfo,
-												'diffHistory': diffHistory,
-												'json': json })
+												'fileTable': fileTable,
+												'commitInfo': commitInfo })
+	page = putCachedPage( etag, "text/html; charset=utf-8", rendered )
 	
-	return HttpResponse( rendered )
+	git_printForkStats( "diff", forkStats )
+	printCacheStats( "diff" )
+	diffStore.flush()
+	return createPageResponse( request, etag, page )
+
+def diffTimeline(request):
+	forkStats = gitbatch.startForkStats()
+	baseCommit = request.GET.get('bc')
+	compareCommit = request.GET.get('cc')
+	directory = request.GET.get('dir')
+	refs = RefSnapshot()
+
+	# two branch tips read the branches' stored timeline, see createDiffTimeline(), any other pair is a history of the commits
+	baseBranch = getTimelineBranch( baseCommit, refs )
+	compareBranch = getTimelineBranch( compareCommit, refs )
+	points = getTimelinePointCount( request )
+	compact = request.GET.get('fmt') == "compact"
+	def createTimelineETag():
+		source = "history"
+		if baseBranch and compareBranch:
+			source = "timeline %s %s %s" % (baseBranch, compareBranch, getTimelineVersion( baseBranch, [compareBranch], [directory] ))
+		return createETag( "diff timeline", refs.resolve( baseCommit ), refs.resolve( compareCommit ), directory, request.GET.get('tqx', ""), points, compact, source )
+	etag = createTimelineETag()
+	if isNotModified( request, etag ):
+		return createNotModified( etag )
+	page = getCachedPage( etag )
+	if page is not None:
+		return createPageResponse( request, etag, page )
+
+	diffHistory = createDiffTimeline( baseCommit, compareCommit, directory, refs, points )
+	if diffHistory is not None and baseBranch and compareBranch:
+		# bringing the timeline up changes its version, the response goes out under the one it was read at
+		etag = createTimelineETag()
+	if diffHistory is None:
+		message = "Generating Timeline, please try again in a moment..."
+		if compact:
+			response = createCompactError( "timeout", message )
+		else:
+			response = createDataSourceError( request, "timeout", message )
+	elif compact:
+		timeline = createCompactTimeline( ["Lines of Difference"], [diff['date'] for diff in diffHistory], [[diff['total'] for diff in diffHistory]],
+										[getDiffTimelineTitle( diff ) for diff in diffHistory] )
+		response = createCompactResponse( request, timeline, etag )
+	else:
+		response = createDataSourceResponse( request, createDiffTimelineTable( diffHistory ), columns_order=("date", "total", "title0", "text0"), etag=etag )
+
+	git_printForkStats( "diff timeline", forkStats )
+	printCacheStats( "diff timeline" )
+	diffStore.flush()
+	return response